@@ -1,16 +1,22 @@
-import csv
 import datetime
 import html
 import os
-import re
-import threading
-from glob import glob
 
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
+import registry_server
+import scan_registry
+import scan_storage
 from app_helper import show_app_dev_info
+from scan_registry import (
+    clean_scanner_input,
+    detect_courier,
+    detect_courier_series,
+    parse_scanner_input,
+    parse_scanner_segments,
+)
 
 
 # =========================================================
@@ -208,25 +214,33 @@ section[data-testid="stSidebar"] hr {
 # =========================================================
 # APPLICATION CONFIGURATION
 # =========================================================
+#
+# Registry, storage and barcode format settings live in
+# scan_registry.py.
+
+# Bump when registry/loading/validation behavior changes.
+# The registry already loaded in this process is reused and
+# only reconciled with the data files (refresh()); a change
+# to scan_registry.py itself reloads it from scratch.
+REGISTRY_CACHE_VERSION = "5.27.0"
+
+# Shown with invalid scans; the formats come from
+# couriers.json (see courier_rules.py).
+CHARSET_LABELS = {
+    "digits": "digit",
+    "alphanumeric": "huruf/angka",
+    "letters": "huruf",
+}
 
-DATA_DIR = "data"
-
-SHOPEE_PREFIX = "SPXID06"
-SHOPEE_DIGITS = 10
-SHOPEE_LENGTH = 17
-
-JNT_PREFIX = "J"
-JNT_REMAINING_CHARS = 11
-JNT_LENGTH = 12
-
-ANTERAJA_PREFIX = "1"
-ANTERAJA_LENGTH = 14
-
-# Bump when registry/loading/validation behavior changes so
-# Streamlit does not reuse an older cached registry instance.
-REGISTRY_CACHE_VERSION = "5.0.0"
-
-os.makedirs(DATA_DIR, exist_ok=True)
+SUPPORTED_FORMATS_HTML = "".join(
+    html.escape(
+        f"{rule.name}: {rule.prefix} + "
+        f"{rule.length - len(rule.prefix)} "
+        f"{CHARSET_LABELS[rule.charset]}"
+    )
+    + "<br>"
+    for rule in scan_registry.COURIERS.rules
+)
 
 
 # =========================================================
@@ -519,6 +533,25 @@ div[data-testid="stTextInput"] input:focus {
     margin-bottom: 15px;
 }
 
+.rejected-pill {
+    display: inline-block;
+
+    padding: 5px 11px;
+
+    border-radius: 14px;
+
+    font-size: 0.78rem;
+    font-weight: 650;
+
+    background: rgba(245, 158, 11, 0.11);
+
+    border:
+        1px solid rgba(245, 158, 11, 0.35);
+
+    margin-top: -7px;
+    margin-bottom: 15px;
+}
+
 
 /* ---------------------------------------------------------
    SECTION
@@ -752,603 +785,6 @@ def play_sound(status):
         )
 
 
-# =========================================================
-# BARCODE VALIDATION + COURIER DETECTION
-# =========================================================
-
-SHOPEE_PATTERN = re.compile(
-    rf"^{re.escape(SHOPEE_PREFIX)}"
-    rf"\d{{{SHOPEE_DIGITS}}}$"
-)
-
-JNT_PATTERN = re.compile(
-    rf"^{re.escape(JNT_PREFIX)}"
-    rf"[A-Z0-9]{{{JNT_REMAINING_CHARS}}}$"
-)
-
-ANTERAJA_PATTERN = re.compile(
-    rf"^{re.escape(ANTERAJA_PREFIX)}"
-    rf"\d{{{ANTERAJA_LENGTH - 1}}}$"
-)
-
-
-def detect_courier(barcode):
-    """
-    Return the courier name for a supported barcode.
-
-    Format yang didukung:
-
-    Shopee SPX
-        SPXID06 + exactly 10 digits
-        Total length: 17
-
-    J&T Express
-        Starts with J
-        12 characters total
-        Remaining characters may be A-Z or 0-9
-
-    AnterAja
-        14 digits total, starting with 1
-    """
-
-    if barcode is None:
-        return None
-
-    barcode = (
-        str(barcode)
-        .strip()
-        .upper()
-    )
-
-    if SHOPEE_PATTERN.fullmatch(
-        barcode
-    ):
-        return "Shopee SPX"
-
-    if JNT_PATTERN.fullmatch(
-        barcode
-    ):
-        return "J&T Express"
-
-    if ANTERAJA_PATTERN.fullmatch(
-        barcode
-    ):
-        return "AnterAja"
-
-    return None
-
-
-def is_valid_barcode(barcode):
-    """
-    True only for a supported courier barcode.
-    """
-
-    return (
-        detect_courier(
-            barcode
-        )
-        is not None
-    )
-
-
-# =========================================================
-# SCANNER INPUT PARSER
-# =========================================================
-
-def parse_scanner_input(raw_input):
-    """
-    Parse one or more physical scanner reads.
-
-    The USB scanner can occasionally place rapid scans
-    together before Streamlit reruns. Because each courier
-    has a known prefix and fixed length, the input can be
-    safely split from left to right.
-
-    Supported blocks:
-        Shopee SPX : 17 chars, starts SPXID06
-        J&T        : 12 chars, starts J, A-Z / 0-9
-        AnterAja   : 14 digits, starts 1
-
-    Any unknown character, incomplete block, or invalid
-    barcode causes the complete scanner event to be rejected.
-    """
-
-    if raw_input is None:
-        return []
-
-    cleaned = re.sub(
-        r"\s+",
-        "",
-        str(raw_input),
-    ).upper()
-
-    if not cleaned:
-        return []
-
-    barcodes = []
-    position = 0
-    input_length = len(
-        cleaned
-    )
-
-    while position < input_length:
-
-        remaining = cleaned[
-            position:
-        ]
-
-        barcode = None
-
-
-        # -------------------------------------------------
-        # SHOPEE SPX
-        # -------------------------------------------------
-
-        if remaining.startswith(
-            SHOPEE_PREFIX
-        ):
-
-            if len(
-                remaining
-            ) < SHOPEE_LENGTH:
-                return []
-
-            candidate = remaining[
-                :SHOPEE_LENGTH
-            ]
-
-            if not SHOPEE_PATTERN.fullmatch(
-                candidate
-            ):
-                return []
-
-            barcode = candidate
-
-
-        # -------------------------------------------------
-        # J&T EXPRESS
-        # -------------------------------------------------
-
-        elif remaining.startswith(
-            JNT_PREFIX
-        ):
-
-            if len(
-                remaining
-            ) < JNT_LENGTH:
-                return []
-
-            candidate = remaining[
-                :JNT_LENGTH
-            ]
-
-            if not JNT_PATTERN.fullmatch(
-                candidate
-            ):
-                return []
-
-            barcode = candidate
-
-
-        # -------------------------------------------------
-        # ANTERAJA
-        # -------------------------------------------------
-
-        elif remaining.startswith(
-            ANTERAJA_PREFIX
-        ):
-
-            if len(
-                remaining
-            ) < ANTERAJA_LENGTH:
-                return []
-
-            candidate = remaining[
-                :ANTERAJA_LENGTH
-            ]
-
-            if not ANTERAJA_PATTERN.fullmatch(
-                candidate
-            ):
-                return []
-
-            barcode = candidate
-
-
-        # -------------------------------------------------
-        # UNKNOWN / UNSUPPORTED
-        # -------------------------------------------------
-
-        else:
-            return []
-
-
-        barcodes.append(
-            barcode
-        )
-
-        position += len(
-            barcode
-        )
-
-
-    return barcodes
-
-
-# =========================================================
-# BARCODE REGISTRY
-# =========================================================
-
-class BarcodeRegistry:
-    """
-    Fast shared registry.
-
-    Duplicate lookup:
-        O(1)
-
-    Storage:
-        daily CSV
-
-    Duplicate IDs never reach CSV writing.
-    """
-
-    def __init__(self):
-
-        self.lock = threading.RLock()
-
-        # barcode -> first successful timestamp
-        self.codes = {}
-
-        self.current_day = (
-            datetime.date.today()
-            .isoformat()
-        )
-
-        # Successful records for today only.
-        self.today_records = []
-
-        self._load_existing_data()
-
-
-    # =====================================================
-    # LOAD EXISTING DATA
-    # =====================================================
-
-    def _load_existing_data(self):
-
-        today = (
-            datetime.date.today()
-            .isoformat()
-        )
-
-        csv_files = sorted(
-            glob(
-                os.path.join(
-                    DATA_DIR,
-                    "*.csv",
-                )
-            )
-        )
-
-        for csv_file in csv_files:
-
-            file_date = os.path.splitext(
-                os.path.basename(csv_file)
-            )[0]
-
-            try:
-
-                with open(
-                    csv_file,
-                    "r",
-                    newline="",
-                    encoding="utf-8",
-                ) as file:
-
-                    reader = csv.reader(file)
-
-                    for row in reader:
-
-                        if len(row) < 2:
-                            continue
-
-                        stored_value = str(
-                            row[0]
-                        ).strip()
-
-                        timestamp = str(
-                            row[1]
-                        ).strip()
-
-                        # Also understands older accidentally
-                        # merged records.
-                        parsed_barcodes = (
-                            parse_scanner_input(
-                                stored_value
-                            )
-                        )
-
-                        if not parsed_barcodes:
-                            continue
-
-                        for barcode in parsed_barcodes:
-
-                            # Keep first successful occurrence.
-                            if barcode not in self.codes:
-
-                                self.codes[
-                                    barcode
-                                ] = timestamp
-
-                            if file_date == today:
-
-                                self.today_records.append(
-                                    (
-                                        barcode,
-                                        timestamp,
-                                    )
-                                )
-
-            except Exception:
-                continue
-
-
-    # =====================================================
-    # MIDNIGHT HANDLING
-    # =====================================================
-
-    def ensure_current_day(self):
-
-        today = (
-            datetime.date.today()
-            .isoformat()
-        )
-
-        if self.current_day == today:
-            return
-
-        with self.lock:
-
-            if self.current_day == today:
-                return
-
-            self.current_day = today
-            self.today_records = []
-
-
-    # =====================================================
-    # PROCESS SCAN BATCH
-    # =====================================================
-
-    def process_batch(self, barcodes):
-        """
-        Process rapid scans under one lock.
-
-        Duplicate checking happens BEFORE file writing.
-
-        Therefore:
-        - duplicates are never stored
-        - invalid scans are never stored
-        """
-
-        self.ensure_current_day()
-
-        results = []
-
-        with self.lock:
-
-            today = (
-                datetime.date.today()
-                .isoformat()
-            )
-
-            today_csv = os.path.join(
-                DATA_DIR,
-                f"{today}.csv",
-            )
-
-            rows_to_write = []
-
-            new_records = []
-
-            # IDs first seen inside this same scan event.
-            batch_new_codes = {}
-
-
-            # -------------------------------------------------
-            # CLASSIFY
-            # -------------------------------------------------
-
-            for barcode in barcodes:
-
-                # =============================================
-                # PREVIOUSLY STORED DUPLICATE
-                # =============================================
-
-                if barcode in self.codes:
-
-                    results.append(
-                        {
-                            "status": "duplicate",
-                            "barcode": barcode,
-                            "timestamp": self.codes[
-                                barcode
-                            ],
-                        }
-                    )
-
-                    continue
-
-
-                # =============================================
-                # DUPLICATE WITHIN SAME RAPID BATCH
-                # =============================================
-
-                if barcode in batch_new_codes:
-
-                    results.append(
-                        {
-                            "status": "pending_duplicate",
-                            "barcode": barcode,
-                            "timestamp": batch_new_codes[
-                                barcode
-                            ],
-                        }
-                    )
-
-                    continue
-
-
-                # =============================================
-                # SUCCESS
-                # =============================================
-
-                timestamp = (
-                    datetime.datetime.now()
-                    .isoformat()
-                )
-
-                batch_new_codes[
-                    barcode
-                ] = timestamp
-
-                rows_to_write.append(
-                    [
-                        barcode,
-                        timestamp,
-                    ]
-                )
-
-                new_records.append(
-                    (
-                        barcode,
-                        timestamp,
-                    )
-                )
-
-                results.append(
-                    {
-                        "status": "success",
-                        "barcode": barcode,
-                        "timestamp": timestamp,
-                    }
-                )
-
-
-            # -------------------------------------------------
-            # SAVE SUCCESSFUL IDS ONLY
-            # -------------------------------------------------
-
-            if rows_to_write:
-
-                try:
-
-                    with open(
-                        today_csv,
-                        "a",
-                        newline="",
-                        encoding="utf-8",
-                    ) as csvfile:
-
-                        writer = csv.writer(
-                            csvfile
-                        )
-
-                        writer.writerows(
-                            rows_to_write
-                        )
-
-                except Exception as exc:
-
-                    for result in results:
-
-                        if result[
-                            "status"
-                        ] in (
-                            "success",
-                            "pending_duplicate",
-                        ):
-
-                            result[
-                                "status"
-                            ] = "error"
-
-                            result[
-                                "message"
-                            ] = str(exc)
-
-                    return results
-
-
-                # Memory is updated only AFTER disk write.
-                for barcode, timestamp in new_records:
-
-                    self.codes[
-                        barcode
-                    ] = timestamp
-
-                    self.today_records.append(
-                        (
-                            barcode,
-                            timestamp,
-                        )
-                    )
-
-
-            # -------------------------------------------------
-            # FINALIZE SAME-BATCH DUPLICATES
-            # -------------------------------------------------
-
-            for result in results:
-
-                if (
-                    result["status"]
-                    == "pending_duplicate"
-                ):
-
-                    result[
-                        "status"
-                    ] = "duplicate"
-
-
-        return results
-
-
-    # =====================================================
-    # TODAY'S SUCCESSFUL RECORDS
-    # =====================================================
-
-    def get_today_records(self):
-
-        self.ensure_current_day()
-
-        with self.lock:
-
-            return list(
-                self.today_records
-            )
-
-
-    # =====================================================
-    # TOTAL SUCCESSFUL SCANS
-    # =====================================================
-
-    def get_total_successful_scans(self):
-        """
-        Number of successfully accepted barcode IDs
-        across all loaded history.
-
-        Since duplicates are not stored, each entry
-        represents one successful scan.
-        """
-
-        with self.lock:
-
-            return len(
-                self.codes
-            )
-
-
 # =========================================================
 # VERSIONED STREAMLIT CACHE
 # =========================================================
@@ -1358,7 +794,16 @@ class BarcodeRegistry:
 )
 def get_barcode_registry(version):
 
-    return BarcodeRegistry()
+    # One registry server shared by every app process.
+    if scan_registry.REGISTRY_SERVER:
+
+        return registry_server.RegistryClient(
+            scan_registry.REGISTRY_SERVER
+        )
+
+    return scan_registry.live_registry(
+        warm_up=scan_registry.BACKGROUND_WARM_UP
+    )
 
 
 registry = get_barcode_registry(
@@ -1380,16 +825,30 @@ if "rapid_scan_count" not in st.session_state:
     st.session_state.rapid_scan_count = 0
 
 
+# Invalid fragments skipped in the last scanner event
+# (see scan_registry.PARTIAL_SCAN_ACCEPT).
+if "rejected_fragments" not in st.session_state:
+
+    st.session_state.rejected_fragments = []
+
+
+if "reload_report" not in st.session_state:
+
+    st.session_state.reload_report = None
+
+
 # =========================================================
 # DISPLAY TIME
 # =========================================================
 
 def format_timestamp(timestamp):
 
+    # Registry timestamps are ISO text; no format
+    # inference needed.
     try:
 
-        value = pd.to_datetime(
-            timestamp
+        value = datetime.datetime.fromisoformat(
+            str(timestamp)
         )
 
         return value.strftime(
@@ -1423,8 +882,36 @@ def barcode_submitted():
     # PARSE
     # =====================================================
 
-    barcodes = parse_scanner_input(
-        raw_input
+    if scan_registry.PARTIAL_SCAN_ACCEPT:
+
+        segments = parse_scanner_segments(
+            raw_input
+        )
+
+        barcodes = [
+            segment["text"]
+            for segment in segments
+            if segment["courier"] is not None
+        ]
+
+        rejected = [
+            segment["text"]
+            for segment in segments
+            if segment["courier"] is None
+        ]
+
+    else:
+
+        barcodes = parse_scanner_input(
+            raw_input
+        )
+
+        rejected = []
+
+    st.session_state.rejected_fragments = (
+        rejected
+        if barcodes
+        else []
     )
 
 
@@ -1434,15 +921,11 @@ def barcode_submitted():
 
     if not barcodes:
 
-        cleaned = re.sub(
-            r"\s+",
-            "",
-            str(raw_input),
-        ).upper()
-
         st.session_state.last_scan = {
             "status": "invalid",
-            "barcode": cleaned,
+            "barcode": clean_scanner_input(
+                raw_input
+            ),
         }
 
         st.session_state.rapid_scan_count = 0
@@ -1477,14 +960,52 @@ def barcode_submitted():
         len(barcodes)
     )
 
+    # Operators must notice the parcels to re-scan.
     play_sound(
-        last_result.get(
+        "invalid"
+        if rejected
+        else last_result.get(
             "status",
             "error",
         )
     )
 
 
+def void_last_scan():
+
+    last_scan = st.session_state.last_scan
+
+    if not last_scan:
+        return
+
+    result = registry.void_scan(
+        last_scan["barcode"]
+    )
+
+    if result["status"] in (
+        "not_found",
+        "not_today",
+        "invalid",
+    ):
+
+        result = {
+            "status": "error",
+            "barcode": last_scan["barcode"],
+            "message": "Barcode tidak ditemukan di pemindaian hari ini.",
+        }
+
+    st.session_state.last_scan = result
+
+    st.session_state.rapid_scan_count = 0
+
+
+def reload_data():
+
+    st.session_state.reload_report = (
+        registry.refresh()
+    )
+
+
 # =========================================================
 # SCANNER READY PANEL
 # =========================================================
@@ -1771,8 +1292,10 @@ STATUS PEMINDAIAN TERAKHIR
 
         try:
 
-            original_datetime = pd.to_datetime(
-                original_timestamp
+            original_datetime = (
+                datetime.datetime.fromisoformat(
+                    str(original_timestamp)
+                )
             )
 
             original_date = (
@@ -1881,12 +1404,50 @@ STATUS PEMINDAIAN TERAKHIR
 
 <div class="status-info">
 Format yang didukung:<br>
-Shopee SPX: SPXID06 + 10 digit<br>
-J&amp;T: 12 karakter diawali J (huruf/angka)<br>
-AnterAja: 14 digit diawali angka 1<br>
+{SUPPORTED_FORMATS_HTML}
 <strong>Tidak disimpan</strong>
 </div>
 
+</div>
+""",
+            unsafe_allow_html=True,
+        )
+
+
+    # =====================================================
+    # VOIDED
+    # =====================================================
+
+    elif status == "voided":
+
+        scan_time = format_timestamp(
+            last_scan.get(
+                "timestamp",
+                "",
+            )
+        )
+
+        st.markdown(
+            f"""
+<div class="status-card status-waiting">
+
+<div class="status-label">
+STATUS PEMINDAIAN TERAKHIR
+</div>
+
+<div class="status-title">
+↩️ PEMINDAIAN DIBATALKAN
+</div>
+
+<div class="status-barcode">
+{safe_barcode}
+</div>
+
+<div class="status-info">
+Dipindai {scan_time} · dihapus dari pemindaian hari ini<br>
+<strong>Barcode dapat dipindai ulang</strong>
+</div>
+
 </div>
 """,
             unsafe_allow_html=True,
@@ -1935,6 +1496,37 @@ STATUS PEMINDAIAN TERAKHIR
         )
 
 
+# Stored, but the writer could not fsync it.
+if (
+    last_scan is not None
+    and last_scan.get("sync_error")
+):
+
+    st.warning(
+        "Tersimpan, tetapi belum ditulis ke disk: "
+        f"{last_scan['sync_error']}"
+    )
+
+
+# =========================================================
+# VOID LAST SCAN
+# =========================================================
+
+# A tombstone is appended; the scan leaves today's list
+# and the duplicate check at once.
+if (
+    last_scan is not None
+    and last_scan.get("status") == "success"
+):
+
+    st.button(
+        "↩️ Batalkan pemindaian ini",
+        help="Tandai pemindaian terakhir sebagai batal, misalnya jika paket salah dipindai.",
+        on_click=void_last_scan,
+        use_container_width=True,
+    )
+
+
 # =========================================================
 # RAPID SCAN INDICATOR
 # =========================================================
@@ -1956,6 +1548,34 @@ if rapid_count > 1:
     )
 
 
+# =========================================================
+# REJECTED FRAGMENTS
+# =========================================================
+
+rejected = (
+    st.session_state.rejected_fragments
+)
+
+
+if rejected:
+
+    safe_fragments = ", ".join(
+        f"<code>{html.escape(fragment[:60])}</code>"
+        for fragment in rejected
+    )
+
+    st.markdown(
+        f"""
+<div class="rejected-pill">
+⚠️ {len(rejected)} potongan dari pemindaian terakhir bukan barcode yang valid dan dilewati:
+{safe_fragments}<br>
+Pindai ulang paket ini saja.
+</div>
+""",
+        unsafe_allow_html=True,
+    )
+
+
 # =========================================================
 # TODAY'S DATA
 # =========================================================
@@ -1972,6 +1592,211 @@ total_successful = (
 )
 
 
+# =========================================================
+# HISTORY WARM-UP PROGRESS
+# =========================================================
+
+load_progress = registry.get_load_progress()
+
+if not load_progress["done"]:
+
+    st.progress(
+        (
+            load_progress["loaded"]
+            / max(load_progress["total"], 1)
+        ),
+        text=(
+            f"Memuat riwayat pemindaian · "
+            f"{load_progress['loaded']}"
+            f"/{load_progress['total']} hari"
+        ),
+    )
+
+
+# =========================================================
+# CRASH RECOVERY REPORT
+# =========================================================
+
+recovery_report = registry.recovery_report
+
+if recovery_report:
+
+    st.warning(
+        f"Pemulihan file setelah crash: {len(recovery_report)} file memiliki ekor rusak yang dipotong. Semua baris utuh disimpan."
+    )
+
+    with st.expander(
+        "Detail",
+    ):
+
+        for report in recovery_report:
+
+            st.caption(
+                f"{os.path.basename(report['file'])}: "
+                f"{report['discarded_bytes']} byte "
+                f"dibuang, disimpan di "
+                f"{report['saved_to']}"
+            )
+
+
+# =========================================================
+# RELOAD DATA
+# =========================================================
+
+st.sidebar.button(
+    "🔄 Muat ulang data",
+    key="reload_data",
+    on_click=reload_data,
+    use_container_width=True,
+)
+
+reload_report = st.session_state.reload_report
+
+if reload_report is not None:
+
+    st.sidebar.caption(
+        f"{len(reload_report['read'])} dari "
+        f"{reload_report['checked']} hari dibaca · "
+        f"{reload_report['seconds'] * 1000:.0f} ms"
+    )
+
+
+# =========================================================
+# REGISTRY DIAGNOSTICS
+# =========================================================
+
+def format_bytes(size):
+
+    if size is None:
+        return "—"
+
+    for unit in ("B", "KB", "MB"):
+
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+
+        size /= 1024
+
+    return f"{size:.1f} GB"
+
+
+# Off by default: the figures are only gathered while the
+# panel is open.
+if st.sidebar.toggle(
+    "Diagnostik registri",
+    key="show_registry_diagnostics",
+):
+
+    diagnostics = registry.get_diagnostics()
+
+    load_stats = diagnostics["load"]
+
+    last_write = diagnostics[
+        "seconds_since_last_write"
+    ]
+
+    st.sidebar.caption(
+        f"{diagnostics['storage']} · "
+        f"{diagnostics['index']} · "
+        f"dimuat dengan {load_stats['mode']}"
+        + (
+            ""
+            if load_stats["seconds"] is None
+            else f" · {load_stats['seconds']:.2f} s"
+        )
+    )
+
+    st.sidebar.metric(
+        "Entri",
+        (
+            "—"
+            if diagnostics["entries"] is None
+            else diagnostics["entries"]
+        ),
+    )
+
+    st.sidebar.caption(
+        f"codes: "
+        f"{format_bytes(diagnostics['codes_bytes'])} · "
+        f"today_records: "
+        f"{diagnostics['today_records']} "
+        f"({format_bytes(diagnostics['today_records_bytes'])})"
+    )
+
+    st.sidebar.caption(
+        f"Baris: {load_stats['rows']} · "
+        f"Dilewati: {load_stats['skipped_rows']} · "
+        f"Tulis terakhir: "
+        + (
+            "—"
+            if last_write is None
+            else f"{last_write:.0f} s"
+        )
+    )
+
+    if diagnostics["sync_error"]:
+
+        st.sidebar.warning(
+            "fsync gagal: "
+            f"{diagnostics['sync_error']}"
+        )
+
+    if diagnostics["entries_by_courier"]:
+
+        st.sidebar.dataframe(
+            pd.DataFrame(
+                sorted(
+                    diagnostics[
+                        "entries_by_courier"
+                    ].items()
+                ),
+                columns=[
+                    "Kurir",
+                    "Entri",
+                ],
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    if load_stats["files"]:
+
+        st.sidebar.dataframe(
+            pd.DataFrame(
+                [
+                    (
+                        file_date,
+                        round(stats["seconds"] * 1000, 1),
+                        stats["rows"],
+                        stats["skipped"],
+                    )
+                    for file_date, stats in sorted(
+                        load_stats["files"].items(),
+                        reverse=True,
+                    )
+                ],
+                columns=[
+                    "Hari",
+                    "ms",
+                    "Baris",
+                    "Dilewati",
+                ],
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    cold_filter = diagnostics["cold_filter"]
+
+    if cold_filter and cold_filter["keys"]:
+
+        st.sidebar.caption(
+            f"Bloom: {cold_filter['keys']} · "
+            f"{format_bytes(cold_filter['filter_bytes'])} · "
+            f"FPR {cold_filter['estimated_fpr']:.2%}"
+        )
+
+
 # =========================================================
 # METRICS
 # =========================================================
@@ -1991,7 +1816,16 @@ with metric_col2:
 
     st.metric(
         "Total pemindaian berhasil",
-        total_successful,
+        (
+            "—"
+            if total_successful is None
+            else total_successful
+        ),
+        help=(
+            "Jumlah barcode berbeda yang tersimpan di "
+            "seluruh riwayat, tanpa pemindaian yang "
+            "dibatalkan."
+        ),
     )
 
 
@@ -2024,19 +1858,21 @@ if records:
     )
 
 
-    df_today["Kurir"] = (
-        df_today["Barcode_ID"]
-        .map(
-            detect_courier
-        )
-        .fillna(
-            "Unknown"
-        )
+    df_today["Kurir"] = detect_courier_series(
+        df_today["Barcode_ID"],
+        "Unknown",
     )
 
 
+    # Imported scans may carry a UTC offset; show every
+    # scan in the wall-clock time it was taken.
     df_today["Timestamp"] = pd.to_datetime(
-        df_today["Timestamp"],
+        df_today["Timestamp"].str.replace(
+            scan_storage.ISO_OFFSET_SUFFIX,
+            "",
+            regex=True,
+        ),
+        format="ISO8601",
         errors="coerce",
     )
 
@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import os
+
+import compact_history
+import day_manifest
+import scan_registry
+import scan_storage
+
+
+# =========================================================
+# HISTORY ARCHIVER
+# =========================================================
+#
+# Converts the files of long-closed days into compressed
+# archives (see DAY ARCHIVES in scan_storage.py):
+#
+#     python archive_history.py [--data-dir data]
+#         [--older-than DAYS] [--compression gzip|lzma]
+#
+# Each day is normalized as compact_history.py does (one
+# barcode per record, voided scans dropped, unparsable
+# values saved under data/recovered/), written as
+# data/<date>.archive, read back and compared, and only
+# then are its CSV, journal and their sidecars removed.
+# The registry, the data watcher and the history pages
+# read archives like any other day file.
+# A scan stored later for an archived day turns it back
+# into a CSV (scan_storage.reopen_archive).
+#
+# Days inside the registry's in-memory window (HOT_DAYS)
+# are left alone by default, so only the cold index sees
+# the new files.
+
+ARCHIVE_AFTER_DAYS = scan_registry.HOT_DAYS or 30
+
+SIDECAR_SUFFIXES = (
+    "",
+    scan_storage.CLEAN_MARKER_SUFFIX,
+    day_manifest.MANIFEST_SUFFIX,
+)
+
+
+def archive_day(data_dir, day, compression):
+    """
+    Archive one day's files.
+
+    Returns a report dict, or None if the day is already
+    archived.
+    """
+
+    archive_path = os.path.join(
+        data_dir,
+        f"{day}{scan_storage.ARCHIVE_EXTENSION}",
+    )
+
+    source_paths = [
+        os.path.join(
+            data_dir,
+            f"{day}{extension}",
+        )
+        for extension in (
+            scan_storage.JOURNAL_EXTENSION,
+            scan_storage.CSV_EXTENSION,
+        )
+    ]
+
+    source_paths = [
+        file_path
+        for file_path in source_paths
+        if os.path.exists(file_path)
+    ]
+
+    if not source_paths:
+        return None
+
+    # The journal is the complete record when there is
+    # one; its CSV is only an export.
+    source_path = source_paths[0]
+
+    rows = scan_storage.read_scan_rows(
+        source_path
+    )
+
+    # Left over from an earlier run interrupted before the
+    # sources were removed, or a day copied in again.
+    if os.path.exists(archive_path):
+
+        rows = scan_storage.read_archive(
+            archive_path
+        ) + rows
+
+    records, unparsed = compact_history.normalize_rows(
+        rows
+    )
+
+    records = list(
+        dict.fromkeys(records)
+    )
+
+    report = {
+        "day": day,
+        "source": source_path,
+        "rows": len(rows),
+        "records": len(records),
+        "unparsed": len(unparsed),
+        "saved_to": None,
+        "bytes_before": sum(
+            os.path.getsize(file_path)
+            for file_path in source_paths
+        ),
+        "bytes_after": 0,
+    }
+
+    if unparsed:
+
+        report["saved_to"] = compact_history.save_unparsed(
+            source_path,
+            unparsed,
+        )
+
+    scan_storage.write_archive(
+        archive_path,
+        records,
+        compression,
+    )
+
+    if sorted(
+        scan_storage.read_archive(archive_path)
+    ) != sorted(records):
+
+        raise RuntimeError(
+            f"{archive_path} does not read back as "
+            "written; the day files were kept."
+        )
+
+    scan_storage.write_clean_mark(
+        archive_path
+    )
+
+    for file_path in source_paths:
+
+        for suffix in SIDECAR_SUFFIXES:
+
+            try:
+
+                os.remove(
+                    f"{file_path}{suffix}"
+                )
+
+            except FileNotFoundError:
+                continue
+
+    report["bytes_after"] = os.path.getsize(
+        archive_path
+    )
+
+    return report
+
+
+def archive_history(
+    data_dir=scan_registry.DATA_DIR,
+    older_than=ARCHIVE_AFTER_DAYS,
+    compression=scan_storage.ARCHIVE_COMPRESSION,
+):
+    """
+    Archive every day closed more than older_than days
+    ago.
+
+    Returns the list of reports for archived days.
+    """
+
+    cutoff = (
+        datetime.date.today()
+        - datetime.timedelta(
+            days=older_than
+        )
+    ).isoformat()
+
+    reports = []
+
+    # No app instance appends while files are replaced.
+    with scan_storage.DataDirLock(data_dir):
+
+        for day in scan_storage.list_day_files(
+            data_dir
+        ):
+
+            if day >= cutoff:
+                continue
+
+            report = archive_day(
+                data_dir,
+                day,
+                compression,
+            )
+
+            if report is not None:
+                reports.append(report)
+
+    return reports
+
+
+# =========================================================
+# COMMAND LINE
+# =========================================================
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Convert the scan files of long-closed days "
+            "into compressed archives with a block index."
+        )
+    )
+
+    parser.add_argument(
+        "--data-dir",
+        default=scan_registry.DATA_DIR,
+    )
+
+    parser.add_argument(
+        "--older-than",
+        type=int,
+        default=ARCHIVE_AFTER_DAYS,
+        help=(
+            "archive days closed more than this many "
+            f"days ago (default: {ARCHIVE_AFTER_DAYS})"
+        ),
+    )
+
+    parser.add_argument(
+        "--compression",
+        choices=sorted(scan_storage.ARCHIVE_CODECS),
+        default=scan_storage.ARCHIVE_COMPRESSION,
+    )
+
+    args = parser.parse_args()
+
+    reports = archive_history(
+        args.data_dir,
+        args.older_than,
+        args.compression,
+    )
+
+    for report in reports:
+
+        line = (
+            f"{report['day']}: "
+            f"{report['records']} records, "
+            f"{report['bytes_before']} -> "
+            f"{report['bytes_after']} bytes"
+        )
+
+        if report["unparsed"]:
+
+            line += (
+                f", {report['unparsed']} unparsed saved to "
+                f"{report['saved_to']}"
+            )
+
+        print(line)
+
+    print(
+        f"{len(reports)} day(s) archived."
+    )
+
+
+if __name__ == "__main__":
+    main()
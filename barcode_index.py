@@ -0,0 +1,1297 @@
+import datetime
+
+import numpy as np
+
+import courier_rules
+
+
+# =========================================================
+# COMPACT BARCODE INDEX
+# =========================================================
+#
+# Drop-in replacement for the registry's
+#     {barcode: ISO timestamp}
+# dict.
+#
+# Every courier format in couriers.json has a fixed
+# structure (prefix, length, charset), so each barcode of
+# a format packs losslessly into one 64-bit integer: the
+# characters after the prefix read as a base-10 (digits)
+# or base-36 (letters, alphanumeric) number. With the
+# default formats:
+#
+#     Shopee SPX   SPXID06 + 10 digits   -> the 10 digits
+#     AnterAja     1 + 13 digits         -> the 13 digits
+#     J&T Express  J + 11 base-36 chars  -> base-36 value
+#
+# A barcode belongs to the format courier_rules would
+# detect for it, so formats of the same length never mix.
+# Formats whose body does not fit in VALUE_BITS bits, and
+# barcodes that match no format, fall back to a plain
+# dict.
+#
+# Each format gets its own open-addressing hash set backed
+# by two int64 numpy columns: the encoded barcode and the
+# first scan time as int64 microseconds since the epoch.
+# That is about 16 bytes per slot instead of the 150+ bytes
+# of a str -> str dict entry. Single scans go through the
+# arrays one slot at a time; whole day files are encoded
+# and inserted with vectorized numpy passes
+# (CompactBarcodeIndex.update_records).
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+ONE_MICROSECOND = datetime.timedelta(
+    microseconds=1
+)
+
+EMPTY_SLOT = -1
+
+# Stored for timestamps that are not naive ISO strings;
+# the original text is kept in a small side dict.
+UNPARSED_TIMESTAMP = -(2 ** 63)
+
+MAX_LOAD_FACTOR = 0.8
+
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+HASH_MASK = (1 << 64) - 1
+
+# Encoded barcodes stay below 2 ** VALUE_BITS, so the cold
+# index can keep a format tag in the bits above.
+VALUE_BITS = 57
+
+# Format tags 1..MAX_CODECS fit in the remaining bits.
+MAX_CODECS = 63
+
+# Code point tests of the courier_rules charsets, on the
+# ASCII characters only.
+CHARSET_TESTS = {
+    "digits": lambda chars: (
+        (chars >= ord("0"))
+        & (chars <= ord("9"))
+    ),
+    "alphanumeric": lambda chars: (
+        (
+            (chars >= ord("0"))
+            & (chars <= ord("9"))
+        )
+        | (
+            (chars >= ord("A"))
+            & (chars <= ord("Z"))
+        )
+    ),
+    "letters": lambda chars: (
+        (chars >= ord("A"))
+        & (chars <= ord("Z"))
+    ),
+}
+
+_BASE36_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Digit positions of YYYY-MM-DDTHH:MM:SS.ffffff; the
+# fraction is zeroed for the form without one.
+TIMESTAMP_DIGITS = [
+    0, 1, 2, 3,
+    5, 6,
+    8, 9,
+    11, 12,
+    14, 15,
+    17, 18,
+    20, 21, 22, 23, 24, 25,
+]
+
+# Indexed by month; February gains a day in leap years.
+MONTH_DAYS = np.array(
+    [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+)
+
+
+# =========================================================
+# BARCODE CODECS
+# =========================================================
+
+class BarcodeCodec:
+    """
+    int64 packing of the barcodes of one courier rule.
+    """
+
+    def __init__(self, rule, number):
+
+        self.rule = rule
+        self.number = number
+
+        self.prefix = rule.prefix
+        self.width = rule.length - len(rule.prefix)
+
+        self.radix = (
+            10
+            if rule.charset == "digits"
+            else 36
+        )
+
+        # Place values of the body characters.
+        self.powers = self.radix ** np.arange(
+            self.width - 1,
+            -1,
+            -1,
+            dtype=np.int64,
+        )
+
+
+    @staticmethod
+    def fits(rule):
+
+        radix = (
+            10
+            if rule.charset == "digits"
+            else 36
+        )
+
+        return (
+            radix ** (rule.length - len(rule.prefix))
+            <= 2 ** VALUE_BITS
+        )
+
+
+    def encode(self, barcode):
+        """
+        Key of a barcode already matched to this rule.
+        """
+
+        return int(
+            barcode[len(self.prefix):],
+            self.radix,
+        )
+
+
+    def encode_chars(self, chars):
+        """
+        Keys of matched barcodes given as a code point
+        matrix of the characters after the prefix.
+        """
+
+        digits = chars.astype(np.int64) - ord("0")
+
+        if self.radix == 36:
+
+            letters = digits > 9
+
+            digits[letters] -= ord("A") - ord("0") - 10
+
+        return digits @ self.powers
+
+
+    def decode(self, value):
+
+        if self.radix == 10:
+            return f"{self.prefix}{value:0{self.width}d}"
+
+        characters = []
+
+        for _ in range(self.width):
+
+            value, remainder = divmod(value, 36)
+
+            characters.append(
+                _BASE36_DIGITS[remainder]
+            )
+
+        return self.prefix + "".join(
+            reversed(characters)
+        )
+
+
+class BarcodeCodecs:
+    """
+    The codecs of every courier rule of a CourierMatcher
+    that fits in VALUE_BITS.
+    """
+
+    def __init__(self, matcher):
+
+        self.matcher = matcher
+
+        self.codecs = []
+
+        # rule -> codec
+        self.by_rule = {}
+
+        for rule in matcher.rules:
+
+            if (
+                len(self.codecs) >= MAX_CODECS
+                or not BarcodeCodec.fits(rule)
+            ):
+                continue
+
+            codec = BarcodeCodec(
+                rule,
+                len(self.codecs),
+            )
+
+            self.codecs.append(codec)
+
+            self.by_rule[rule] = codec
+
+        # The order CourierMatcher.match_at() tries the
+        # rules of one length in: longest prefix first,
+        # then file order.
+        self.rule_order = sorted(
+            matcher.rules,
+            key=lambda rule: -len(rule.prefix),
+        )
+
+        self.lengths = sorted(
+            {
+                codec.rule.length
+                for codec in self.codecs
+            }
+        )
+
+        # Stored with persisted keys (snapshot, cold
+        # index): keys written under other formats are
+        # not readable.
+        self.signature = [
+            [
+                codec.rule.name,
+                codec.rule.prefix,
+                codec.rule.length,
+                codec.rule.charset,
+            ]
+            for codec in self.codecs
+        ]
+
+
+    def encode(self, barcode):
+        """
+        (codec, key) for one barcode, or (None, None).
+        """
+
+        rule = self.matcher.match_at(
+            barcode,
+            0,
+            len(barcode),
+        )
+
+        if rule is None or not barcode.isascii():
+            return None, None
+
+        codec = self.by_rule.get(rule)
+
+        if codec is None:
+            return None, None
+
+        return codec, codec.encode(barcode)
+
+
+    def encode_many(self, barcodes):
+        """
+        encode() for a sequence of barcodes at once.
+
+        Returns (codec numbers, keys) as int64 arrays;
+        number -1 where encode() gives None.
+        """
+
+        count = len(barcodes)
+
+        numbers = np.full(
+            count,
+            -1,
+            dtype=np.int64,
+        )
+
+        keys = np.zeros(
+            count,
+            dtype=np.int64,
+        )
+
+        if not count or not self.codecs:
+            return numbers, keys
+
+        lengths = np.fromiter(
+            map(len, barcodes),
+            dtype=np.int64,
+            count=count,
+        )
+
+        # One row of code points per barcode; longer
+        # barcodes are cut, but have no codec anyway.
+        all_chars = np.array(
+            barcodes,
+            dtype=f"U{self.lengths[-1]}",
+        ).view(
+            np.uint32
+        ).reshape(
+            count,
+            self.lengths[-1],
+        )
+
+        for length in self.lengths:
+
+            positions = np.flatnonzero(
+                lengths == length
+            )
+
+            if not len(positions):
+                continue
+
+            chars = all_chars[positions, :length]
+
+            # Non-ASCII barcodes stay in the dict, as in
+            # encode().
+            undecided = (chars < 128).all(axis=1)
+
+            for rule in self.rule_order:
+
+                if rule.length != length:
+                    continue
+
+                prefix_length = len(rule.prefix)
+
+                matched = (
+                    undecided
+                    & (
+                        chars[:, :prefix_length]
+                        == np.array(
+                            [
+                                ord(character)
+                                for character in rule.prefix
+                            ],
+                            dtype=np.uint32,
+                        )
+                    ).all(axis=1)
+                    & CHARSET_TESTS[rule.charset](
+                        chars[:, prefix_length:]
+                    ).all(axis=1)
+                )
+
+                undecided &= ~matched
+
+                codec = self.by_rule.get(rule)
+
+                if codec is None:
+                    continue
+
+                rows = np.flatnonzero(matched)
+
+                numbers[positions[rows]] = codec.number
+
+                keys[positions[rows]] = codec.encode_chars(
+                    chars[rows, prefix_length:]
+                )
+
+        return numbers, keys
+
+
+# Compiled once per process from couriers.json.
+CODECS = BarcodeCodecs(
+    courier_rules.COURIERS
+)
+
+
+# =========================================================
+# TIMESTAMP CODEC
+# =========================================================
+
+def encode_timestamp(timestamp):
+    """
+    Naive ISO timestamp -> int64 microseconds since the
+    epoch.
+
+    Returns None for text that is not an ISO timestamp,
+    and for timestamps with a UTC offset, which would not
+    decode back to the same text.
+    """
+
+    try:
+
+        value = datetime.datetime.fromisoformat(
+            str(timestamp)
+        )
+
+    except ValueError:
+        return None
+
+    if value.tzinfo is not None:
+        return None
+
+    return (
+        value - EPOCH
+    ) // ONE_MICROSECOND
+
+
+def encode_timestamps(timestamps):
+    """
+    encode_timestamp() for the two forms the scanner
+    writes, YYYY-MM-DDTHH:MM:SS[.ffffff], computed from
+    the digits in one vectorized pass.
+
+    Returns (values, encoded) arrays; other text is left
+    unencoded for encode_timestamp().
+    """
+
+    count = len(timestamps)
+
+    # Shorter text is padded with code point 0, longer
+    # text is cut and then rejected by its length.
+    chars = np.array(
+        timestamps,
+        dtype="U27",
+    ).view(
+        np.int32
+    ).reshape(
+        count,
+        27,
+    )
+
+    fraction = chars[:, 19] == ord(".")
+
+    encoded = (
+        (chars[:, 26] == 0)
+        & (
+            fraction
+            | (chars[:, 19] == 0)
+        )
+        & (chars[:, 4] == ord("-"))
+        & (chars[:, 7] == ord("-"))
+        & (chars[:, 10] == ord("T"))
+        & (chars[:, 13] == ord(":"))
+        & (chars[:, 16] == ord(":"))
+    )
+
+    digits = chars[:, TIMESTAMP_DIGITS] - ord("0")
+
+    digits[~fraction, 14:] = 0
+
+    encoded &= (
+        (digits >= 0)
+        & (digits <= 9)
+    ).all(axis=1)
+
+    digits = digits.astype(np.int64)
+
+    def number(first, last):
+
+        value = digits[:, first]
+
+        for column in range(first + 1, last):
+            value = value * 10 + digits[:, column]
+
+        return value
+
+    year = number(0, 4)
+    month = number(4, 6)
+    day = number(6, 8)
+    hour = number(8, 10)
+    minute = number(10, 12)
+    second = number(12, 14)
+
+    leap = (
+        (year % 4 == 0)
+        & (
+            (year % 100 != 0)
+            | (year % 400 == 0)
+        )
+    )
+
+    encoded &= (
+        (year >= 1)
+        & (month >= 1)
+        & (month <= 12)
+        & (day >= 1)
+        & (
+            day
+            <= MONTH_DAYS[np.clip(month, 0, 12)]
+            + (leap & (month == 2))
+        )
+        & (hour <= 23)
+        & (minute <= 59)
+        & (second <= 59)
+    )
+
+    # Days since the epoch of the proleptic Gregorian
+    # date, with March as the first month of the year.
+    march_year = year - (month <= 2)
+    era = march_year // 400
+    year_of_era = march_year - era * 400
+    day_of_year = (
+        153 * ((month + 9) % 12) + 2
+    ) // 5 + day - 1
+    day_of_era = (
+        year_of_era * 365
+        + year_of_era // 4
+        - year_of_era // 100
+        + day_of_year
+    )
+    days = era * 146097 + day_of_era - 719468
+
+    values = (
+        (
+            (days * 24 + hour) * 60
+            + minute
+        ) * 60
+        + second
+    ) * 1000000 + number(14, 20)
+
+    values[~encoded] = 0
+
+    return values, encoded
+
+
+def decode_timestamp(value):
+
+    return (
+        EPOCH
+        + datetime.timedelta(
+            microseconds=value
+        )
+    ).isoformat()
+
+
+# =========================================================
+# INT64 HASH MAP
+# =========================================================
+
+class Int64HashMap:
+    """
+    Open-addressing (linear probing) map of non-negative
+    int64 keys to int64 values, stored in two numpy
+    arrays.
+
+    One-key calls walk the arrays through memoryviews;
+    set_many() inserts a whole batch with vectorized probe
+    rounds.
+    """
+
+    def __init__(self, capacity=1024):
+
+        self._allocate(capacity)
+
+
+    def _allocate(self, capacity):
+
+        self.size = 0
+        self.capacity = capacity
+        self.shift = 64 - (
+            capacity.bit_length() - 1
+        )
+
+        self.keys = np.full(
+            capacity,
+            EMPTY_SLOT,
+            dtype=np.int64,
+        )
+        self.values = np.zeros(
+            capacity,
+            dtype=np.int64,
+        )
+
+        # Python ints without numpy scalar overhead.
+        self.key_slots = memoryview(self.keys)
+        self.value_slots = memoryview(self.values)
+
+
+    @classmethod
+    def from_arrays(cls, keys, values):
+        """
+        Rebuild a map from the arrays of another one (see
+        registry_snapshot.py).
+        """
+
+        capacity = len(keys)
+
+        if (
+            capacity < 1
+            or capacity & (capacity - 1)
+            or len(values) != capacity
+        ):
+            raise ValueError("not a hash map layout")
+
+        table = cls.__new__(cls)
+
+        table.capacity = capacity
+        table.shift = 64 - (
+            capacity.bit_length() - 1
+        )
+
+        table.keys = np.array(
+            keys,
+            dtype=np.int64,
+        )
+        table.values = np.array(
+            values,
+            dtype=np.int64,
+        )
+
+        table.key_slots = memoryview(table.keys)
+        table.value_slots = memoryview(table.values)
+
+        table.size = int(
+            np.count_nonzero(
+                table.keys != EMPTY_SLOT
+            )
+        )
+
+        return table
+
+
+    def _home(self, key):
+
+        return (
+            (key * HASH_MULTIPLIER) & HASH_MASK
+        ) >> self.shift
+
+
+    def _homes(self, keys):
+
+        return (
+            (
+                keys.view(np.uint64)
+                * np.uint64(HASH_MULTIPLIER)
+            )
+            >> np.uint64(self.shift)
+        ).astype(np.int64)
+
+
+    def _slot(self, key):
+
+        mask = self.capacity - 1
+
+        slot = self._home(key)
+
+        keys = self.key_slots
+
+        while True:
+
+            current = keys[slot]
+
+            if (
+                current == key
+                or current == EMPTY_SLOT
+            ):
+                return slot
+
+            slot = (slot + 1) & mask
+
+
+    def get(self, key, default=None):
+
+        slot = self._slot(key)
+
+        if self.key_slots[slot] == EMPTY_SLOT:
+            return default
+
+        return self.value_slots[slot]
+
+
+    def set(self, key, value, only_if_absent=False):
+        """
+        Store value for key.
+
+        With only_if_absent an existing value is kept and
+        returned; otherwise returns None.
+        """
+
+        slot = self._slot(key)
+
+        if self.key_slots[slot] != EMPTY_SLOT:
+
+            if only_if_absent:
+                return self.value_slots[slot]
+
+        else:
+
+            if (
+                self.size + 1
+                > self.capacity * MAX_LOAD_FACTOR
+            ):
+
+                self._resize(
+                    self.capacity * 2
+                )
+
+                slot = self._slot(key)
+
+            self.key_slots[slot] = key
+            self.size += 1
+
+        self.value_slots[slot] = value
+
+        return None
+
+
+    def set_many(self, keys, values, keep_earliest=False):
+        """
+        set(only_if_absent=True) for arrays of keys and
+        values, in order: the first value of a key wins,
+        or with keep_earliest the smallest, also over the
+        value already stored.
+
+        Returns the positions of the keys whose stored
+        value is UNPARSED_TIMESTAMP, left for the caller to
+        compare when keep_earliest is set.
+        """
+
+        # One entry per key: the first, or the smallest.
+        if keep_earliest:
+
+            order = np.lexsort(
+                (
+                    values,
+                    keys,
+                )
+            )
+
+        else:
+
+            order = np.argsort(
+                keys,
+                kind="stable",
+            )
+
+        sorted_keys = keys[order]
+
+        first = np.ones(
+            len(order),
+            dtype=bool,
+        )
+
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+
+        order = order[first]
+
+        capacity = self.capacity
+
+        while (
+            self.size + len(order)
+            > capacity * MAX_LOAD_FACTOR
+        ):
+            capacity *= 2
+
+        if capacity != self.capacity:
+            self._resize(capacity)
+
+        return order[
+            self._insert(
+                keys[order],
+                values[order],
+                keep_earliest,
+            )
+        ]
+
+
+    def _insert(self, keys, values, keep_earliest):
+        """
+        Probe all distinct keys one slot per round until
+        each finds itself or an empty slot.
+
+        Returns the positions of keys found holding
+        UNPARSED_TIMESTAMP.
+        """
+
+        mask = self.capacity - 1
+
+        slots = self._homes(keys)
+
+        pending = np.arange(len(keys))
+
+        unparsed = []
+
+        while len(pending):
+
+            pending_slots = slots[pending]
+
+            current = self.keys[pending_slots]
+
+            found = current == keys[pending]
+
+            if keep_earliest and found.any():
+
+                found_slots = pending_slots[found]
+
+                stored = self.values[found_slots]
+
+                new = values[pending[found]]
+
+                unparsed.append(
+                    pending[found][
+                        stored == UNPARSED_TIMESTAMP
+                    ]
+                )
+
+                earlier = (
+                    (new < stored)
+                    & (stored != UNPARSED_TIMESTAMP)
+                )
+
+                self.values[
+                    found_slots[earlier]
+                ] = new[earlier]
+
+            placed = found
+
+            empty = np.flatnonzero(
+                current == EMPTY_SLOT
+            )
+
+            if len(empty):
+
+                # Several keys may reach one empty slot in
+                # the same round; the first takes it.
+                _, first = np.unique(
+                    pending_slots[empty],
+                    return_index=True,
+                )
+
+                winners = empty[first]
+
+                self.keys[
+                    pending_slots[winners]
+                ] = keys[pending[winners]]
+
+                self.values[
+                    pending_slots[winners]
+                ] = values[pending[winners]]
+
+                self.size += len(winners)
+
+                placed = placed.copy()
+                placed[winners] = True
+
+            pending = pending[~placed]
+
+            slots[pending] = (slots[pending] + 1) & mask
+
+        if not unparsed:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(unparsed)
+
+
+    def delete(self, key):
+        """
+        Remove key with backward-shift deletion, so no
+        tombstone slots are left behind.
+        """
+
+        hole = self._slot(key)
+
+        keys = self.key_slots
+        values = self.value_slots
+
+        if keys[hole] == EMPTY_SLOT:
+            return False
+
+        mask = self.capacity - 1
+
+        candidate = (hole + 1) & mask
+
+        while keys[candidate] != EMPTY_SLOT:
+
+            home = self._home(
+                keys[candidate]
+            )
+
+            # Move the entry back if the hole lies between
+            # its home slot and its current slot.
+            if (
+                (candidate - home) & mask
+                >= (candidate - hole) & mask
+            ):
+
+                keys[hole] = keys[candidate]
+                values[hole] = values[candidate]
+
+                hole = candidate
+
+            candidate = (candidate + 1) & mask
+
+        keys[hole] = EMPTY_SLOT
+
+        self.size -= 1
+
+        return True
+
+
+    def _resize(self, capacity):
+
+        occupied = self.keys != EMPTY_SLOT
+
+        old_keys = self.keys[occupied]
+        old_values = self.values[occupied]
+
+        self._allocate(capacity)
+
+        self._insert(
+            old_keys,
+            old_values,
+            keep_earliest=False,
+        )
+
+
+    def items(self):
+
+        occupied = np.flatnonzero(
+            self.keys != EMPTY_SLOT
+        )
+
+        return zip(
+            self.keys[occupied].tolist(),
+            self.values[occupied].tolist(),
+        )
+
+
+    def memory_bytes(self):
+
+        return (
+            self.keys.nbytes
+            + self.values.nbytes
+        )
+
+
+# =========================================================
+# COMPACT BARCODE INDEX
+# =========================================================
+
+class CompactBarcodeIndex:
+    """
+    Mapping of barcode -> first ISO timestamp with the
+    subset of the dict interface BarcodeRegistry uses.
+
+    Barcodes without a codec (unknown formats, older
+    hand-edited data) fall back to a plain dict.
+    """
+
+    def __init__(self, codecs=None):
+
+        self.codecs = (
+            CODECS
+            if codecs is None
+            else codecs
+        )
+
+        # Codec number -> its hash map.
+        self.tables = [
+            Int64HashMap()
+            for _ in self.codecs.codecs
+        ]
+
+        # barcode -> ISO timestamp, for barcodes without a
+        # codec.
+        self.other = {}
+
+        # barcode -> original text, for timestamps that
+        # could not be encoded.
+        self.raw_timestamps = {}
+
+
+    def _locate(self, barcode):
+
+        codec, key = self.codecs.encode(barcode)
+
+        if codec is None:
+            return None, None
+
+        return self.tables[codec.number], key
+
+
+    def __contains__(self, barcode):
+
+        table, key = self._locate(barcode)
+
+        if table is None:
+            return barcode in self.other
+
+        return table.get(key) is not None
+
+
+    def get(self, barcode, default=None):
+
+        table, key = self._locate(barcode)
+
+        if table is None:
+
+            return self.other.get(
+                barcode,
+                default,
+            )
+
+        value = table.get(key)
+
+        if value is None:
+            return default
+
+        return self._decode_value(
+            barcode,
+            value,
+        )
+
+
+    def __getitem__(self, barcode):
+
+        value = self.get(barcode)
+
+        if value is None:
+            raise KeyError(barcode)
+
+        return value
+
+
+    def _store(self, barcode, timestamp, only_if_absent):
+
+        table, key = self._locate(barcode)
+
+        if table is None:
+
+            if only_if_absent:
+
+                return self.other.setdefault(
+                    barcode,
+                    timestamp,
+                )
+
+            self.other[barcode] = timestamp
+
+            return timestamp
+
+        value = encode_timestamp(timestamp)
+
+        if value is None:
+            value = UNPARSED_TIMESTAMP
+
+        existing = table.set(
+            key,
+            value,
+            only_if_absent,
+        )
+
+        if existing is not None:
+
+            return self._decode_value(
+                barcode,
+                existing,
+            )
+
+        if value == UNPARSED_TIMESTAMP:
+
+            self.raw_timestamps[
+                barcode
+            ] = timestamp
+
+        return timestamp
+
+
+    def _decode_value(self, barcode, value):
+
+        if value == UNPARSED_TIMESTAMP:
+            return self.raw_timestamps[barcode]
+
+        return decode_timestamp(value)
+
+
+    def __setitem__(self, barcode, timestamp):
+
+        self._store(
+            barcode,
+            timestamp,
+            only_if_absent=False,
+        )
+
+
+    def setdefault(self, barcode, timestamp):
+        """
+        dict.setdefault(): one lookup for the common
+        "keep the first occurrence" load path.
+        """
+
+        return self._store(
+            barcode,
+            timestamp,
+            only_if_absent=True,
+        )
+
+
+    def _add_record(self, barcode, timestamp, keep_earliest):
+
+        stored_timestamp = self.setdefault(
+            barcode,
+            timestamp,
+        )
+
+        if (
+            keep_earliest
+            and timestamp < stored_timestamp
+        ):
+            self[barcode] = timestamp
+
+
+    def update_records(self, records, keep_earliest=False):
+        """
+        setdefault() every (barcode, timestamp) record in
+        order, as the registry loads a day file; with
+        keep_earliest the earliest timestamp wins instead.
+
+        Barcodes are encoded and inserted per format in
+        vectorized passes. A file with timestamps numpy
+        does not parse for encoded barcodes goes record by
+        record, so the order of its records still decides.
+        """
+
+        if not records:
+            return
+
+        barcodes = [
+            barcode
+            for barcode, _ in records
+        ]
+        timestamps = [
+            timestamp
+            for _, timestamp in records
+        ]
+
+        numbers, keys = self.codecs.encode_many(
+            barcodes
+        )
+
+        values, encoded = encode_timestamps(
+            timestamps
+        )
+
+        packed = numbers >= 0
+
+        if (packed & ~encoded).any():
+
+            for barcode, timestamp in records:
+
+                self._add_record(
+                    barcode,
+                    timestamp,
+                    keep_earliest,
+                )
+
+            return
+
+        for position in np.flatnonzero(~packed).tolist():
+
+            self._add_record(
+                barcodes[position],
+                timestamps[position],
+                keep_earliest,
+            )
+
+        order = np.argsort(
+            numbers,
+            kind="stable",
+        )
+
+        boundaries = np.searchsorted(
+            numbers[order],
+            np.arange(len(self.tables) + 1),
+        )
+
+        for number, table in enumerate(self.tables):
+
+            rows = order[
+                boundaries[number]:boundaries[number + 1]
+            ]
+
+            if not len(rows):
+                continue
+
+            unparsed = table.set_many(
+                keys[rows],
+                values[rows],
+                keep_earliest,
+            )
+
+            # Stored as text: compared as text.
+            for position in rows[unparsed].tolist():
+
+                self._add_record(
+                    barcodes[position],
+                    timestamps[position],
+                    keep_earliest,
+                )
+
+
+    def __delitem__(self, barcode):
+
+        table, key = self._locate(barcode)
+
+        if table is None:
+
+            del self.other[barcode]
+
+            return
+
+        if not table.delete(key):
+            raise KeyError(barcode)
+
+        self.raw_timestamps.pop(
+            barcode,
+            None,
+        )
+
+
+    def __len__(self):
+
+        return (
+            sum(
+                table.size
+                for table in self.tables
+            )
+            + len(self.other)
+        )
+
+
+    def items(self):
+
+        for codec, table in zip(
+            self.codecs.codecs,
+            self.tables,
+        ):
+
+            for key, value in table.items():
+
+                barcode = codec.decode(key)
+
+                yield (
+                    barcode,
+                    self._decode_value(
+                        barcode,
+                        value,
+                    ),
+                )
+
+        yield from self.other.items()
+
+
+    def count_by_courier(self):
+
+        counts = {}
+
+        for codec, table in zip(
+            self.codecs.codecs,
+            self.tables,
+        ):
+
+            counts[codec.rule.name] = (
+                counts.get(codec.rule.name, 0)
+                + table.size
+            )
+
+        if self.other:
+            counts["Unknown"] = len(self.other)
+
+        return counts
+
+
+    def memory_bytes(self):
+        """
+        Approximate bytes held by the arrays.
+        """
+
+        return sum(
+            table.memory_bytes()
+            for table in self.tables
+        )
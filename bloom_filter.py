@@ -0,0 +1,354 @@
+import os
+import struct
+
+import numpy as np
+
+
+# =========================================================
+# BLOOM FILTER
+# =========================================================
+#
+# Bit array in front of the cold index (cold_index.py):
+# nearly every scan is a new parcel, and a filter miss
+# proves the barcode is not in the older history without
+# touching the index file. Only possible hits go on to the
+# exact lookup.
+#
+# Keys are the int64 values of cold_index.pack_barcode().
+# Each key sets HASH_COUNT bits chosen by double hashing
+# the splitmix64 mix of the key; everything is vectorized
+# with numpy, so building from a million keys takes well
+# under a second.
+#
+# File layout (little-endian):
+#     magic, bit count, key count, capacity, hash count,
+#     bits (bit_count / 8 bytes)
+
+BLOOM_MAGIC = b"DBF1"
+
+BLOOM_HEADER = struct.Struct("<QQQI")
+
+# 10 bits and 7 hashes per key: about 0.8% false positives
+# at capacity.
+BITS_PER_KEY = 10
+HASH_COUNT = 7
+
+# Filters are sized for this many times their keys, so
+# days added later fit without a rebuild.
+CAPACITY_HEADROOM = 2
+
+MIN_CAPACITY = 1024
+
+# Up to this many keys are checked in plain Python; numpy
+# only pays off for larger batches.
+SCALAR_BATCH = 8
+
+MIX_1 = 0xBF58476D1CE4E5B9
+MIX_2 = 0x94D049BB133111EB
+GOLDEN = 0x9E3779B97F4A7C15
+
+MASK_64 = (1 << 64) - 1
+
+
+def _mix(keys):
+    """
+    splitmix64 finalizer over a uint64 array.
+    """
+
+    z = keys + np.uint64(GOLDEN)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(MIX_1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(MIX_2)
+
+    return z ^ (z >> np.uint64(31))
+
+
+def _mix_one(key):
+    """
+    _mix() for one Python int.
+    """
+
+    z = (key + GOLDEN) & MASK_64
+    z = ((z ^ (z >> 30)) * MIX_1) & MASK_64
+    z = ((z ^ (z >> 27)) * MIX_2) & MASK_64
+
+    return z ^ (z >> 31)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over int64 keys.
+    """
+
+    def __init__(
+        self,
+        capacity,
+        hash_count=HASH_COUNT,
+        bits=None,
+        key_count=0,
+    ):
+
+        self.capacity = max(
+            int(capacity),
+            MIN_CAPACITY,
+        )
+        self.hash_count = hash_count
+
+        self.bit_count = (
+            (self.capacity * BITS_PER_KEY + 63)
+            // 64 * 64
+        )
+
+        if bits is None:
+
+            bits = np.zeros(
+                self.bit_count // 8,
+                dtype=np.uint8,
+            )
+
+        self.bits = bits
+
+        # Keys added; may count a key twice.
+        self.key_count = key_count
+
+
+    @classmethod
+    def from_keys(cls, keys):
+
+        bloom = cls(
+            len(keys) * CAPACITY_HEADROOM
+        )
+
+        bloom.add(keys)
+
+        return bloom
+
+
+    def _positions(self, keys):
+        """
+        [len(keys), hash_count] bit positions.
+        """
+
+        mixed = _mix(
+            np.asarray(
+                keys,
+                dtype=np.int64,
+            ).view(np.uint64)
+        )
+
+        low = mixed & np.uint64(0xFFFFFFFF)
+        high = (mixed >> np.uint64(32)) | np.uint64(1)
+
+        steps = np.arange(
+            self.hash_count,
+            dtype=np.uint64,
+        )
+
+        return (
+            low[:, None]
+            + steps[None, :] * high[:, None]
+        ) % np.uint64(self.bit_count)
+
+
+    def add(self, keys):
+
+        if not len(keys):
+            return
+
+        positions = self._positions(keys).ravel()
+
+        np.bitwise_or.at(
+            self.bits,
+            (positions >> np.uint64(3)).astype(np.intp),
+            (
+                np.uint8(1)
+                << (positions & np.uint64(7)).astype(np.uint8)
+            ),
+        )
+
+        self.key_count += len(keys)
+
+
+    def might_contain(self, keys):
+        """
+        Boolean array: False means the key is certainly
+        absent.
+        """
+
+        if not len(keys):
+
+            return np.zeros(
+                0,
+                dtype=bool,
+            )
+
+        if len(keys) <= SCALAR_BATCH:
+
+            return np.array(
+                [
+                    self._contains_one(int(key))
+                    for key in keys
+                ],
+                dtype=bool,
+            )
+
+        positions = self._positions(keys)
+
+        set_bits = (
+            self.bits[
+                (positions >> np.uint64(3)).astype(np.intp)
+            ]
+            >> (positions & np.uint64(7)).astype(np.uint8)
+        ) & np.uint8(1)
+
+        return set_bits.all(axis=1)
+
+
+    def _contains_one(self, key):
+
+        mixed = _mix_one(key & MASK_64)
+
+        low = mixed & 0xFFFFFFFF
+        high = (mixed >> 32) | 1
+
+        bits = self.bits
+
+        for step in range(self.hash_count):
+
+            position = (
+                (low + step * high) & MASK_64
+            ) % self.bit_count
+
+            if not (
+                bits[position >> 3]
+                >> (position & 7)
+            ) & 1:
+                return False
+
+        return True
+
+
+    def copy(self):
+
+        return BloomFilter(
+            self.capacity,
+            self.hash_count,
+            self.bits.copy(),
+            self.key_count,
+        )
+
+
+    def estimated_fpr(self):
+        """
+        False-positive rate expected from the share of
+        bits set.
+        """
+
+        fill = (
+            np.unpackbits(self.bits).mean()
+            if len(self.bits)
+            else 0.0
+        )
+
+        return float(fill) ** self.hash_count
+
+
+    def memory_bytes(self):
+
+        return self.bits.nbytes
+
+
+# =========================================================
+# PERSISTENCE
+# =========================================================
+
+def save_filter(path, bloom):
+    """
+    Write a filter atomically. A filter that cannot be
+    written is built again on the next start.
+    """
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+
+        with open(
+            temp_path,
+            "wb",
+        ) as file:
+
+            file.write(BLOOM_MAGIC)
+
+            file.write(
+                BLOOM_HEADER.pack(
+                    bloom.bit_count,
+                    bloom.key_count,
+                    bloom.capacity,
+                    bloom.hash_count,
+                )
+            )
+
+            file.write(
+                bloom.bits.tobytes()
+            )
+
+        os.replace(
+            temp_path,
+            path,
+        )
+
+    except OSError:
+        pass
+
+
+def load_filter(path):
+    """
+    Read a filter written by save_filter(), or None.
+    """
+
+    try:
+
+        with open(
+            path,
+            "rb",
+        ) as file:
+
+            data = file.read()
+
+    except OSError:
+        return None
+
+    prefix = len(BLOOM_MAGIC) + BLOOM_HEADER.size
+
+    if (
+        len(data) < prefix
+        or not data.startswith(BLOOM_MAGIC)
+    ):
+        return None
+
+    bit_count, key_count, capacity, hash_count = (
+        BLOOM_HEADER.unpack_from(
+            data,
+            len(BLOOM_MAGIC),
+        )
+    )
+
+    bits = np.frombuffer(
+        data,
+        dtype=np.uint8,
+        offset=prefix,
+    ).copy()
+
+    bloom = BloomFilter(
+        capacity,
+        hash_count,
+        bits,
+        key_count,
+    )
+
+    if (
+        bloom.bit_count != bit_count
+        or len(bits) * 8 != bit_count
+    ):
+        return None
+
+    return bloom
@@ -0,0 +1,676 @@
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+import barcode_index
+import bloom_filter
+
+
+# =========================================================
+# COLD BARCODE INDEX
+# =========================================================
+#
+# On-disk duplicate index for the days that have left the
+# registry's in-memory window (HOT_DAYS in
+# scan_registry.py).
+#
+# Every barcode is packed into one int64 key (courier tag
+# in the top bits, barcode_index codec value below) and
+# stored with its first scan time as int64 microseconds
+# since the epoch. The keys are sorted, so the file is
+# memory-mapped and searched with a binary search; only
+# the pages actually probed are ever read into memory.
+#
+# File layout:
+#     magic, 4-byte JSON header length, JSON header,
+#     padding to 8 bytes,
+#     keys[count], timestamps[count]   (little-endian int64)
+#
+# The JSON header records the high-water mark of every day
+# file the index was built from, so a rewritten file is
+# noticed, the courier formats the keys were packed with
+# (an index packed with other formats is rebuilt), plus
+# the rare records that cannot be packed (unknown formats,
+# unparsable timestamps).
+#
+# Each rebuild writes a new generation,
+#     data/cold_index.<generation>.bin
+# rather than replacing the file in place: Windows cannot
+# replace a file another reader still has mapped. Older
+# generations are removed once nothing maps them.
+#
+# Every generation has a Bloom filter sidecar,
+#     data/cold_index.<generation>.bin.bloom
+# (see bloom_filter.py), so a barcode that is not in the
+# older history, i.e. almost every scan, is answered
+# without reading the index file at all. A missing sidecar
+# is built again from the keys when the index is opened.
+
+COLD_INDEX_MAGIC = b"DCI1"
+
+COLD_INDEX_VERSION = 3
+
+COLD_INDEX_PREFIX = "cold_index."
+COLD_INDEX_SUFFIX = ".bin"
+
+FILTER_SUFFIX = ".bloom"
+
+# False probes every key straight against the index.
+COLD_INDEX_FILTER = True
+
+HEADER_LENGTH = struct.Struct("<I")
+
+# Courier tag bits above the codec value bits.
+TAG_SHIFT = barcode_index.VALUE_BITS
+
+INT64 = np.dtype("<i8")
+
+
+def pack_barcode(barcode):
+    """
+    Barcode -> int64 key, or None for an unknown format.
+    """
+
+    codec, value = barcode_index.CODECS.encode(
+        barcode
+    )
+
+    if codec is None:
+        return None
+
+    return ((codec.number + 1) << TAG_SHIFT) | value
+
+
+class ColdIndex:
+    """
+    Read-only, memory-mapped cold index.
+
+    An index that is missing or unreadable is empty and
+    covers no days.
+    """
+
+    def __init__(self, path=None):
+
+        self.path = path
+
+        # day -> mark of the day file it was built from.
+        self.days = {}
+
+        # barcode -> ISO timestamp, for unpacked records.
+        self.other = {}
+
+        self.keys = np.empty(
+            0,
+            dtype=INT64,
+        )
+        self.timestamps = self.keys
+
+        self.filter = None
+        self.filter_fpr = 0.0
+
+        # Lookups of packed keys since startup (carried
+        # over to newer generations by the registry).
+        self.stats = {
+            "probes": 0,
+            "passed": 0,
+            "found": 0,
+        }
+
+        try:
+
+            self._open()
+
+        except (OSError, ValueError, KeyError):
+
+            self.days = {}
+            self.other = {}
+
+
+    def _open(self):
+
+        if self.path is None:
+            return
+
+        with open(
+            self.path,
+            "rb",
+        ) as file:
+
+            prefix = file.read(
+                len(COLD_INDEX_MAGIC)
+                + HEADER_LENGTH.size
+            )
+
+            if (
+                len(prefix)
+                < len(COLD_INDEX_MAGIC) + HEADER_LENGTH.size
+                or not prefix.startswith(
+                    COLD_INDEX_MAGIC
+                )
+            ):
+                raise ValueError("not a cold index")
+
+            (header_length,) = HEADER_LENGTH.unpack(
+                prefix[len(COLD_INDEX_MAGIC):]
+            )
+
+            header = json.loads(
+                file.read(header_length)
+            )
+
+        if header["version"] != COLD_INDEX_VERSION:
+            raise ValueError("old cold index")
+
+        if (
+            header["codecs"]
+            != barcode_index.CODECS.signature
+        ):
+            raise ValueError("courier formats changed")
+
+        count = header["count"]
+
+        if count:
+
+            data = np.memmap(
+                self.path,
+                dtype=INT64,
+                mode="r",
+                offset=_data_offset(header_length),
+                shape=(2 * count,),
+            )
+
+            self.keys = data[:count]
+            self.timestamps = data[count:]
+
+        self.days = header["days"]
+        self.other = header["other"]
+
+        if COLD_INDEX_FILTER and count:
+            self._open_filter()
+
+
+    def _open_filter(self):
+
+        filter_path = f"{self.path}{FILTER_SUFFIX}"
+
+        bloom = bloom_filter.load_filter(
+            filter_path
+        )
+
+        if (
+            bloom is None
+            or bloom.key_count < len(self.keys)
+        ):
+
+            bloom = bloom_filter.BloomFilter.from_keys(
+                self.keys
+            )
+
+            bloom_filter.save_filter(
+                filter_path,
+                bloom,
+            )
+
+        self.filter = bloom
+        self.filter_fpr = bloom.estimated_fpr()
+
+
+    def __len__(self):
+
+        return len(self.keys) + len(self.other)
+
+
+    def lookup(self, barcodes):
+        """
+        Return {barcode: first ISO timestamp} for the
+        barcodes in the index.
+        """
+
+        found = {}
+
+        packed = []
+
+        for barcode in barcodes:
+
+            if barcode in self.other:
+
+                found[barcode] = self.other[barcode]
+
+                continue
+
+            key = pack_barcode(barcode)
+
+            if key is not None:
+
+                packed.append(
+                    (
+                        barcode,
+                        key,
+                    )
+                )
+
+        if not packed or not len(self.keys):
+            return found
+
+        self.stats["probes"] += len(packed)
+
+        if self.filter is not None:
+
+            # Only possible hits are searched.
+            packed = [
+                entry
+                for entry, maybe in zip(
+                    packed,
+                    self.filter.might_contain(
+                        [
+                            key
+                            for _, key in packed
+                        ]
+                    ).tolist(),
+                )
+                if maybe
+            ]
+
+            if not packed:
+                return found
+
+        self.stats["passed"] += len(packed)
+
+        probes = np.array(
+            [
+                key
+                for _, key in packed
+            ],
+            dtype=INT64,
+        )
+
+        slots = np.minimum(
+            np.searchsorted(
+                self.keys,
+                probes,
+            ),
+            len(self.keys) - 1,
+        )
+
+        for (barcode, key), slot in zip(
+            packed,
+            slots.tolist(),
+        ):
+
+            if self.keys[slot] == key:
+
+                self.stats["found"] += 1
+
+                found[barcode] = (
+                    barcode_index.decode_timestamp(
+                        int(self.timestamps[slot])
+                    )
+                )
+
+        return found
+
+
+    def filter_stats(self):
+        """
+        Size of the index and its filter, and the filter's
+        expected and observed false-positive rates.
+        """
+
+        stats = self.stats
+
+        misses = stats["probes"] - stats["found"]
+
+        return {
+            "keys": len(self.keys),
+            "filter_bytes": (
+                self.filter.memory_bytes()
+                if self.filter is not None
+                else 0
+            ),
+            "estimated_fpr": self.filter_fpr,
+            "observed_fpr": (
+                (stats["passed"] - stats["found"])
+                / misses
+                if self.filter is not None and misses
+                else None
+            ),
+            **stats,
+        }
+
+
+    def close(self):
+
+        # Dropping the views releases the mapping.
+        self.keys = np.empty(
+            0,
+            dtype=INT64,
+        )
+        self.timestamps = self.keys
+
+
+def _data_offset(header_length):
+
+    offset = (
+        len(COLD_INDEX_MAGIC)
+        + HEADER_LENGTH.size
+        + header_length
+    )
+
+    return (offset + 7) // 8 * 8
+
+
+# =========================================================
+# GENERATIONS
+# =========================================================
+
+def _generation_paths(data_dir):
+    """
+    Cold index files in data_dir, oldest first.
+    """
+
+    try:
+
+        names = os.listdir(data_dir)
+
+    except OSError:
+        return []
+
+    generations = []
+
+    for name in names:
+
+        if not (
+            name.startswith(COLD_INDEX_PREFIX)
+            and name.endswith(COLD_INDEX_SUFFIX)
+        ):
+            continue
+
+        generation = name[
+            len(COLD_INDEX_PREFIX):-len(COLD_INDEX_SUFFIX)
+        ]
+
+        if generation.isdigit():
+
+            generations.append(
+                (
+                    int(generation),
+                    os.path.join(
+                        data_dir,
+                        name,
+                    ),
+                )
+            )
+
+    return [
+        path
+        for _, path in sorted(generations)
+    ]
+
+
+def open_cold_index(data_dir):
+    """
+    Open the newest cold index in data_dir (empty if there
+    is none).
+    """
+
+    paths = _generation_paths(data_dir)
+
+    return ColdIndex(
+        paths[-1] if paths else None
+    )
+
+
+def remove_old_generations(data_dir, keep):
+    """
+    Delete every cold index except keep. Files still
+    mapped elsewhere (on Windows) are left for next time.
+    """
+
+    for path in _generation_paths(data_dir):
+
+        if path == keep:
+            continue
+
+        try:
+
+            os.remove(path)
+
+        except OSError:
+            continue
+
+        try:
+
+            os.remove(
+                f"{path}{FILTER_SUFFIX}"
+            )
+
+        except OSError:
+            pass
+
+
+# =========================================================
+# BUILDING
+# =========================================================
+
+def build_cold_index(data_dir, day_records, base=None):
+    """
+    Write a new cold index generation from
+        [(day, records, mark), ...]
+    with records as [(barcode, timestamp), ...], merged
+    into the entries of base (a ColdIndex) if given.
+
+    The earliest timestamp of every barcode wins. Returns
+    the new ColdIndex; older generations are left for
+    remove_old_generations().
+    """
+
+    keys = []
+    timestamps = []
+
+    days = {}
+    other = {}
+
+    if base is not None:
+
+        days.update(base.days)
+        other.update(base.other)
+
+    for day, records, mark in day_records:
+
+        days[day] = mark
+
+        if not records:
+            continue
+
+        barcodes = [
+            barcode
+            for barcode, _ in records
+        ]
+        day_timestamps = [
+            timestamp
+            for _, timestamp in records
+        ]
+
+        numbers, values = barcode_index.CODECS.encode_many(
+            barcodes
+        )
+
+        stamps, encoded = barcode_index.encode_timestamps(
+            day_timestamps
+        )
+
+        packed = numbers >= 0
+
+        # Forms numpy does not parse get a second try one
+        # by one.
+        for position in np.flatnonzero(
+            packed & ~encoded
+        ).tolist():
+
+            value = barcode_index.encode_timestamp(
+                day_timestamps[position]
+            )
+
+            if value is not None:
+
+                stamps[position] = value
+                encoded[position] = True
+
+        for position in np.flatnonzero(
+            ~(packed & encoded)
+        ).tolist():
+
+            barcode = barcodes[position]
+            timestamp = day_timestamps[position]
+
+            if (
+                barcode not in other
+                or timestamp < other[barcode]
+            ):
+                other[barcode] = timestamp
+
+        rows = packed & encoded
+
+        keys.append(
+            ((numbers[rows] + 1) << TAG_SHIFT)
+            | values[rows]
+        )
+        timestamps.append(stamps[rows])
+
+    new_keys = np.concatenate(
+        keys
+        or [np.empty(0, dtype=np.int64)]
+    )
+
+    all_keys = new_keys
+    all_timestamps = np.concatenate(
+        timestamps
+        or [np.empty(0, dtype=np.int64)]
+    )
+
+    if base is not None and len(base.keys):
+
+        all_keys = np.concatenate(
+            [
+                base.keys,
+                all_keys,
+            ]
+        )
+        all_timestamps = np.concatenate(
+            [
+                base.timestamps,
+                all_timestamps,
+            ]
+        )
+
+    # Sort by key, then timestamp; keep each key's first
+    # (earliest) entry.
+    order = np.lexsort(
+        (
+            all_timestamps,
+            all_keys,
+        )
+    )
+
+    all_keys = all_keys[order]
+    all_timestamps = all_timestamps[order]
+
+    first = np.ones(
+        len(all_keys),
+        dtype=bool,
+    )
+    first[1:] = all_keys[1:] != all_keys[:-1]
+
+    all_keys = all_keys[first]
+    all_timestamps = all_timestamps[first]
+
+    bloom = None
+
+    if COLD_INDEX_FILTER and len(all_keys):
+
+        base_filter = (
+            base.filter
+            if base is not None
+            else None
+        )
+
+        if (
+            base_filter is not None
+            and base_filter.key_count + len(new_keys)
+            <= base_filter.capacity
+        ):
+
+            # Incremental: only the new days' keys.
+            bloom = base_filter.copy()
+
+            bloom.add(new_keys)
+
+        else:
+
+            bloom = bloom_filter.BloomFilter.from_keys(
+                all_keys
+            )
+
+    header = json.dumps(
+        {
+            "version": COLD_INDEX_VERSION,
+            "codecs": barcode_index.CODECS.signature,
+            "count": len(all_keys),
+            "days": days,
+            "other": other,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    prefix = (
+        COLD_INDEX_MAGIC
+        + HEADER_LENGTH.pack(len(header))
+        + header
+    )
+
+    path = os.path.join(
+        data_dir,
+        f"{COLD_INDEX_PREFIX}{time.time_ns()}"
+        f"{COLD_INDEX_SUFFIX}",
+    )
+
+    # Several app processes may build at once.
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(
+        temp_path,
+        "wb",
+    ) as file:
+
+        file.write(
+            prefix.ljust(
+                _data_offset(len(header)),
+                b"\0",
+            )
+        )
+
+        file.write(
+            all_keys.astype(INT64).tobytes()
+        )
+        file.write(
+            all_timestamps.astype(INT64).tobytes()
+        )
+
+    # In place before the index, so opening it never has
+    # to build the filter.
+    if bloom is not None:
+
+        bloom_filter.save_filter(
+            f"{path}{FILTER_SUFFIX}",
+            bloom,
+        )
+
+    os.replace(
+        temp_path,
+        path,
+    )
+
+    return ColdIndex(path)
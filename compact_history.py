@@ -0,0 +1,371 @@
+import argparse
+import csv
+import datetime
+import io
+import os
+
+import scan_registry
+import scan_storage
+
+
+# =========================================================
+# HISTORY COMPACTION
+# =========================================================
+#
+# Older versions sometimes stored several rapid scans glued
+# into one CSV cell, so every stored value is normally run
+# through parse_scanner_input() at every startup.
+#
+# This one-time migration rewrites each past day file with
+# exactly one normalized barcode per record and marks it
+# clean (scan_storage.write_clean_mark). Clean records are
+# loaded without re-parsing.
+#
+#     python compact_history.py [--data-dir data]
+#
+# Values that are not valid barcodes at all are dropped
+# from the rewritten file; they are saved under
+# data/recovered/ first. Voided scans are dropped together
+# with their tombstones. Today's file is left alone, and
+# so are archives (archive_history.py), which are written
+# normalized.
+
+
+def normalize_rows(rows):
+    """
+    Split stored rows into one (barcode, timestamp) record
+    per barcode, leaving out voided scans.
+
+    Returns (records, unparsed rows).
+    """
+
+    records = []
+    unparsed = []
+
+    rows, _ = scan_storage.apply_tombstones(
+        rows
+    )
+
+    for stored_value, timestamp in rows:
+
+        barcodes = scan_registry.parse_scanner_input(
+            stored_value
+        )
+
+        if not barcodes:
+
+            unparsed.append(
+                (
+                    stored_value,
+                    timestamp,
+                )
+            )
+
+            continue
+
+        records.extend(
+            (
+                barcode,
+                timestamp,
+            )
+            for barcode in barcodes
+        )
+
+    return records, unparsed
+
+
+def rewrite_day_file(file_path, records):
+    """
+    Atomically replace a CSV or journal day file.
+    """
+
+    temp_path = f"{file_path}.tmp"
+
+    if file_path.endswith(
+        scan_storage.JOURNAL_EXTENSION
+    ):
+
+        payload = scan_storage.JOURNAL_MAGIC + b"".join(
+            scan_storage.encode_journal_record(
+                barcode,
+                timestamp,
+            )
+            for barcode, timestamp in records
+        )
+
+    else:
+
+        buffer = io.StringIO()
+
+        csv.writer(
+            buffer
+        ).writerows(
+            scan_storage.storage_row(
+                barcode,
+                timestamp,
+            )
+            for barcode, timestamp in records
+        )
+
+        payload = buffer.getvalue().encode("utf-8")
+
+    with open(
+        temp_path,
+        "wb",
+    ) as file:
+
+        file.write(payload)
+
+        file.flush()
+
+        os.fsync(
+            file.fileno()
+        )
+
+    os.replace(
+        temp_path,
+        file_path,
+    )
+
+
+def save_unparsed(file_path, unparsed):
+
+    recovered_dir = os.path.join(
+        os.path.dirname(file_path),
+        scan_storage.RECOVERY_DIRNAME,
+    )
+
+    os.makedirs(
+        recovered_dir,
+        exist_ok=True,
+    )
+
+    saved_path = os.path.join(
+        recovered_dir,
+        (
+            f"{os.path.basename(file_path)}."
+            f"{datetime.datetime.now():%Y%m%d%H%M%S}"
+            ".unparsed.csv"
+        ),
+    )
+
+    with open(
+        saved_path,
+        "w",
+        newline="",
+        encoding="utf-8",
+    ) as file:
+
+        csv.writer(
+            file
+        ).writerows(unparsed)
+
+    return saved_path
+
+
+def compact_day_file(file_path):
+    """
+    Normalize one day file and mark it clean.
+
+    Returns a report dict, or None if it was already clean.
+    """
+
+    clean_mark = scan_storage.read_clean_mark(
+        file_path
+    )
+
+    if (
+        clean_mark is not None
+        and scan_storage.check_mark(
+            clean_mark,
+            file_path,
+        ) == "unchanged"
+    ):
+        return None
+
+    rows = scan_storage.read_scan_rows(
+        file_path
+    )
+
+    records, unparsed = normalize_rows(rows)
+
+    report = {
+        "file": file_path,
+        "rows": len(rows),
+        "records": len(records),
+        "voided": sum(
+            scan_storage.voided_barcode(stored_value)
+            is not None
+            for stored_value, _ in rows
+        ),
+        "unparsed": len(unparsed),
+        "rewritten": False,
+        "saved_to": None,
+    }
+
+    if unparsed:
+
+        report["saved_to"] = save_unparsed(
+            file_path,
+            unparsed,
+        )
+
+    # Rewrite unless every row already holds exactly one
+    # normalized barcode in the current format.
+    if (
+        records != rows
+        or not _has_current_format(file_path)
+    ):
+
+        rewrite_day_file(
+            file_path,
+            records,
+        )
+
+        report["rewritten"] = True
+
+    scan_storage.write_clean_mark(
+        file_path
+    )
+
+    return report
+
+
+def _has_current_format(file_path):
+
+    if file_path.endswith(
+        scan_storage.JOURNAL_EXTENSION
+    ):
+
+        with open(
+            file_path,
+            "rb",
+        ) as file:
+
+            return scan_storage.journal_magic(
+                file.read(len(scan_storage.JOURNAL_MAGIC))
+            ) == scan_storage.JOURNAL_MAGIC
+
+    # Rows must come out exactly as storage_row() writes
+    # them now (see scan_storage.ROW_TIMESTAMPS).
+    with open(
+        file_path,
+        "r",
+        newline="",
+        encoding="utf-8",
+        errors="replace",
+    ) as file:
+
+        for row in csv.reader(file):
+
+            if not row:
+                continue
+
+            parsed = scan_storage.parse_csv_row(row)
+
+            if (
+                parsed is None
+                or scan_storage.storage_row(*parsed)
+                != row
+            ):
+                return False
+
+    return True
+
+
+def compact_history(data_dir=scan_registry.DATA_DIR):
+    """
+    Compact every day file before today.
+
+    Returns the list of reports for compacted files.
+    """
+
+    today = (
+        datetime.date.today()
+        .isoformat()
+    )
+
+    reports = []
+
+    # No app instance appends while files are rewritten.
+    with scan_storage.DataDirLock(data_dir):
+
+        for day, file_path in (
+            scan_storage.list_day_files(
+                data_dir
+            ).items()
+        ):
+
+            if (
+                day >= today
+                or file_path.endswith(
+                    scan_storage.ARCHIVE_EXTENSION
+                )
+            ):
+                continue
+
+            report = compact_day_file(
+                file_path
+            )
+
+            if report is not None:
+                reports.append(report)
+
+    return reports
+
+
+# =========================================================
+# COMMAND LINE
+# =========================================================
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Rewrite past daily scan files as one "
+            "normalized barcode per row and mark them "
+            "clean for fast loading."
+        )
+    )
+
+    parser.add_argument(
+        "--data-dir",
+        default=scan_registry.DATA_DIR,
+    )
+
+    args = parser.parse_args()
+
+    reports = compact_history(
+        args.data_dir
+    )
+
+    for report in reports:
+
+        line = (
+            f"{os.path.basename(report['file'])}: "
+            f"{report['rows']} rows -> "
+            f"{report['records']} records"
+        )
+
+        if not report["rewritten"]:
+            line += " (already normalized)"
+
+        if report["voided"]:
+            line += f", {report['voided']} voided"
+
+        if report["unparsed"]:
+
+            line += (
+                f", {report['unparsed']} unparsed saved to "
+                f"{report['saved_to']}"
+            )
+
+        print(line)
+
+    print(
+        f"{len(reports)} file(s) compacted."
+    )
+
+
+if __name__ == "__main__":
+    main()
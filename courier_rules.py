@@ -0,0 +1,617 @@
+import json
+import os
+import re
+
+import numpy as np
+
+
+# =========================================================
+# COURIER RULES
+# =========================================================
+#
+# Barcode formats of the supported couriers, read once at
+# startup from couriers.json next to this file (or the
+# file named by DISPATCHER_COURIER_CONFIG):
+#
+#     {"couriers": [
+#         {"name": "Shopee SPX", "prefix": "SPXID06",
+#          "length": 17, "charset": "digits"},
+#         ...
+#     ]}
+#
+# length counts the prefix; charset is what may follow it:
+#
+#     digits        decimal digits (regex \d)
+#     alphanumeric  A-Z / 0-9
+#     letters       A-Z
+#
+# A courier with several formats gets one entry per
+# format under the same name.
+#
+# The rules are compiled into one prefix trie. Finding the
+# rule for a barcode walks its prefix once and checks the
+# rest with one precompiled pattern, whatever the number
+# of couriers. When one prefix extends another, the longer
+# prefix is tried first; rules with the same prefix are
+# tried in file order.
+#
+# Whole columns (history files, today's table) go through
+# CourierMatcher.detect_series, which gives the same
+# answers with pandas' vectorized string methods and one
+# alternation of every rule, in the same order, instead of
+# one trie walk per row.
+
+COURIER_CONFIG_FILE = os.environ.get(
+    "DISPATCHER_COURIER_CONFIG",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "couriers.json",
+    ),
+)
+
+CHARSETS = {
+    "digits": r"\d",
+    "alphanumeric": "[A-Z0-9]",
+    "letters": "[A-Z]",
+}
+
+# Used when the config file does not exist.
+DEFAULT_COURIERS = [
+    {
+        "name": "Shopee SPX",
+        "prefix": "SPXID06",
+        "length": 17,
+        "charset": "digits",
+    },
+    {
+        "name": "J&T Express",
+        "prefix": "J",
+        "length": 12,
+        "charset": "alphanumeric",
+    },
+    {
+        "name": "AnterAja",
+        "prefix": "1",
+        "length": 14,
+        "charset": "digits",
+    },
+]
+
+# Trie key holding, at every node, the rules whose prefix
+# ends there or at an ancestor, longest prefix first; never
+# a one-character string.
+RULES_KEY = None
+
+
+class CourierRule:
+    """
+    One barcode format: a fixed prefix, a total length and
+    the characters allowed after the prefix.
+    """
+
+    def __init__(self, name, prefix, length, charset):
+
+        prefix = str(prefix).upper()
+
+        if not name or not prefix:
+
+            raise ValueError(
+                "A courier rule needs a name and a prefix."
+            )
+
+        if (
+            not isinstance(length, int)
+            or length <= len(prefix)
+        ):
+
+            raise ValueError(
+                f"{name}: length must be an integer "
+                f"longer than the prefix {prefix!r}."
+            )
+
+        if charset not in CHARSETS:
+
+            raise ValueError(
+                f"{name}: unknown charset {charset!r} "
+                f"(expected one of {sorted(CHARSETS)})."
+            )
+
+        self.name = name
+        self.prefix = prefix
+        self.length = length
+        self.charset = charset
+
+        # Matched in place with pos/endpos, so unanchored.
+        self.body = re.compile(
+            f"{CHARSETS[charset]}"
+            f"{{{length - len(prefix)}}}"
+        )
+
+        # The whole barcode, for detect_series.
+        self.pattern = (
+            f"{re.escape(prefix)}{self.body.pattern}"
+        )
+
+
+class CourierMatcher:
+    """
+    Prefix trie over a list of CourierRule.
+    """
+
+    def __init__(self, rules):
+
+        self.rules = list(rules)
+
+        # Courier names in file order, without repeats.
+        self.names = list(
+            dict.fromkeys(
+                rule.name
+                for rule in self.rules
+            )
+        )
+
+        # Radix trie: first character -> (label, child) for
+        # every edge, RULES_KEY -> candidate rules (see
+        # RULES_KEY).
+        self.root = self._compress(
+            self._build_trie(
+                self.rules
+            )
+        )
+
+        self._inherit(
+            self.root,
+            [],
+        )
+
+        # Same order as candidates(): longest prefix first,
+        # then file order. The first alternative that
+        # matches the whole barcode wins, so each rule's
+        # group is set only where candidates() would pick
+        # it.
+        self.series_rules = sorted(
+            self.rules,
+            key=lambda rule: -len(rule.prefix),
+        )
+
+        self.series_pattern = re.compile(
+            "^(?:"
+            + "|".join(
+                f"({rule.pattern})"
+                for rule in self.series_rules
+            )
+            + ")$"
+        )
+
+
+    @staticmethod
+    def _build_trie(rules):
+        """
+        One node per prefix character: char -> child,
+        RULES_KEY -> rules whose prefix ends there.
+        """
+
+        root = {
+            RULES_KEY: [],
+        }
+
+        for rule in rules:
+
+            node = root
+
+            for character in rule.prefix:
+
+                node = node.setdefault(
+                    character,
+                    {
+                        RULES_KEY: [],
+                    },
+                )
+
+            node[RULES_KEY].append(rule)
+
+        return root
+
+
+    def _compress(self, node):
+        """
+        Merge chains of nodes with one child and no rules
+        into single edges, so a walk costs one step per
+        branch point instead of one per character.
+        """
+
+        compressed = {
+            RULES_KEY: node[RULES_KEY],
+        }
+
+        for character, child in node.items():
+
+            if character is RULES_KEY:
+                continue
+
+            label = character
+
+            while (
+                not child[RULES_KEY]
+                and len(child) == 2
+            ):
+
+                (next_character, child), = (
+                    (key, value)
+                    for key, value in child.items()
+                    if key is not RULES_KEY
+                )
+
+                label += next_character
+
+            compressed[character] = (
+                label,
+                self._compress(child),
+            )
+
+        return compressed
+
+
+    def _inherit(self, node, inherited):
+        """
+        Append the ancestors' rules to every node's own.
+        """
+
+        node[RULES_KEY] = node[RULES_KEY] + inherited
+
+        for character, edge in node.items():
+
+            if character is not RULES_KEY:
+
+                self._inherit(
+                    edge[1],
+                    node[RULES_KEY],
+                )
+
+
+    def candidates(self, text, position=0):
+        """
+        Rules whose prefix occurs in text at position,
+        longest prefix first.
+        """
+
+        node = self.root
+
+        index = position
+        text_length = len(text)
+
+        # Reads at most the longest prefix.
+        while index < text_length:
+
+            edge = node.get(
+                text[index]
+            )
+
+            if edge is None:
+                break
+
+            label, child = edge
+
+            # No rule ends inside an edge.
+            if not text.startswith(
+                label,
+                index,
+            ):
+                break
+
+            node = child
+            index += len(label)
+
+        return node[RULES_KEY]
+
+
+    def match_at(self, text, position=0, end=None):
+        """
+        The first candidate rule whose whole block is valid
+        at position (and ends exactly at end, if given),
+        else None. text must be upper case.
+        """
+
+        text_length = len(text)
+
+        for rule in self.candidates(
+            text,
+            position,
+        ):
+
+            block_end = position + rule.length
+
+            if (
+                block_end > text_length
+                or (
+                    end is not None
+                    and block_end != end
+                )
+            ):
+                continue
+
+            if rule.body.fullmatch(
+                text,
+                position + len(rule.prefix),
+                block_end,
+            ):
+                return rule
+
+        return None
+
+
+    def detect(self, barcode):
+        """
+        Courier name of one barcode, or None.
+        """
+
+        barcode = (
+            str(barcode)
+            .strip()
+            .upper()
+        )
+
+        rule = self.match_at(
+            barcode,
+            0,
+            len(barcode),
+        )
+
+        if rule is None:
+            return None
+
+        return rule.name
+
+
+    def detect_series(self, barcodes, unknown=None):
+        """
+        Courier names of many barcodes at once, as a
+        categorical pandas Series (categories: names, then
+        unknown). Values detect() rejects get unknown, or
+        NaN if unknown is None. A Series keeps its index.
+        """
+
+        # Only the pages need pandas; the registry, its
+        # server and load workers import this module too.
+        import pandas as pd
+
+        if not isinstance(barcodes, pd.Series):
+
+            barcodes = pd.Series(
+                list(barcodes),
+                dtype=object,
+            )
+
+        categories = list(self.names)
+
+        unknown_code = -1
+
+        if unknown is not None:
+
+            if unknown not in categories:
+                categories.append(unknown)
+
+            unknown_code = categories.index(unknown)
+
+        # One column per rule, set where its group matched.
+        matched = (
+            barcodes
+            .fillna("")
+            .astype(str)
+            .str.strip()
+            .str.upper()
+            .str.extract(
+                self.series_pattern,
+                expand=True,
+            )
+            .notna()
+            .to_numpy()
+        )
+
+        # Position 0 for rows no rule matched, else 1 +
+        # the rule's column.
+        column_codes = np.array(
+            [unknown_code]
+            + [
+                categories.index(rule.name)
+                for rule in self.series_rules
+            ],
+            dtype=np.int64,
+        )
+
+        codes = column_codes[
+            (
+                matched.argmax(axis=1) + 1
+            )
+            * matched.any(axis=1)
+        ]
+
+        return pd.Series(
+            pd.Categorical.from_codes(
+                codes,
+                categories=categories,
+            ),
+            index=barcodes.index,
+        )
+
+
+    def split(self, cleaned):
+        """
+        Split upper-case text without whitespace into
+        consecutive barcodes, left to right; [] if any part
+        is not a valid block.
+
+        Blocks are checked in place; nothing after the
+        current position is copied, so a long burst of
+        glued scans stays linear.
+        """
+
+        barcodes = []
+
+        position = 0
+        input_length = len(cleaned)
+
+        while position < input_length:
+
+            rule = self.match_at(
+                cleaned,
+                position,
+            )
+
+            if rule is None:
+                return []
+
+            end = position + rule.length
+
+            barcodes.append(
+                cleaned[position:end]
+            )
+
+            position = end
+
+        return barcodes
+
+
+    def segments(self, cleaned):
+        """
+        Split like split(), but keep going past invalid
+        text: each invalid stretch becomes one segment that
+        ends where the next valid block starts.
+
+        Returns [(start, end, rule), ...] covering the
+        whole text, with rule None for an invalid stretch.
+        """
+
+        segments = []
+
+        position = 0
+        input_length = len(cleaned)
+
+        invalid_start = None
+
+        while position < input_length:
+
+            rule = self.match_at(
+                cleaned,
+                position,
+            )
+
+            if rule is None:
+
+                if invalid_start is None:
+                    invalid_start = position
+
+                # Resynchronise one character further on.
+                position += 1
+
+                continue
+
+            if invalid_start is not None:
+
+                segments.append(
+                    (
+                        invalid_start,
+                        position,
+                        None,
+                    )
+                )
+
+                invalid_start = None
+
+            end = position + rule.length
+
+            segments.append(
+                (
+                    position,
+                    end,
+                    rule,
+                )
+            )
+
+            position = end
+
+        if invalid_start is not None:
+
+            segments.append(
+                (
+                    invalid_start,
+                    input_length,
+                    None,
+                )
+            )
+
+        return segments
+
+
+# =========================================================
+# LOADING
+# =========================================================
+
+def load_rules(path=COURIER_CONFIG_FILE):
+    """
+    Compile the courier config file into a CourierMatcher.
+
+    A missing file gives DEFAULT_COURIERS; an invalid one
+    raises ValueError naming the problem.
+    """
+
+    try:
+
+        with open(
+            path,
+            "r",
+            encoding="utf-8",
+        ) as file:
+
+            entries = json.load(file)["couriers"]
+
+    except FileNotFoundError:
+
+        entries = DEFAULT_COURIERS
+
+    except (ValueError, KeyError, TypeError) as exc:
+
+        raise ValueError(
+            f"{path}: not a courier config ({exc})."
+        ) from exc
+
+    rules = []
+
+    for entry in entries:
+
+        try:
+
+            rules.append(
+                CourierRule(
+                    entry["name"],
+                    entry["prefix"],
+                    entry["length"],
+                    entry["charset"],
+                )
+            )
+
+        except (KeyError, TypeError) as exc:
+
+            raise ValueError(
+                f"{path}: courier entry {entry!r} needs "
+                "name, prefix, length and charset."
+            ) from exc
+
+        except ValueError as exc:
+
+            raise ValueError(
+                f"{path}: {exc}"
+            ) from exc
+
+    if not rules:
+
+        raise ValueError(
+            f"{path}: no couriers configured."
+        )
+
+    return CourierMatcher(rules)
+
+
+# Compiled once per process and shared by the scanner and
+# history pages.
+COURIERS = load_rules()
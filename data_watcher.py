@@ -0,0 +1,537 @@
+import ctypes
+import ctypes.util
+import datetime
+import os
+import select
+import struct
+import sys
+import threading
+
+import scan_storage
+
+
+# =========================================================
+# DATA DIRECTORY WATCHER
+# =========================================================
+#
+# Follows the daily scan files in data/ and reports only
+# the records appended since the last change, whether they
+# were written by this process, another app instance, or a
+# file copied in from another station.
+#
+# Every day file has a high-water mark (see
+# scan_storage.read_scan_rows_from). On a change the file
+# is read from its mark; a rewritten file is read again
+# from the start.
+#
+# Linux uses inotify (through libc, no extra package);
+# elsewhere the directory is polled: today's file, plus
+# the day files that appear, vanish or, where the listing
+# carries their size and mtime for free (Windows), change.
+# Any other day is checked when it is asked for, with
+# refresh([day]).
+#
+# One watcher per data directory is shared by everything
+# in the process (shared_watcher()): the registry and the
+# history pages subscribe to the same thread.
+
+POLL_INTERVAL_SECONDS = 1.0
+
+# After an inotify event, wait this long for the rest of a
+# burst so one batch of writes is read once.
+EVENT_SETTLE_SECONDS = 0.05
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_TO
+    | IN_CREATE
+)
+
+# struct inotify_event: wd, mask, cookie, name length
+EVENT_HEADER = struct.Struct("iIII")
+
+DAY_FILE_EXTENSIONS = (
+    scan_storage.CSV_EXTENSION,
+    scan_storage.JOURNAL_EXTENSION,
+    scan_storage.ARCHIVE_EXTENSION,
+)
+
+
+# =========================================================
+# INOTIFY
+# =========================================================
+
+class Inotify:
+    """
+    Minimal inotify watch on one directory.
+    """
+
+    def __init__(self, directory):
+
+        libc_name = ctypes.util.find_library("c")
+
+        if (
+            not sys.platform.startswith("linux")
+            or libc_name is None
+        ):
+            raise OSError("inotify is not available")
+
+        libc = ctypes.CDLL(
+            libc_name,
+            use_errno=True,
+        )
+
+        self.fd = libc.inotify_init1(
+            IN_NONBLOCK | IN_CLOEXEC
+        )
+
+        if self.fd < 0:
+
+            raise OSError(
+                ctypes.get_errno(),
+                "inotify_init1 failed",
+            )
+
+        if libc.inotify_add_watch(
+            self.fd,
+            os.fsencode(directory),
+            WATCH_MASK,
+        ) < 0:
+
+            error = ctypes.get_errno()
+
+            os.close(self.fd)
+
+            raise OSError(
+                error,
+                "inotify_add_watch failed",
+            )
+
+
+    def read_names(self, timeout):
+        """
+        Wait up to timeout seconds for events.
+
+        Returns the set of changed file names, or None if
+        the kernel queue overflowed and events were lost.
+        """
+
+        readable, _, _ = select.select(
+            [self.fd],
+            [],
+            [],
+            timeout,
+        )
+
+        names = set()
+
+        if not readable:
+            return names
+
+        while True:
+
+            try:
+
+                data = os.read(
+                    self.fd,
+                    64 * 1024,
+                )
+
+            except BlockingIOError:
+                return names
+
+            position = 0
+
+            while position < len(data):
+
+                _, mask, _, length = (
+                    EVENT_HEADER.unpack_from(
+                        data,
+                        position,
+                    )
+                )
+
+                position += EVENT_HEADER.size
+
+                if mask & IN_Q_OVERFLOW:
+                    return None
+
+                names.add(
+                    os.fsdecode(
+                        data[
+                            position:position + length
+                        ].rstrip(b"\0")
+                    )
+                )
+
+                position += length
+
+
+    def close(self):
+
+        os.close(self.fd)
+
+
+# =========================================================
+# WATCHER
+# =========================================================
+
+# Absolute data directory -> the watcher shared by this
+# process.
+_shared_watchers = {}
+
+_shared_watchers_lock = threading.Lock()
+
+
+def shared_watcher(data_dir):
+    """
+    The process's watcher of data_dir, started on first
+    use. Subscribers unsubscribe() instead of closing it.
+    """
+
+    key = os.path.abspath(data_dir)
+
+    with _shared_watchers_lock:
+
+        watcher = _shared_watchers.get(key)
+
+        if (
+            watcher is None
+            or watcher.stopped.is_set()
+        ):
+
+            watcher = DataDirWatcher(data_dir)
+
+            _shared_watchers[key] = watcher
+
+        return watcher
+
+
+def list_day_entries(data_dir):
+    """
+    {file name: (size, mtime)} of the day files in one
+    directory listing.
+
+    Only Windows returns the size and mtime with the
+    listing; elsewhere they would cost a stat() per file,
+    so they are None and only names are compared.
+    """
+
+    entries = {}
+
+    with os.scandir(data_dir) as listing:
+
+        for entry in listing:
+
+            if not entry.name.endswith(
+                DAY_FILE_EXTENSIONS
+            ):
+                continue
+
+            if os.name == "nt":
+
+                stat = entry.stat()
+
+                entries[entry.name] = (
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+
+            else:
+
+                entries[entry.name] = None
+
+    return entries
+
+
+class DataDirWatcher:
+    """
+    Background thread reporting records appended to the
+    daily scan files.
+
+    Subscribers are called as
+        callback(day, rows, start, mark)
+    where rows are the (stored_value, timestamp) records
+    read from byte offset start up to mark["offset"].
+    start is 0 when the file is new or was rewritten.
+    """
+
+    def __init__(
+        self,
+        data_dir,
+        poll_interval=POLL_INTERVAL_SECONDS,
+    ):
+
+        self.data_dir = data_dir
+        self.poll_interval = poll_interval
+
+        self.lock = threading.Lock()
+
+        self.subscribers = []
+
+        # day -> high-water mark of its day file.
+        self.marks = {}
+
+        # Last listing, for polling (list_day_entries()).
+        self.entries = {}
+
+        # Only changes made from now on are reported.
+        for day, file_path in (
+            scan_storage.list_day_files(
+                data_dir
+            ).items()
+        ):
+
+            try:
+
+                self.marks[day] = scan_storage.end_mark(
+                    file_path
+                )
+
+            except OSError:
+                continue
+
+        try:
+
+            self.inotify = Inotify(data_dir)
+
+            self.mode = "inotify"
+
+        except OSError:
+
+            self.inotify = None
+
+            self.mode = "polling"
+
+            try:
+
+                self.entries = list_day_entries(
+                    data_dir
+                )
+
+            except OSError:
+                pass
+
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(
+            target=self._run,
+            name="data-watcher",
+            daemon=True,
+        )
+
+        self.thread.start()
+
+
+    def subscribe(self, callback):
+
+        self.subscribers.append(callback)
+
+
+    def unsubscribe(self, callback):
+
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+
+    def close(self):
+
+        if self.stopped.is_set():
+            return
+
+        self.stopped.set()
+
+        self.thread.join()
+
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+    # =====================================================
+    # CHANGE DETECTION
+    # =====================================================
+
+    def refresh(self, days=None):
+        """
+        Check the given days (default: every day file) now
+        and report their appended records.
+        """
+
+        if days is None:
+
+            days = list(
+                scan_storage.list_day_files(
+                    self.data_dir
+                )
+            )
+
+        with self.lock:
+
+            for day in days:
+
+                try:
+
+                    self._check_day(day)
+
+                except (OSError, ValueError):
+                    continue
+
+
+    def _check_day(self, day):
+
+        file_path = scan_storage.day_file(
+            self.data_dir,
+            day,
+        )
+
+        if not os.path.exists(
+            file_path
+        ):
+            return
+
+        mark = self.marks.get(day)
+
+        start = 0
+
+        if mark is not None:
+
+            status = scan_storage.check_mark(
+                mark,
+                file_path,
+            )
+
+            if status == "unchanged":
+                return
+
+            if status == "appended":
+                start = mark["offset"]
+
+        rows, new_mark = scan_storage.read_scan_rows_from(
+            file_path,
+            start,
+        )
+
+        self.marks[day] = new_mark
+
+        if not rows:
+            return
+
+        for callback in list(self.subscribers):
+
+            try:
+
+                callback(
+                    day,
+                    rows,
+                    start,
+                    new_mark,
+                )
+
+            except Exception:
+                continue
+
+
+    def _poll(self):
+        """
+        Check today's file and the day files whose listing
+        entry changed.
+        """
+
+        try:
+
+            entries = list_day_entries(
+                self.data_dir
+            )
+
+        except OSError:
+            return
+
+        # Appeared or vanished, or changed size or mtime.
+        changed = (
+            entries.keys() ^ self.entries.keys()
+        ) | {
+            name
+            for name in entries.keys() & self.entries.keys()
+            if entries[name] != self.entries[name]
+        }
+
+        self.entries = entries
+
+        days = {
+            os.path.splitext(name)[0]
+            for name in changed
+        }
+
+        days.add(
+            datetime.date.today().isoformat()
+        )
+
+        self.refresh(
+            sorted(days)
+        )
+
+
+    def _run(self):
+
+        while not self.stopped.is_set():
+
+            if self.inotify is None:
+
+                if self.stopped.wait(
+                    self.poll_interval
+                ):
+                    return
+
+                self._poll()
+
+                continue
+
+            names = self.inotify.read_names(
+                self.poll_interval
+            )
+
+            if names is not None:
+
+                if not names:
+                    continue
+
+                # Let the rest of the burst arrive.
+                self.stopped.wait(
+                    EVENT_SETTLE_SECONDS
+                )
+
+                more_names = self.inotify.read_names(0)
+
+                if more_names is None:
+                    names = None
+
+                else:
+                    names |= more_names
+
+            if names is None:
+
+                self.refresh()
+
+                continue
+
+            self.refresh(
+                sorted(
+                    {
+                        os.path.splitext(name)[0]
+                        for name in names
+                        if name.endswith(
+                            DAY_FILE_EXTENSIONS
+                        )
+                    }
+                )
+            )
@@ -0,0 +1,480 @@
+import copy
+import datetime
+import json
+import os
+import threading
+import zlib
+
+import scan_storage
+
+
+# =========================================================
+# DAY MANIFESTS
+# =========================================================
+#
+# Small JSON sidecar kept next to every day file,
+#     data/<date>.csv.manifest  (or .journal.manifest)
+# with what the summaries need, so nothing has to load the
+# day's scans to show them:
+#
+#     count      records stored that day
+#     unique     distinct barcodes among them
+#     voided     scans voided by a tombstone
+#     couriers   {courier: {count, first, last}}
+#     first      earliest scan time (ISO)
+#     last       latest scan time (ISO)
+#     size       bytes of the day file covered
+#     crc32      CRC32 of those bytes
+#     mark       high-water mark of the day file
+#
+# A manifest is extended from its mark when records are
+# appended and rebuilt when the day file was rewritten, so
+# every update only reads the new bytes. Tombstones (see
+# scan_storage.apply_tombstones) are not counted; one that
+# voids a record counted earlier rebuilds the manifest.
+#
+# Extending unique needs the barcodes already counted:
+# DayManifests keeps them for the BARCODE_SET_DAYS days it
+# updated last (today, in practice); any other day is
+# counted again from the start of its file.
+
+MANIFEST_FORMAT_VERSION = 2
+
+BARCODE_SET_DAYS = 3
+
+MANIFEST_SUFFIX = ".manifest"
+
+
+def manifest_path(file_path):
+
+    return f"{file_path}{MANIFEST_SUFFIX}"
+
+
+def empty_manifest(day):
+
+    return {
+        "format_version": MANIFEST_FORMAT_VERSION,
+        "day": day,
+        "count": 0,
+        "unique": 0,
+        "voided": 0,
+        "couriers": {},
+        "first": None,
+        "last": None,
+        "size": 0,
+        "crc32": 0,
+        "mark": None,
+    }
+
+
+def read_manifest(file_path):
+    """
+    Return the manifest of a day file if it is current
+    (nothing appended or rewritten since), else None.
+    """
+
+    try:
+
+        with open(
+            manifest_path(file_path),
+            "r",
+            encoding="utf-8",
+        ) as file:
+
+            manifest = json.load(file)
+
+    except (OSError, ValueError):
+        return None
+
+    if (
+        manifest.get("format_version")
+        != MANIFEST_FORMAT_VERSION
+        or not manifest.get("mark")
+        or scan_storage.check_mark(
+            manifest["mark"],
+            file_path,
+        ) != "unchanged"
+    ):
+        return None
+
+    return manifest
+
+
+def _load_manifest(file_path):
+    """
+    Stored manifest, current or not, or None.
+    """
+
+    try:
+
+        with open(
+            manifest_path(file_path),
+            "r",
+            encoding="utf-8",
+        ) as file:
+
+            manifest = json.load(file)
+
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get(
+        "format_version"
+    ) != MANIFEST_FORMAT_VERSION:
+        return None
+
+    return manifest
+
+
+def _write_manifest(file_path, manifest):
+
+    path = manifest_path(file_path)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+
+        with open(
+            temp_path,
+            "w",
+            encoding="utf-8",
+        ) as file:
+
+            json.dump(
+                manifest,
+                file,
+            )
+
+        os.replace(
+            temp_path,
+            path,
+        )
+
+    except OSError:
+
+        # Only a cache: the next update writes it again.
+        pass
+
+
+def _is_timestamp(timestamp):
+
+    try:
+
+        datetime.datetime.fromisoformat(
+            timestamp
+        )
+
+    except ValueError:
+        return False
+
+    return True
+
+
+def add_records(manifest, records, barcodes):
+    """
+    Count [(barcode, courier, timestamp), ...] into a
+    manifest in place; barcodes is the set of barcodes
+    counted so far, updated too.
+    """
+
+    couriers = manifest["couriers"]
+
+    for barcode, courier, timestamp in records:
+
+        manifest["count"] += 1
+
+        if barcode not in barcodes:
+
+            barcodes.add(barcode)
+
+            manifest["unique"] += 1
+
+        entry = couriers.setdefault(
+            courier or "Unknown",
+            {
+                "count": 0,
+                "first": None,
+                "last": None,
+            },
+        )
+
+        entry["count"] += 1
+
+        if not _is_timestamp(timestamp):
+            continue
+
+        for target in (
+            manifest,
+            entry,
+        ):
+
+            if (
+                target["first"] is None
+                or timestamp < target["first"]
+            ):
+                target["first"] = timestamp
+
+            if (
+                target["last"] is None
+                or timestamp > target["last"]
+            ):
+                target["last"] = timestamp
+
+
+def update_manifest(
+    file_path,
+    day,
+    split_value,
+    manifest=None,
+    barcodes=None,
+):
+    """
+    Bring the manifest of one day file up to date.
+
+    Returns (manifest, barcodes), barcodes being the set
+    of the barcodes it counts, or None if it was already
+    current and no set was given.
+
+    split_value(stored_value) returns the
+    [(barcode, courier), ...] a stored value holds.
+    manifest is the caller's cached copy, if any, and
+    barcodes its set; without one an appended file is
+    counted again from the start.
+    """
+
+    if manifest is None:
+
+        manifest = _load_manifest(
+            file_path
+        )
+
+    status = "rewritten"
+
+    if (
+        manifest is not None
+        and manifest.get("mark")
+    ):
+
+        status = scan_storage.check_mark(
+            manifest["mark"],
+            file_path,
+        )
+
+    if status == "unchanged":
+        return manifest, barcodes
+
+    if (
+        status == "rewritten"
+        or barcodes is None
+    ):
+
+        manifest = empty_manifest(day)
+
+        barcodes = set()
+
+    else:
+
+        # The cached copies may be in use by readers.
+        manifest = copy.deepcopy(manifest)
+
+        barcodes = set(barcodes)
+
+    start = manifest["size"]
+
+    rows, mark = scan_storage.read_scan_rows_from(
+        file_path,
+        start,
+    )
+
+    rows, voids = scan_storage.apply_tombstones(
+        rows
+    )
+
+    if voids and start:
+
+        manifest = empty_manifest(day)
+
+        barcodes = set()
+
+        start = 0
+
+        rows, mark = scan_storage.read_scan_rows_from(
+            file_path,
+        )
+
+        rows, voids = scan_storage.apply_tombstones(
+            rows
+        )
+
+    manifest["voided"] += len(voids)
+
+    with open(
+        file_path,
+        "rb",
+    ) as file:
+
+        file.seek(start)
+
+        data = file.read(
+            mark["offset"] - start
+        )
+
+    add_records(
+        manifest,
+        (
+            (
+                barcode,
+                courier,
+                timestamp,
+            )
+            for stored_value, timestamp in rows
+            for barcode, courier in split_value(
+                stored_value
+            )
+        ),
+        barcodes,
+    )
+
+    manifest["size"] = mark["offset"]
+    manifest["crc32"] = zlib.crc32(
+        data,
+        manifest["crc32"],
+    )
+    manifest["mark"] = mark
+
+    _write_manifest(
+        file_path,
+        manifest,
+    )
+
+    return manifest, barcodes
+
+
+# =========================================================
+# MANIFEST CACHE
+# =========================================================
+
+class DayManifests:
+    """
+    Manifests of every day file in data_dir, kept in
+    memory and refreshed after writes and changes.
+    """
+
+    def __init__(self, data_dir, split_value):
+
+        self.data_dir = data_dir
+        self.split_value = split_value
+
+        self.lock = threading.Lock()
+
+        # day -> manifest
+        self.manifests = {}
+
+        # day -> barcodes counted by its manifest, for the
+        # BARCODE_SET_DAYS days updated last, oldest first.
+        self.barcodes = {}
+
+
+    def refresh(self, days=None):
+        """
+        Update the manifests of the given days (default:
+        every day file) from their files.
+
+        The lock is taken per day, so a full refresh does
+        not hold up refreshes of today's manifest.
+        """
+
+        if days is None:
+
+            day_files = scan_storage.list_day_files(
+                self.data_dir
+            )
+
+            days = list(day_files)
+
+        else:
+
+            day_files = {
+                day: scan_storage.day_file(
+                    self.data_dir,
+                    day,
+                )
+                for day in days
+            }
+
+            day_files = {
+                day: file_path
+                for day, file_path in day_files.items()
+                if os.path.exists(file_path)
+            }
+
+        for day in days:
+
+            with self.lock:
+
+                file_path = day_files.get(day)
+
+                if file_path is None:
+
+                    self.manifests.pop(
+                        day,
+                        None,
+                    )
+
+                    self.barcodes.pop(
+                        day,
+                        None,
+                    )
+
+                    continue
+
+                cached = self.manifests.get(day)
+
+                if (
+                    cached is not None
+                    and cached["mark"]["path"]
+                    != file_path
+                ):
+                    cached = None
+
+                try:
+
+                    manifest, barcodes = update_manifest(
+                        file_path,
+                        day,
+                        self.split_value,
+                        cached,
+                        self.barcodes.pop(day, None),
+                    )
+
+                except (OSError, ValueError):
+                    continue
+
+                self.manifests[day] = manifest
+
+                if barcodes is not None:
+
+                    self.barcodes[day] = barcodes
+
+                    while (
+                        len(self.barcodes)
+                        > BARCODE_SET_DAYS
+                    ):
+
+                        del self.barcodes[
+                            next(iter(self.barcodes))
+                        ]
+
+
+    def total(self):
+        """
+        Distinct barcodes stored across all days, in
+        O(days).
+        """
+
+        with self.lock:
+
+            return sum(
+                manifest["unique"]
+                for manifest in self.manifests.values()
+            )
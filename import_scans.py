@@ -0,0 +1,531 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+import registry_server
+import scan_registry
+import scan_storage
+
+
+# =========================================================
+# BULK SCAN IMPORT
+# =========================================================
+#
+# Merges a scan dump from a station that worked offline
+# into the history, with the same duplicate check as live
+# scanning:
+#
+#     python import_scans.py dump.csv [--chunk-size 10000]
+#         [--timestamp ISO] [--summary summary.json]
+#
+# One scan per line, either a bare scanner read or
+# "scan,timestamp"; rows copied from a day file (checksum
+# and epoch columns, see scan_storage.storage_row) are
+# read as well. "-" reads standard input. Glued reads are
+# split with parse_scanner_input(). Lines without a
+# timestamp get --timestamp, or are counted invalid.
+# Timestamps are normalized as storage reads them back
+# (scan_storage.normalize_timestamp), keeping any UTC
+# offset; ones that cannot be are invalid.
+#
+# The file is streamed: CHUNK_SIZE barcodes at a time go
+# through BarcodeRegistry.process_batch(), one registry
+# lock and one append per day per chunk, so memory does
+# not grow with the file. Each record keeps its original
+# timestamp and goes into the day file of that timestamp.
+# Running scanner apps keep working during the import and
+# pick up the new records through their data watchers.
+#
+# The registry works on scan_registry.DATA_DIR; with
+# DISPATCHER_REGISTRY_SERVER set the chunks go to the
+# registry server instead of a registry opened here.
+#
+# Invalid lines are saved under data/recovered/. Days
+# that are already archived (archive_history.py) are left
+# alone; their scans are counted as "archived".
+
+CHUNK_SIZE = 10000
+
+
+def iter_import_rows(file, default_timestamp=None):
+    """
+    Yield (row, scan, timestamp) for every non-empty line
+    of an import file; scan and timestamp are None where
+    they cannot be read.
+    """
+
+    for row in csv.reader(file):
+
+        if not any(
+            field.strip()
+            for field in row
+        ):
+            continue
+
+        if len(row) == 1:
+
+            yield row, row[0], default_timestamp
+
+            continue
+
+        parsed = scan_storage.parse_csv_row(row)
+
+        if parsed is None:
+
+            yield row, None, None
+
+            continue
+
+        yield row, parsed[0], parsed[1]
+
+
+class ScanImporter:
+    """
+    Feeds import rows to a registry in chunks and counts
+    the outcome.
+    """
+
+    def __init__(
+        self,
+        registry,
+        chunk_size=CHUNK_SIZE,
+        source_name="import",
+    ):
+
+        self.registry = registry
+        self.chunk_size = chunk_size
+        self.source_name = source_name
+
+        self.today = (
+            datetime.date.today()
+            .isoformat()
+        )
+
+        self.barcodes = []
+        self.timestamps = []
+
+        # day -> True if the day is archived
+        self.archived_days = {}
+
+        # Only the file backends archive days.
+        self.check_archives = not (
+            scan_storage.STORAGE_BACKENDS[
+                scan_registry.STORAGE_BACKEND
+            ].indexed
+        )
+
+        self.invalid_file = None
+        self.invalid_writer = None
+
+        self.summary = {
+            "lines": 0,
+            "accepted": 0,
+            "duplicate": 0,
+            "invalid": 0,
+            "archived": 0,
+            "error": None,
+            "saved_to": None,
+            "days": {},
+        }
+
+
+    def add(self, row, scan, timestamp):
+        """
+        Queue one import row; processes a chunk when it is
+        full. Returns False once the registry reported an
+        error.
+        """
+
+        self.summary["lines"] += 1
+
+        # As storage will read it back, so the day file,
+        # the registry and later voids all see one value.
+        timestamp = scan_storage.normalize_timestamp(
+            timestamp
+        )
+
+        day = self._day(timestamp)
+
+        barcodes = []
+
+        if (
+            scan is not None
+            and day is not None
+        ):
+
+            barcodes = scan_registry.parse_scanner_input(
+                scan
+            )
+
+        if not barcodes:
+
+            self._reject(row)
+
+            return True
+
+        if self._is_archived(day):
+
+            self.summary["archived"] += len(barcodes)
+
+            return True
+
+        self.barcodes.extend(barcodes)
+
+        self.timestamps.extend(
+            [timestamp] * len(barcodes)
+        )
+
+        if len(self.barcodes) >= self.chunk_size:
+            return self.flush()
+
+        return True
+
+
+    def flush(self):
+        """
+        Process the queued barcodes as one batch.
+        """
+
+        if not self.barcodes:
+            return True
+
+        results = self.registry.process_batch(
+            self.barcodes,
+            self.timestamps,
+        )
+
+        self.barcodes = []
+        self.timestamps = []
+
+        for result in results:
+
+            status = result["status"]
+
+            if status == "error":
+
+                self.summary["error"] = result.get(
+                    "message"
+                )
+
+                continue
+
+            if status == "success":
+
+                self.summary["accepted"] += 1
+
+                day = scan_registry.scan_day(
+                    result["timestamp"]
+                )
+
+                self.summary["days"][day] = (
+                    self.summary["days"].get(day, 0)
+                    + 1
+                )
+
+            elif status == "invalid":
+
+                self.summary["invalid"] += 1
+
+            else:
+
+                self.summary["duplicate"] += 1
+
+        return self.summary["error"] is None
+
+
+    def close(self):
+
+        if self.invalid_file is not None:
+
+            self.invalid_file.close()
+            self.invalid_file = None
+
+
+    def _day(self, timestamp):
+        """
+        Day of a normalized timestamp, or None if it is
+        missing or in the future.
+        """
+
+        if timestamp is None:
+            return None
+
+        day = scan_registry.scan_day(
+            timestamp
+        )
+
+        if day > self.today:
+            return None
+
+        return day
+
+
+    def _is_archived(self, day):
+
+        if not self.check_archives:
+            return False
+
+        if day not in self.archived_days:
+
+            self.archived_days[day] = scan_storage.day_file(
+                scan_registry.DATA_DIR,
+                day,
+            ).endswith(
+                scan_storage.ARCHIVE_EXTENSION
+            )
+
+        return self.archived_days[day]
+
+
+    def _reject(self, row):
+
+        self.summary["invalid"] += 1
+
+        if self.invalid_writer is None:
+
+            recovered_dir = os.path.join(
+                scan_registry.DATA_DIR,
+                scan_storage.RECOVERY_DIRNAME,
+            )
+
+            os.makedirs(
+                recovered_dir,
+                exist_ok=True,
+            )
+
+            saved_path = os.path.join(
+                recovered_dir,
+                (
+                    f"{self.source_name}."
+                    f"{datetime.datetime.now():%Y%m%d%H%M%S}"
+                    ".invalid.csv"
+                ),
+            )
+
+            self.invalid_file = open(
+                saved_path,
+                "w",
+                newline="",
+                encoding="utf-8",
+            )
+
+            self.invalid_writer = csv.writer(
+                self.invalid_file
+            )
+
+            self.summary["saved_to"] = saved_path
+
+        self.invalid_writer.writerow(row)
+
+
+def import_scans(
+    file,
+    registry,
+    chunk_size=CHUNK_SIZE,
+    default_timestamp=None,
+    source_name="import",
+):
+    """
+    Stream one import file into the registry.
+
+    Returns the summary dict: lines read, barcodes
+    accepted / duplicate / archived, invalid lines, the
+    file they were saved to, accepted barcodes per day,
+    and the registry error that stopped the import, if
+    any.
+    """
+
+    importer = ScanImporter(
+        registry,
+        chunk_size,
+        source_name,
+    )
+
+    try:
+
+        for row, scan, timestamp in iter_import_rows(
+            file,
+            default_timestamp,
+        ):
+
+            if not importer.add(
+                row,
+                scan,
+                timestamp,
+            ):
+                break
+
+        else:
+
+            importer.flush()
+
+    finally:
+
+        importer.close()
+
+    return importer.summary
+
+
+# =========================================================
+# COMMAND LINE
+# =========================================================
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Merge a text or CSV dump of offline scans "
+            "into the scan history, skipping duplicates "
+            "and keeping the original scan times."
+        )
+    )
+
+    parser.add_argument(
+        "file",
+        help="scan dump to import, or - for stdin",
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help=(
+            "barcodes per registry batch "
+            f"(default: {CHUNK_SIZE})"
+        ),
+    )
+
+    parser.add_argument(
+        "--timestamp",
+        default=None,
+        help=(
+            "ISO timestamp for lines without one "
+            "(default: such lines are invalid)"
+        ),
+    )
+
+    parser.add_argument(
+        "--summary",
+        default=None,
+        help="also write the summary to this JSON file",
+    )
+
+    args = parser.parse_args()
+
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+    if args.timestamp is not None:
+
+        if scan_storage.normalize_timestamp(
+            args.timestamp
+        ) is None:
+
+            parser.error(
+                f"--timestamp {args.timestamp!r} is not "
+                "an ISO timestamp"
+            )
+
+    if scan_registry.REGISTRY_SERVER:
+
+        registry = registry_server.RegistryClient(
+            scan_registry.REGISTRY_SERVER
+        )
+
+    else:
+
+        registry = scan_registry.BarcodeRegistry()
+
+    if args.file == "-":
+
+        file = sys.stdin
+        source_name = "stdin"
+
+    else:
+
+        file = open(
+            args.file,
+            "r",
+            newline="",
+            encoding="utf-8-sig",
+            errors="replace",
+        )
+
+        source_name = os.path.basename(args.file)
+
+    try:
+
+        summary = import_scans(
+            file,
+            registry,
+            args.chunk_size,
+            args.timestamp,
+            source_name,
+        )
+
+    finally:
+
+        if file is not sys.stdin:
+            file.close()
+
+        # A registry flushes its writer and saves the
+        # snapshot; a client only closes its connections.
+        registry.close()
+
+    for day, count in sorted(
+        summary["days"].items()
+    ):
+        print(f"{day}: {count} accepted")
+
+    line = (
+        f"{summary['lines']} lines: "
+        f"{summary['accepted']} accepted, "
+        f"{summary['duplicate']} duplicate, "
+        f"{summary['invalid']} invalid"
+    )
+
+    if summary["archived"]:
+
+        line += (
+            f", {summary['archived']} on archived days "
+            "skipped"
+        )
+
+    if summary["saved_to"]:
+
+        line += (
+            f"; invalid lines saved to "
+            f"{summary['saved_to']}"
+        )
+
+    print(line)
+
+    if args.summary:
+
+        with open(
+            args.summary,
+            "w",
+            encoding="utf-8",
+        ) as file:
+
+            json.dump(
+                summary,
+                file,
+                indent=2,
+            )
+
+    if summary["error"] is not None:
+
+        print(
+            f"Import stopped: {summary['error']}",
+            file=sys.stderr,
+        )
+
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
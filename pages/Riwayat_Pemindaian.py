@@ -2,11 +2,11 @@ import datetime
 import html
 import io
 import os
-import re
 
 import pandas as pd
 import streamlit as st
 
+import scan_history
 from app_helper import show_app_dev_info
 
 
@@ -204,86 +204,20 @@ section[data-testid="stSidebar"] hr {
 # CONFIGURATION
 # =========================================================
 
-DATA_DIR = "data"
-
-SHOPEE_PREFIX = "SPXID06"
-SHOPEE_DIGITS = 10
-
-JNT_PREFIX = "J"
-JNT_REMAINING_CHARS = 11
-
-ANTERAJA_PREFIX = "1"
-ANTERAJA_LENGTH = 14
+# Courier formats: couriers.json (see scan_history.py).
+COURIERS = scan_history.COURIERS
 
 COURIER_OPTIONS = [
     "Semua",
-    "Shopee SPX",
-    "J&T Express",
-    "AnterAja",
+    *COURIERS.names,
 ]
 
-SHOPEE_PATTERN = re.compile(
-    rf"^{re.escape(SHOPEE_PREFIX)}"
-    rf"\d{{{SHOPEE_DIGITS}}}$"
-)
-
-JNT_PATTERN = re.compile(
-    rf"^{re.escape(JNT_PREFIX)}"
-    rf"[A-Z0-9]{{{JNT_REMAINING_CHARS}}}$"
-)
-
-ANTERAJA_PATTERN = re.compile(
-    rf"^{re.escape(ANTERAJA_PREFIX)}"
-    rf"\d{{{ANTERAJA_LENGTH - 1}}}$"
-)
-
-
-def detect_courier(barcode):
-    """
-    Detect courier from Dispatcher ID.
-
-    Shopee SPX:
-        SPXID06 + 10 digits
-
-    J&T Express:
-        12 characters total
-        starts with J
-        remaining characters A-Z / 0-9
-
-    AnterAja:
-        14 digits total
-        starts with 1
-    """
-
-    if barcode is None:
-        return "Tidak diketahui"
-
-    barcode = (
-        str(barcode)
-        .strip()
-        .upper()
-    )
-
-    if SHOPEE_PATTERN.fullmatch(
-        barcode
-    ):
-        return "Shopee SPX"
-
-    if JNT_PATTERN.fullmatch(
-        barcode
-    ):
-        return "J&T Express"
-
-    if ANTERAJA_PATTERN.fullmatch(
-        barcode
-    ):
-        return "AnterAja"
-
-    return "Tidak diketahui"
+# Courier column label of IDs that match no format.
+UNKNOWN_COURIER = "Tidak diketahui"
 
 
 os.makedirs(
-    DATA_DIR,
+    scan_history.DATA_DIR,
     exist_ok=True,
 )
 
@@ -483,98 +417,54 @@ Lihat hasil pemindaian berdasarkan tanggal atau cari ID Dispatcher
 # DATA HELPERS
 # =========================================================
 
-@st.cache_data(
-    show_spinner=False
-)
-def load_scan_file(
-    file_path,
-    modified_time,
-):
+def read_scan_file(scan_day):
     """
-    Load one daily CSV.
-
-    modified_time is included in the cache key so Streamlit
-    automatically reloads the file after new scans are added.
+    One day of scans with the "Kurir" column (see
+    scan_history.py).
     """
 
-    return pd.read_csv(
-        file_path,
-        names=[
-            "Barcode_ID",
-            "Timestamp",
-        ],
-        dtype=str,
+    return scan_history.read_scan_file(
+        scan_day,
+        "Kurir",
+        UNKNOWN_COURIER,
     )
 
 
-def read_scan_file(file_path):
-    """
-    Safely load and clean a daily scan file.
-    """
-
-    if not os.path.exists(
-        file_path
-    ):
-        return pd.DataFrame(
-            columns=[
-                "Barcode_ID",
-                "Timestamp",
-            ]
-        )
-
-    try:
+def search_scan_file(scan_day, barcode_query):
 
-        modified_time = os.path.getmtime(
-            file_path
-        )
-
-        df = load_scan_file(
-            file_path,
-            modified_time,
-        ).copy()
-
-    except Exception:
-
-        return pd.DataFrame(
-            columns=[
-                "Barcode_ID",
-                "Timestamp",
-            ]
-        )
+    return scan_history.search_scan_file(
+        scan_day,
+        barcode_query,
+        "Kurir",
+        UNKNOWN_COURIER,
+    )
 
-    if df.empty:
-        return df
 
-    df["Barcode_ID"] = (
-        df["Barcode_ID"]
-        .astype(str)
-        .str.strip()
-    )
+def load_date_frame(scan_day, courier):
+    """
+    One day's scans for the date tab, newest first,
+    filtered to one courier unless "Semua".
+    """
 
-    df["Kurir"] = (
-        df["Barcode_ID"]
-        .map(
-            detect_courier
-        )
+    df = read_scan_file(
+        scan_day
     )
 
-    df["Timestamp"] = pd.to_datetime(
-        df["Timestamp"],
-        errors="coerce",
-    )
+    if courier != "Semua":
 
-    df = df.dropna(
-        subset=[
-            "Timestamp",
+        df = df[
+            df["Kurir"]
+            == courier
         ]
-    )
-
-    df = df[
-        df["Barcode_ID"] != ""
-    ]
 
-    return df.reset_index(
-        drop=True
+    return (
+        df.sort_values(
+            "Timestamp",
+            ascending=False,
+        )
+        .reset_index(
+            drop=True
+        )
     )
 
 
@@ -745,18 +635,12 @@ PILIH TANGGAL PEMINDAIAN
         selected_date.isoformat()
     )
 
-    selected_file = os.path.join(
-        DATA_DIR,
-        f"{selected_date_str}.csv",
-    )
-
-
     # =====================================================
     # NO FILE
     # =====================================================
 
-    if not os.path.exists(
-        selected_file
+    if not scan_history.get_scan_storage().has_day(
+        selected_date_str
     ):
 
         st.markdown(
@@ -785,26 +669,37 @@ Tidak ada pemindaian berhasil yang tercatat untuk
     else:
 
         # =================================================
-        # LOAD
+        # SUMMARY
         # =================================================
 
-        df_date = read_scan_file(
-            selected_file
+        # Precomputed by the scanner when the manifest is
+        # current, so the day file is only read for the
+        # table; otherwise from the loaded rows.
+        summary = scan_history.read_day_manifest(
+            selected_date_str
         )
 
-        if (
+        df_date = None
+
+        if summary is None:
+
+            df_date = load_date_frame(
+                selected_date_str,
+                selected_courier,
+            )
+
+            summary = scan_history.frame_summary(
+                df_date
+            )
+
+        elif (
             selected_courier
             != "Semua"
         ):
 
-            df_date = (
-                df_date[
-                    df_date["Kurir"]
-                    == selected_courier
-                ]
-                .reset_index(
-                    drop=True
-                )
+            summary = summary["couriers"].get(
+                selected_courier,
+                scan_history.frame_summary(None),
             )
 
 
@@ -812,7 +707,7 @@ Tidak ada pemindaian berhasil yang tercatat untuk
         # EMPTY
         # =================================================
 
-        if df_date.empty:
+        if not summary["count"]:
 
             st.markdown(
                 f"""
@@ -839,42 +734,22 @@ tidak memiliki data valid.
 
         else:
 
-            # =================================================
-            # SORT
-            # =================================================
-
-            df_date = (
-                df_date.sort_values(
-                    "Timestamp",
-                    ascending=False,
-                )
-                .reset_index(
-                    drop=True
-                )
-            )
-
+            total_scans = summary["count"]
 
-            # =================================================
-            # SUMMARY
-            # =================================================
-
-            total_scans = len(
-                df_date
-            )
-
-            first_scan = (
-                df_date["Timestamp"]
-                .min()
-                .strftime(
-                    "%H:%M:%S"
+            first_scan, latest_scan = (
+                (
+                    datetime.datetime.fromisoformat(
+                        timestamp
+                    )
+                    .strftime(
+                        "%H:%M:%S"
+                    )
+                    if timestamp is not None
+                    else "—"
                 )
-            )
-
-            latest_scan = (
-                df_date["Timestamp"]
-                .max()
-                .strftime(
-                    "%H:%M:%S"
+                for timestamp in (
+                    summary["first"],
+                    summary["last"],
                 )
             )
 
@@ -940,116 +815,131 @@ Semua ID Dispatcher yang berhasil dipindai pada tanggal terpilih
             )
 
 
-            display_df = (
-                df_date.copy()
+            show_table = st.toggle(
+                "Tampilkan pemindaian",
+                key="history_show_scans",
             )
 
+            if show_table:
 
-            display_df.insert(
-                0,
-                "No.",
-                range(
-                    1,
-                    len(display_df) + 1,
-                ),
-            )
+                if df_date is None:
 
+                    df_date = load_date_frame(
+                        selected_date_str,
+                        selected_courier,
+                    )
 
-            display_df["Timestamp"] = (
-                display_df["Timestamp"]
-                .dt.strftime(
-                    "%Y-%m-%d %H:%M:%S"
+
+                display_df = (
+                    df_date.copy()
                 )
-            )
 
 
-            display_df = (
-                display_df.rename(
-                    columns={
-                        "Barcode_ID":
-                            "ID Dispatcher",
-                        "Timestamp":
-                            "Tanggal",
-                    }
+                display_df.insert(
+                    0,
+                    "No.",
+                    range(
+                        1,
+                        len(display_df) + 1,
+                    ),
                 )
-            )
 
 
-            st.dataframe(
-                display_df,
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "No.": (
-                        st.column_config.NumberColumn(
-                            "No.",
-                            width="small",
-                        )
-                    ),
-                    "ID Dispatcher": (
-                        st.column_config.TextColumn(
-                            "ID Dispatcher",
-                            width="large",
-                        )
-                    ),
-                    "Kurir": (
-                        st.column_config.TextColumn(
-                            "Kurir",
-                            width="medium",
-                        )
-                    ),
-                    "Tanggal": (
-                        st.column_config.TextColumn(
-                            "Tanggal",
-                            width="medium",
-                        )
-                    ),
-                },
-            )
+                display_df["Timestamp"] = (
+                    display_df["Timestamp"]
+                    .dt.strftime(
+                        "%Y-%m-%d %H:%M:%S"
+                    )
+                )
 
 
-            # =================================================
-            # EXCEL DOWNLOAD
-            # =================================================
+                display_df = (
+                    display_df.rename(
+                        columns={
+                            "Barcode_ID":
+                                "ID Dispatcher",
+                            "Timestamp":
+                                "Tanggal",
+                        }
+                    )
+                )
 
-            excel_data = (
-                create_excel_file(
-                    df_date,
-                    "Riwayat_Pemindaian",
+
+                st.dataframe(
+                    display_df,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "No.": (
+                            st.column_config.NumberColumn(
+                                "No.",
+                                width="small",
+                            )
+                        ),
+                        "ID Dispatcher": (
+                            st.column_config.TextColumn(
+                                "ID Dispatcher",
+                                width="large",
+                            )
+                        ),
+                        "Kurir": (
+                            st.column_config.TextColumn(
+                                "Kurir",
+                                width="medium",
+                            )
+                        ),
+                        "Tanggal": (
+                            st.column_config.TextColumn(
+                                "Tanggal",
+                                width="medium",
+                            )
+                        ),
+                    },
                 )
-            )
 
 
-            st.markdown(
-                """
+                # =================================================
+                # EXCEL DOWNLOAD
+                # =================================================
+
+                excel_data = (
+                    create_excel_file(
+                        df_date,
+                        "Riwayat_Pemindaian",
+                    )
+                )
+
+
+                st.markdown(
+                    """
 <div class="download-title">
 Ekspor riwayat pemindaian
 </div>
 """,
-                unsafe_allow_html=True,
-            )
+                    unsafe_allow_html=True,
+                )
 
 
-            st.download_button(
-                label=(
-                    f"⬇️ Unduh "
-                    f"{selected_date_str} "
-                    f"Scan History"
-                ),
-                data=excel_data,
-                file_name=(
-                    f"dispatcher_scans_"
-                    f"{selected_date_str}.xlsx"
-                ),
-                mime=(
-                    "application/"
-                    "vnd.openxmlformats-"
-                    "officedocument."
-                    "spreadsheetml.sheet"
-                ),
-                use_container_width=True,
-                key="date_history_download",
-            )
+                st.download_button(
+                    label=(
+                        f"⬇️ Unduh "
+                        f"{selected_date_str} "
+                        f"Scan History"
+                    ),
+                    data=excel_data,
+                    file_name=(
+                        f"dispatcher_scans_"
+                        f"{selected_date_str}.xlsx"
+                    ),
+                    mime=(
+                        "application/"
+                        "vnd.openxmlformats-"
+                        "officedocument."
+                        "spreadsheetml.sheet"
+                    ),
+                    use_container_width=True,
+                    key="date_history_download",
+                )
 
 
 # =========================================================
@@ -1083,7 +973,7 @@ CARI ID DISPATCHER
                 "Cari ID Dispatcher",
                 placeholder=(
                     "Enter full or partial ID — "
-                    "Shopee, J&T, or AnterAja"
+                    + ", ".join(COURIERS.names)
                 ),
                 key="barcode_history_search",
                 label_visibility="collapsed",
@@ -1154,16 +1044,10 @@ Masukkan ID Dispatcher lengkap atau sebagian, pilih kurir jika diperlukan, lalu
 
         try:
 
-            data_files = [
-                entry
-                for entry
-                in os.scandir(DATA_DIR)
-                if (
-                    entry.is_file()
-                    and entry.name.lower()
-                    .endswith(".csv")
-                )
-            ]
+            scan_days = (
+                scan_history.get_scan_storage()
+                .list_days()
+            )
 
         except Exception as exc:
 
@@ -1171,24 +1055,14 @@ Masukkan ID Dispatcher lengkap atau sebagian, pilih kurir jika diperlukan, lalu
                 f"Tidak dapat mengakses data pemindaian: {exc}"
             )
 
-            data_files = []
+            scan_days = []
 
 
-        for entry in data_files:
-
-            file_path = (
-                entry.path
-            )
-
-            file_date = (
-                os.path.splitext(
-                    entry.name
-                )[0]
-            )
-
+        for file_date in scan_days:
 
-            df_file = read_scan_file(
-                file_path
+            df_file = search_scan_file(
+                file_date,
+                barcode_query,
             )
 
 
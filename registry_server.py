@@ -0,0 +1,725 @@
+import argparse
+import hmac
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+
+import scan_registry
+
+
+# =========================================================
+# REGISTRY SERVER
+# =========================================================
+#
+# One process owns the BarcodeRegistry (dedup index,
+# storage and writer thread); every Streamlit worker and
+# packing station talks to it over a local socket instead
+# of embedding its own registry.
+#
+# Start it with
+#     python registry_server.py [address]
+# and point the scanner apps at it with
+#     DISPATCHER_REGISTRY_SERVER=<address>
+#
+# Addresses:
+#     127.0.0.1:8765       TCP
+#     unix:/run/dispatcher.sock
+#                          Unix socket (not on Windows)
+#
+# Access: a TCP server needs DISPATCHER_REGISTRY_TOKEN,
+# and every request must carry the same token. A Unix
+# socket is created with mode 0600, so only the server's
+# user can connect; a token is checked there too if set.
+#
+# Protocol: every request and response is one message,
+#     4-byte big-endian length + UTF-8 JSON
+# Request  {"method": name, "params": [...], "token": ...}
+# Response {"result": value} or {"error": message}
+# A connection may carry any number of requests.
+#
+# Clients are not trusted with the data: the registry
+# checks every scan again (scan_registry.is_storable_scan)
+# and answers "invalid" for anything it would not store.
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+MESSAGE_HEADER = struct.Struct(">I")
+
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+CLIENT_TIMEOUT_SECONDS = 30
+
+# Idle connections a client keeps for the next call.
+CLIENT_POOL_SIZE = 8
+
+UNIX_SOCKET_MODE = 0o600
+
+# Registry calls clients may make.
+REMOTE_METHODS = (
+    "process_batch",
+    "void_scan",
+    "get_today_records",
+    "get_total_successful_scans",
+    "get_load_progress",
+    "get_filter_stats",
+    "get_diagnostics",
+    "refresh",
+    "get_recovery_report",
+)
+
+
+# =========================================================
+# MESSAGE FRAMING
+# =========================================================
+
+def parse_address(address):
+    """
+    Return (socket family, socket address).
+    """
+
+    if address.startswith("unix:"):
+
+        return (
+            socket.AF_UNIX,
+            address[len("unix:"):],
+        )
+
+    host, _, port = address.rpartition(":")
+
+    return (
+        socket.AF_INET,
+        (
+            host or "127.0.0.1",
+            int(port),
+        ),
+    )
+
+
+def _read_exact(stream, size):
+
+    data = b""
+
+    while len(data) < size:
+
+        chunk = stream.read(
+            size - len(data)
+        )
+
+        if not chunk:
+            return None
+
+        data += chunk
+
+    return data
+
+
+def read_message(stream):
+    """
+    Read one message from a binary stream.
+
+    Returns None when the peer closed the connection.
+    """
+
+    header = _read_exact(
+        stream,
+        MESSAGE_HEADER.size,
+    )
+
+    if header is None:
+        return None
+
+    (size,) = MESSAGE_HEADER.unpack(header)
+
+    if size > MAX_MESSAGE_BYTES:
+
+        raise ValueError(
+            f"Message too large: {size} bytes"
+        )
+
+    payload = _read_exact(
+        stream,
+        size,
+    )
+
+    if payload is None:
+        return None
+
+    return json.loads(
+        payload.decode("utf-8")
+    )
+
+
+def write_message(stream, message):
+
+    payload = json.dumps(
+        message,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    stream.write(
+        MESSAGE_HEADER.pack(len(payload))
+        + payload
+    )
+
+    stream.flush()
+
+
+# =========================================================
+# SERVER
+# =========================================================
+
+class RegistryRequestHandler(
+    socketserver.StreamRequestHandler
+):
+
+    def handle(self):
+
+        while True:
+
+            try:
+
+                request = read_message(
+                    self.rfile
+                )
+
+            except (OSError, ValueError):
+                return
+
+            if request is None:
+                return
+
+            write_message(
+                self.wfile,
+                self.server.dispatch(request),
+            )
+
+
+class _TcpServer(
+    socketserver.ThreadingTCPServer
+):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class _UnixServer(
+        socketserver.ThreadingUnixStreamServer
+    ):
+
+        daemon_threads = True
+
+
+class RegistryServer:
+    """
+    Serve one BarcodeRegistry to every connected client,
+    one thread per connection.
+    """
+
+    def __init__(
+        self,
+        registry,
+        address=DEFAULT_ADDRESS,
+        token=None,
+    ):
+
+        self.registry = registry
+
+        self.token = (
+            scan_registry.REGISTRY_TOKEN
+            if token is None
+            else token
+        )
+
+        family, server_address = parse_address(
+            address
+        )
+
+        if family == socket.AF_INET:
+
+            if not self.token:
+
+                raise ValueError(
+                    "A TCP registry server needs a token: "
+                    "set DISPATCHER_REGISTRY_TOKEN."
+                )
+
+            server_class = _TcpServer
+
+        else:
+
+            server_class = _UnixServer
+
+            # Left behind by a server that did not exit
+            # cleanly.
+            if os.path.exists(server_address):
+                os.remove(server_address)
+
+        self.server = server_class(
+            server_address,
+            RegistryRequestHandler,
+            bind_and_activate=False,
+        )
+
+        try:
+
+            self.server.server_bind()
+
+            # Before listen(), so nobody else can connect
+            # in between.
+            if family != socket.AF_INET:
+
+                os.chmod(
+                    server_address,
+                    UNIX_SOCKET_MODE,
+                )
+
+            self.server.server_activate()
+
+        except BaseException:
+
+            self.server.server_close()
+            raise
+
+        self.server.dispatch = self.dispatch
+
+        self.socket_path = (
+            None
+            if family == socket.AF_INET
+            else server_address
+        )
+
+
+    def dispatch(self, request):
+
+        if self.token and not hmac.compare_digest(
+            str(
+                request.get("token", "")
+            ).encode("utf-8"),
+            self.token.encode("utf-8"),
+        ):
+
+            return {
+                "error": "Invalid registry token."
+            }
+
+        method = request.get("method")
+
+        if method not in REMOTE_METHODS:
+
+            return {
+                "error": f"Unknown method: {method}"
+            }
+
+        try:
+
+            if method == "get_recovery_report":
+
+                result = self.registry.recovery_report
+
+            else:
+
+                result = getattr(
+                    self.registry,
+                    method,
+                )(
+                    *request.get("params", [])
+                )
+
+        except Exception as exc:
+
+            return {
+                "error": str(exc)
+            }
+
+        return {
+            "result": result
+        }
+
+
+    def serve_forever(self):
+
+        self.server.serve_forever()
+
+
+    def close(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+        if self.socket_path is not None:
+            os.remove(self.socket_path)
+
+        self.registry.close()
+
+
+# =========================================================
+# CLIENT
+# =========================================================
+
+class RegistryClient:
+    """
+    Thin stand-in for BarcodeRegistry that forwards the
+    calls the scanner page makes to a RegistryServer.
+
+    Connections are kept in a small pool shared by every
+    thread (Streamlit session and rerun): a call takes an
+    idle one or opens a new one, so slow batches never
+    queue behind each other on the client side, and hands
+    it back when done.
+    """
+
+    def __init__(
+        self,
+        address,
+        timeout=CLIENT_TIMEOUT_SECONDS,
+        token=None,
+        pool_size=CLIENT_POOL_SIZE,
+    ):
+
+        self.address = address
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+        self.token = (
+            scan_registry.REGISTRY_TOKEN
+            if token is None
+            else token
+        )
+
+        self.pool_lock = threading.Lock()
+
+        # Idle (connection, stream) pairs.
+        self.pool = []
+
+
+    def _connect(self):
+
+        family, server_address = parse_address(
+            self.address
+        )
+
+        connection = socket.socket(
+            family,
+            socket.SOCK_STREAM,
+        )
+
+        connection.settimeout(
+            self.timeout
+        )
+
+        try:
+
+            connection.connect(
+                server_address
+            )
+
+        except OSError:
+
+            connection.close()
+            raise
+
+        return (
+            connection,
+            connection.makefile(
+                "rwb"
+            ),
+        )
+
+
+    def _acquire(self):
+
+        with self.pool_lock:
+
+            if self.pool:
+                return self.pool.pop()
+
+        return self._connect()
+
+
+    def _release(self, pooled):
+
+        with self.pool_lock:
+
+            if len(self.pool) < self.pool_size:
+
+                self.pool.append(pooled)
+
+                return
+
+        self._disconnect(pooled)
+
+
+    def _disconnect(self, pooled):
+
+        connection, stream = pooled
+
+        try:
+
+            stream.close()
+            connection.close()
+
+        except OSError:
+            pass
+
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+
+        with self.pool_lock:
+
+            pool = self.pool
+            self.pool = []
+
+        for pooled in pool:
+            self._disconnect(pooled)
+
+
+    def _call(self, method, *params):
+
+        pooled = self._acquire()
+
+        try:
+
+            write_message(
+                pooled[1],
+                {
+                    "method": method,
+                    "params": list(params),
+                    "token": self.token,
+                },
+            )
+
+            response = read_message(
+                pooled[1]
+            )
+
+        except (OSError, ValueError):
+
+            self._disconnect(pooled)
+
+            # The server probably restarted: the other
+            # idle connections are dead too.
+            self.close()
+
+            raise
+
+        if response is None:
+
+            self._disconnect(pooled)
+
+            self.close()
+
+            raise ConnectionError(
+                "Registry server closed the connection."
+            )
+
+        self._release(pooled)
+
+        if "error" in response:
+
+            raise RuntimeError(
+                response["error"]
+            )
+
+        return response["result"]
+
+
+    def _query(self, method):
+        """
+        Read-only call, retried once on a new connection
+        (e.g. after the server restarted).
+        """
+
+        try:
+
+            return self._call(method)
+
+        except (OSError, ConnectionError):
+
+            return self._call(method)
+
+
+    def process_batch(self, barcodes, timestamps=None):
+
+        params = [
+            list(barcodes),
+        ]
+
+        if timestamps is not None:
+
+            params.append(
+                list(timestamps)
+            )
+
+        try:
+
+            return self._call(
+                "process_batch",
+                *params,
+            )
+
+        except Exception as exc:
+
+            # Not retried: the server may have stored the
+            # batch before the connection dropped.
+            return [
+                {
+                    "status": "error",
+                    "barcode": barcode,
+                    "message": str(exc),
+                }
+                for barcode in barcodes
+            ]
+
+
+    def void_scan(self, barcode):
+
+        try:
+
+            return self._call(
+                "void_scan",
+                barcode,
+            )
+
+        except Exception as exc:
+
+            # Not retried, like process_batch.
+            return {
+                "status": "error",
+                "barcode": barcode,
+                "message": str(exc),
+            }
+
+
+    def get_today_records(self):
+
+        return [
+            tuple(record)
+            for record in self._query(
+                "get_today_records"
+            )
+        ]
+
+
+    def get_total_successful_scans(self):
+
+        return self._query(
+            "get_total_successful_scans"
+        )
+
+
+    def get_load_progress(self):
+
+        return self._query(
+            "get_load_progress"
+        )
+
+
+    def get_filter_stats(self):
+
+        return self._query(
+            "get_filter_stats"
+        )
+
+
+    def get_diagnostics(self):
+
+        return self._query(
+            "get_diagnostics"
+        )
+
+
+    def refresh(self):
+
+        return self._call(
+            "refresh"
+        )
+
+
+    @property
+    def recovery_report(self):
+
+        return self._query(
+            "get_recovery_report"
+        )
+
+
+# =========================================================
+# COMMAND LINE
+# =========================================================
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Serve the barcode registry to the scanner "
+            "apps over a local socket."
+        )
+    )
+
+    parser.add_argument(
+        "address",
+        nargs="?",
+        default=(
+            scan_registry.REGISTRY_SERVER
+            or DEFAULT_ADDRESS
+        ),
+        help=(
+            "host:port or unix:/path "
+            f"(default: {DEFAULT_ADDRESS})"
+        ),
+    )
+
+    args = parser.parse_args()
+
+    if (
+        parse_address(args.address)[0] == socket.AF_INET
+        and not scan_registry.REGISTRY_TOKEN
+    ):
+
+        parser.error(
+            "a TCP address needs a token: set "
+            "DISPATCHER_REGISTRY_TOKEN for the server and "
+            "the apps"
+        )
+
+    server = RegistryServer(
+        scan_registry.BarcodeRegistry(
+            warm_up=scan_registry.BACKGROUND_WARM_UP
+        ),
+        args.address,
+    )
+
+    # Service managers stop the server with SIGTERM; shut
+    # down as cleanly as on Ctrl+C.
+    signal.signal(
+        signal.SIGTERM,
+        signal.default_int_handler,
+    )
+
+    print(
+        f"Registry server listening on {args.address}",
+        flush=True,
+    )
+
+    try:
+
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import barcode_index
+
+
+# =========================================================
+# REGISTRY SNAPSHOT
+# =========================================================
+#
+# Binary checkpoint of BarcodeRegistry.codes plus the
+# high-water mark of every daily file at the time it was
+# written (see scan_storage.read_scan_rows_from).
+#
+# On startup the registry loads the snapshot and replays
+# only the bytes appended after each mark, instead of
+# parsing every daily file again.
+#
+# The data directory is shared and copied between
+# stations, so the file holds data only, never objects:
+#     magic, 4-byte JSON header length, JSON header,
+#     padding to 8 bytes,
+#     keys[capacity], values[capacity] of every compact
+#     index table               (little-endian int64)
+#
+# The JSON header holds the marks, the courier formats the
+# keys were packed with, the dict parts of the index (or
+# the whole index for REGISTRY_INDEX = "dict") and a CRC
+# of the arrays. A file that does not parse, or does not
+# match, is no snapshot at all.
+
+SNAPSHOT_MAGIC = b"DRS1"
+
+SNAPSHOT_VERSION = 4
+
+HEADER_LENGTH = struct.Struct("<I")
+
+INT64 = np.dtype("<i8")
+
+
+def _data_offset(header_length):
+
+    offset = (
+        len(SNAPSHOT_MAGIC)
+        + HEADER_LENGTH.size
+        + header_length
+    )
+
+    return (offset + 7) // 8 * 8
+
+
+def save_snapshot(snapshot_path, codes, marks):
+    """
+    Write the snapshot atomically.
+    """
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "marks": marks,
+    }
+
+    arrays = []
+
+    if isinstance(
+        codes,
+        barcode_index.CompactBarcodeIndex,
+    ):
+
+        header["index"] = "compact"
+        header["codecs"] = codes.codecs.signature
+        header["tables"] = [
+            table.capacity
+            for table in codes.tables
+        ]
+        header["other"] = codes.other
+        header["raw_timestamps"] = codes.raw_timestamps
+
+        for table in codes.tables:
+
+            arrays.append(
+                table.keys.astype(INT64).tobytes()
+            )
+            arrays.append(
+                table.values.astype(INT64).tobytes()
+            )
+
+    else:
+
+        header["index"] = "dict"
+        header["codes"] = codes
+
+    data = b"".join(arrays)
+
+    header["crc"] = zlib.crc32(data)
+
+    header_bytes = json.dumps(
+        header,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    prefix = (
+        SNAPSHOT_MAGIC
+        + HEADER_LENGTH.pack(len(header_bytes))
+        + header_bytes
+    )
+
+    temp_path = f"{snapshot_path}.tmp"
+
+    with open(
+        temp_path,
+        "wb",
+    ) as file:
+
+        file.write(prefix)
+
+        file.write(
+            b"\0" * (
+                _data_offset(len(header_bytes))
+                - len(prefix)
+            )
+        )
+
+        file.write(data)
+
+    os.replace(
+        temp_path,
+        snapshot_path,
+    )
+
+
+def load_snapshot(snapshot_path):
+    """
+    Return (codes, marks), or None when there is no
+    usable snapshot.
+    """
+
+    if not os.path.exists(
+        snapshot_path
+    ):
+        return None
+
+    try:
+
+        with open(
+            snapshot_path,
+            "rb",
+        ) as file:
+
+            content = file.read()
+
+        return _parse_snapshot(content)
+
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _parse_snapshot(content):
+
+    prefix_length = (
+        len(SNAPSHOT_MAGIC)
+        + HEADER_LENGTH.size
+    )
+
+    if (
+        len(content) < prefix_length
+        or not content.startswith(SNAPSHOT_MAGIC)
+    ):
+        raise ValueError("not a registry snapshot")
+
+    (header_length,) = HEADER_LENGTH.unpack(
+        content[len(SNAPSHOT_MAGIC):prefix_length]
+    )
+
+    header = json.loads(
+        content[
+            prefix_length:prefix_length + header_length
+        ]
+    )
+
+    if header["version"] != SNAPSHOT_VERSION:
+        raise ValueError("old registry snapshot")
+
+    marks = header["marks"]
+
+    if not isinstance(marks, dict) or not all(
+        isinstance(mark, dict)
+        for mark in marks.values()
+    ):
+        raise ValueError("bad marks")
+
+    data = content[
+        _data_offset(header_length):
+    ]
+
+    if zlib.crc32(data) != header["crc"]:
+        raise ValueError("damaged registry snapshot")
+
+    if header["index"] == "dict":
+
+        codes = header["codes"]
+
+        if not isinstance(codes, dict):
+            raise ValueError("bad index")
+
+        return codes, marks
+
+    if header["index"] != "compact":
+        raise ValueError("unknown index")
+
+    # Keys packed under other courier formats are not
+    # readable.
+    if (
+        header["codecs"]
+        != barcode_index.CODECS.signature
+    ):
+        raise ValueError("courier formats changed")
+
+    capacities = header["tables"]
+
+    if len(capacities) != len(
+        barcode_index.CODECS.codecs
+    ) or len(data) != 16 * sum(capacities):
+        raise ValueError("bad tables")
+
+    codes = barcode_index.CompactBarcodeIndex()
+
+    columns = np.frombuffer(
+        data,
+        dtype=INT64,
+    )
+
+    start = 0
+
+    for number, capacity in enumerate(capacities):
+
+        codes.tables[number] = (
+            barcode_index.Int64HashMap.from_arrays(
+                columns[start:start + capacity],
+                columns[
+                    start + capacity:start + 2 * capacity
+                ],
+            )
+        )
+
+        start += 2 * capacity
+
+    if not isinstance(
+        header["other"],
+        dict,
+    ) or not isinstance(
+        header["raw_timestamps"],
+        dict,
+    ):
+        raise ValueError("bad index")
+
+    codes.other = header["other"]
+    codes.raw_timestamps = header["raw_timestamps"]
+
+    return codes, marks
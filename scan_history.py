@@ -0,0 +1,629 @@
+import io
+import threading
+
+import pandas as pd
+import streamlit as st
+
+import courier_rules
+import data_watcher
+import day_manifest
+import scan_storage
+
+
+# =========================================================
+# SCAN HISTORY DATA
+# =========================================================
+#
+# Reading days of scans for the history pages
+# (History_eng.py and pages/Riwayat_Pemindaian.py), which
+# keep only their own labels.
+#
+# The storage and the day cache are Streamlit resources,
+# so both pages share one of each per process.
+
+DATA_DIR = "data"
+
+# Days kept parsed in memory by DayFrames; the least
+# recently viewed day is dropped first.
+DAY_FRAME_CACHE_DAYS = 31
+
+# Courier formats: couriers.json, compiled once per
+# process by courier_rules.py and shared with the scanner.
+COURIERS = courier_rules.COURIERS
+
+
+# =========================================================
+# DATA HELPERS
+# =========================================================
+
+@st.cache_resource(
+    show_spinner=False
+)
+def get_scan_storage():
+    """
+    Configured scan storage (see scan_storage.py).
+    """
+
+    return scan_storage.open_storage(
+        DATA_DIR
+    )
+
+
+@st.cache_data(
+    show_spinner=False
+)
+def load_scan_file(
+    scan_day,
+    version,
+):
+    """
+    Load one day of scans from an indexed storage.
+
+    version is included in the cache key so Streamlit
+    automatically reloads the day after new scans are added.
+    """
+
+    return rows_to_frame(
+        get_scan_storage().read_day(
+            scan_day
+        )
+    )
+
+
+def read_day_manifest(scan_day):
+    """
+    Current manifest of one day file (see day_manifest.py),
+    or None with indexed storage or when the file changed
+    after it was written.
+    """
+
+    if get_scan_storage().indexed:
+        return None
+
+    return day_manifest.read_manifest(
+        scan_storage.day_file(
+            DATA_DIR,
+            scan_day,
+        )
+    )
+
+
+def parse_scan_csv(data):
+    """
+    Parse raw daily CSV bytes, dropping rows that fail
+    their checksum.
+
+    Epoch rows (barcode,epoch_us,utc_offset,checksum)
+    become datetime64 timestamps with integer arithmetic;
+    ISO rows (see scan_storage.ROW_TIMESTAMPS) are parsed
+    as text.
+    """
+
+    if not data:
+        return rows_to_frame([])
+
+    df = pd.read_csv(
+        io.BytesIO(data),
+        names=[
+            "Barcode_ID",
+            "Time",
+            "Offset",
+            "Checksum",
+        ],
+        dtype=str,
+        on_bad_lines="skip",
+    )
+
+    epoch_rows = df["Checksum"].notna()
+
+    # Rows written with a checksum must match it; a
+    # torn row from a crash fails and is dropped. ISO
+    # rows keep their checksum in the third column.
+    expected = [
+        scan_storage.row_checksum(
+            [
+                barcode,
+                time,
+                offset,
+            ]
+            if is_epoch
+            else [
+                barcode,
+                time,
+            ]
+        )
+        for barcode, time, offset, is_epoch in zip(
+            df["Barcode_ID"].fillna(""),
+            df["Time"].fillna(""),
+            df["Offset"].fillna(""),
+            epoch_rows,
+        )
+    ]
+
+    valid = (
+        epoch_rows
+        & (df["Checksum"] == expected)
+    ) | (
+        ~epoch_rows
+        & (
+            df["Offset"].isna()
+            | (df["Offset"] == expected)
+        )
+    )
+
+    df = df[valid]
+    epoch_rows = epoch_rows[valid]
+
+    timestamps = pd.Series(
+        pd.NaT,
+        index=df.index,
+        dtype="datetime64[ns]",
+    )
+
+    epoch_fields = df.loc[
+        epoch_rows,
+        [
+            "Time",
+            "Offset",
+        ],
+    ]
+
+    try:
+
+        epoch_fields = epoch_fields.astype("int64")
+
+    except ValueError:
+
+        # Only a hand-edited row can get here.
+        epoch_fields = epoch_fields.apply(
+            pd.to_numeric,
+            errors="coerce",
+        )
+
+    # Timestamps stored with their own offset have it
+    # shifted by AWARE_OFFSET (see scan_storage.py).
+    offsets = epoch_fields["Offset"].where(
+        epoch_fields["Offset"].abs()
+        <= scan_storage.MAX_OFFSET_MINUTES,
+        epoch_fields["Offset"] - scan_storage.AWARE_OFFSET,
+    )
+
+    local_us = (
+        epoch_fields["Time"]
+        + offsets * 60_000_000
+    )
+
+    timestamps[epoch_rows] = pd.to_datetime(
+        local_us,
+        unit="us",
+    )
+
+    timestamps[~epoch_rows] = parse_iso_times(
+        df.loc[~epoch_rows, "Time"]
+    )
+
+    return pd.DataFrame(
+        {
+            "Barcode_ID": df["Barcode_ID"],
+            "Timestamp": timestamps,
+        }
+    )
+
+
+def rows_to_frame(rows):
+    """
+    DataFrame for (barcode, ISO timestamp) rows, with the
+    timestamps as datetime64.
+    """
+
+    df = pd.DataFrame(
+        rows,
+        columns=[
+            "Barcode_ID",
+            "Timestamp",
+        ],
+        dtype=str,
+    )
+
+    df["Timestamp"] = parse_iso_times(
+        df["Timestamp"]
+    )
+
+    return df
+
+
+def parse_iso_times(texts):
+    """
+    datetime64 wall-clock times for ISO text; a UTC offset
+    (imported scans) is dropped, as for epoch rows, so
+    the column stays naive. Unreadable text becomes NaT.
+    """
+
+    return pd.to_datetime(
+        texts.str.replace(
+            scan_storage.ISO_OFFSET_SUFFIX,
+            "",
+            regex=True,
+        ),
+        format="ISO8601",
+        errors="coerce",
+    )
+
+
+def load_day_frame(scan_day):
+    """
+    Read one whole day file.
+
+    Returns (DataFrame, file path, byte offset read up to).
+    """
+
+    file_path = scan_storage.day_file(
+        DATA_DIR,
+        scan_day,
+    )
+
+    if file_path.endswith(
+        scan_storage.CSV_EXTENSION
+    ):
+
+        with open(
+            file_path,
+            "rb",
+        ) as file:
+
+            data = file.read()
+
+        # A partial last line is left for the watcher.
+        end = data.rfind(b"\n") + 1
+
+        return (
+            parse_scan_csv(
+                data[:end]
+            ),
+            file_path,
+            end,
+        )
+
+    rows, mark = get_scan_storage().read_day_from(
+        scan_day
+    )
+
+    return (
+        rows_to_frame(rows),
+        file_path,
+        mark["offset"],
+    )
+
+
+class DayFrames:
+    """
+    The DAY_FRAME_CACHE_DAYS days viewed last, kept as
+    DataFrames and extended with the rows the data watcher
+    reports, so a new scan never re-parses the whole day
+    file.
+    """
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+
+        # day -> (DataFrame, file path, byte offset), least
+        # recently viewed first.
+        self.frames = {}
+
+        # The scanner's watcher when it runs in this
+        # process.
+        self.watcher = data_watcher.shared_watcher(
+            DATA_DIR
+        )
+
+        self.watcher.subscribe(
+            self.apply_change
+        )
+
+
+    def get(self, scan_day):
+
+        # Pick up anything appended since the last event.
+        self.watcher.refresh(
+            [scan_day]
+        )
+
+        with self.lock:
+
+            cached = self.frames.pop(
+                scan_day,
+                None,
+            )
+
+            if cached is not None:
+
+                self.frames[
+                    scan_day
+                ] = cached
+
+        if cached is None:
+
+            cached = load_day_frame(
+                scan_day
+            )
+
+            with self.lock:
+
+                self.frames[
+                    scan_day
+                ] = cached
+
+                while (
+                    len(self.frames)
+                    > DAY_FRAME_CACHE_DAYS
+                ):
+
+                    del self.frames[
+                        next(iter(self.frames))
+                    ]
+
+        return cached[0]
+
+
+    def apply_change(self, day, rows, start, mark):
+
+        with self.lock:
+
+            cached = self.frames.get(day)
+
+            if cached is None:
+                return
+
+            frame, file_path, offset = cached
+
+            # Already read when the day was loaded; a
+            # rewrite (start 0) can be shorter, though.
+            if (
+                file_path == mark["path"]
+                and 0 < start
+                and mark["offset"] <= offset
+            ):
+                return
+
+            # Rewritten, switched to a journal, or rows were
+            # missed: read the whole day again next time.
+            if (
+                file_path != mark["path"]
+                or start != offset
+            ):
+
+                del self.frames[day]
+
+                return
+
+            self.frames[day] = (
+                pd.concat(
+                    [
+                        frame,
+                        rows_to_frame(rows),
+                    ],
+                    ignore_index=True,
+                ),
+                file_path,
+                mark["offset"],
+            )
+
+
+@st.cache_resource(
+    show_spinner=False
+)
+def get_day_frames():
+    """
+    Day cache shared by every session of this page.
+    """
+
+    return DayFrames()
+
+
+def empty_scan_frame():
+
+    return pd.DataFrame(
+        columns=[
+            "Barcode_ID",
+            "Timestamp",
+        ]
+    )
+
+
+def drop_voided(df):
+    """
+    Remove tombstone rows (see scan_storage.py) and the
+    scans they void.
+    """
+
+    tombstones = df["Barcode_ID"].str.startswith(
+        scan_storage.VOID_PREFIX
+    )
+
+    if not tombstones.any():
+        return df
+
+    voided = pd.MultiIndex.from_arrays(
+        [
+            df.loc[
+                tombstones,
+                "Barcode_ID",
+            ].str[len(scan_storage.VOID_PREFIX):],
+            df.loc[
+                tombstones,
+                "Timestamp",
+            ],
+        ]
+    )
+
+    df = df[~tombstones]
+
+    return df[
+        ~pd.MultiIndex.from_frame(
+            df[
+                [
+                    "Barcode_ID",
+                    "Timestamp",
+                ]
+            ]
+        ).isin(voided)
+    ].copy()
+
+
+def read_scan_file(scan_day, courier_column, unknown_courier):
+    """
+    Safely load and clean one day of scans, with the
+    courier of every scan in courier_column.
+    """
+
+    storage = get_scan_storage()
+
+    try:
+
+        if not storage.has_day(
+            scan_day
+        ):
+            return empty_scan_frame()
+
+        if storage.indexed:
+
+            df = load_scan_file(
+                scan_day,
+                storage.day_version(
+                    scan_day
+                ),
+            ).copy()
+
+        else:
+
+            df = get_day_frames().get(
+                scan_day
+            ).copy()
+
+    except Exception:
+
+        return empty_scan_frame()
+
+    return clean_scan_frame(
+        df,
+        courier_column,
+        unknown_courier,
+    )
+
+
+def search_scan_file(
+    scan_day,
+    barcode_query,
+    courier_column,
+    unknown_courier,
+):
+    """
+    read_scan_file() for the history search: of an
+    archived day only the blocks that can hold a match
+    are decompressed.
+    """
+
+    storage = get_scan_storage()
+
+    if storage.indexed:
+
+        return read_scan_file(
+            scan_day,
+            courier_column,
+            unknown_courier,
+        )
+
+    file_path = scan_storage.day_file(
+        DATA_DIR,
+        scan_day,
+    )
+
+    if not file_path.endswith(
+        scan_storage.ARCHIVE_EXTENSION
+    ):
+
+        return read_scan_file(
+            scan_day,
+            courier_column,
+            unknown_courier,
+        )
+
+    try:
+
+        rows = scan_storage.read_archive(
+            file_path,
+            barcode=barcode_query,
+        )
+
+    except (OSError, ValueError):
+
+        return empty_scan_frame()
+
+    return clean_scan_frame(
+        rows_to_frame(rows),
+        courier_column,
+        unknown_courier,
+    )
+
+
+def frame_summary(df):
+    """
+    The count/first/last part of a day manifest (see
+    day_manifest.py) for loaded scans; None counts as
+    no scans.
+    """
+
+    if df is None or df.empty:
+
+        return {
+            "count": 0,
+            "first": None,
+            "last": None,
+        }
+
+    return {
+        "count": len(df),
+        "first": df["Timestamp"].min().isoformat(),
+        "last": df["Timestamp"].max().isoformat(),
+    }
+
+
+def clean_scan_frame(df, courier_column, unknown_courier):
+    """
+    Strip IDs, drop voided scans and unreadable rows, and
+    add the courier column (formats in couriers.json) as
+    a categorical column.
+    """
+
+    if df.empty:
+        return df
+
+    df["Barcode_ID"] = (
+        df["Barcode_ID"]
+        .astype(str)
+        .str.strip()
+    )
+
+    df = drop_voided(df)
+
+    df[courier_column] = COURIERS.detect_series(
+        df["Barcode_ID"],
+        unknown_courier,
+    )
+
+    # Timestamps are already datetime64; unreadable ones
+    # are NaT.
+    df = df.dropna(
+        subset=[
+            "Timestamp",
+        ]
+    )
+
+    df = df[
+        df["Barcode_ID"] != ""
+    ]
+
+    return df.reset_index(
+        drop=True
+    )
@@ -0,0 +1,2990 @@
+import atexit
+import concurrent.futures
+import datetime
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+
+import barcode_index
+import cold_index
+import courier_rules
+import data_watcher
+import day_manifest
+import registry_snapshot
+import scan_storage
+import scan_writer
+
+
+# =========================================================
+# REGISTRY CONFIGURATION
+# =========================================================
+
+DATA_DIR = "data"
+
+# Courier barcode formats: couriers.json, compiled by
+# courier_rules.py.
+COURIERS = courier_rules.COURIERS
+
+# Scanner events holding several glued reads: keep every
+# valid barcode and report the invalid fragments (True),
+# or reject the whole event when any part is invalid
+# (False). See parse_scanner_segments().
+PARTIAL_SCAN_ACCEPT = True
+
+# "csv", "journal" or "sqlite", see scan_storage.py.
+STORAGE_BACKEND = scan_storage.STORAGE_BACKEND
+
+# Binary checkpoint of the registry, written at midnight
+# rollover and at shutdown so a restart only replays the
+# scans added since (see registry_snapshot.py).
+SNAPSHOT_ENABLED = True
+SNAPSHOT_FILE = os.path.join(
+    DATA_DIR,
+    "registry.snapshot",
+)
+
+# In-memory duplicate index:
+#     "compact"  per-courier int64 hash sets, ~10x smaller
+#                (see barcode_index.py)
+#     "dict"     plain {barcode: ISO timestamp} dict
+REGISTRY_INDEX = "compact"
+
+# Only the last HOT_DAYS days (today included) stay in the
+# in-memory index. Older days move to a sorted,
+# memory-mapped index in data/ that is probed only when
+# the in-memory index misses (see cold_index.py).
+# None keeps the whole history in memory.
+HOT_DAYS = 30
+
+# Group-commit writer durability (see scan_writer.py):
+#     "batch"     fsync every group commit
+#     "interval"  fsync at most every SYNC_INTERVAL_MS
+#     "os"        OS-buffered, never fsync
+WRITE_DURABILITY = "os"
+SYNC_INTERVAL_MS = 50
+
+# Load today's file first and stream older days in on a
+# background thread, so scanning is available right after
+# a restart.
+BACKGROUND_WARM_UP = True
+
+# Follow data/ for records appended by other processes or
+# day files copied in from another station (inotify on
+# Linux, polling elsewhere; see data_watcher.py).
+WATCH_DATA_DIR = True
+
+# Cold starts parse the daily files in this many processes
+# (1: in this process). Fewer than PARALLEL_LOAD_MIN_DAYS
+# files are always read in-process; starting the pool
+# would cost more than it saves.
+LOAD_WORKERS = os.cpu_count() or 1
+PARALLEL_LOAD_MIN_DAYS = 16
+
+# Address of a shared registry server (registry_server.py)
+# such as "127.0.0.1:8765" or "unix:/run/dispatcher.sock".
+# Empty: every app process embeds its own registry.
+REGISTRY_SERVER = os.environ.get(
+    "DISPATCHER_REGISTRY_SERVER",
+    "",
+)
+
+# Shared secret sent with every registry server call;
+# required when the server listens on TCP. Unix sockets
+# are only open to the server's user instead.
+REGISTRY_TOKEN = os.environ.get(
+    "DISPATCHER_REGISTRY_TOKEN",
+    "",
+)
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+
+# =========================================================
+# BARCODE VALIDATION + COURIER DETECTION
+# =========================================================
+
+def detect_courier(barcode):
+    """
+    Return the courier name for a supported barcode, or
+    None.
+
+    The formats come from couriers.json (see
+    courier_rules.py); by default:
+
+    Shopee SPX
+        SPXID06 + exactly 10 digits
+        Total length: 17
+
+    J&T Express
+        Starts with J
+        12 characters total
+        Remaining characters may be A-Z or 0-9
+
+    AnterAja
+        14 digits total, starting with 1
+    """
+
+    if barcode is None:
+        return None
+
+    return COURIERS.detect(
+        barcode
+    )
+
+
+def detect_courier_series(barcodes, unknown=None):
+    """
+    detect_courier() for a whole column at once: a
+    categorical Series of courier names, with unknown
+    where no format matches.
+    """
+
+    return COURIERS.detect_series(
+        barcodes,
+        unknown,
+    )
+
+
+def is_valid_barcode(barcode):
+    """
+    True only for a supported courier barcode.
+    """
+
+    return (
+        detect_courier(
+            barcode
+        )
+        is not None
+    )
+
+
+# =========================================================
+# SCANNER INPUT PARSER
+# =========================================================
+
+def parse_scanner_input(raw_input):
+    """
+    Parse one or more physical scanner reads.
+
+    The USB scanner can occasionally place rapid scans
+    together before Streamlit reruns. Because each courier
+    has a known prefix and fixed length, the input can be
+    safely split from left to right.
+
+    Supported blocks are the courier formats in
+    couriers.json; by default:
+        Shopee SPX : 17 chars, starts SPXID06
+        J&T        : 12 chars, starts J, A-Z / 0-9
+        AnterAja   : 14 digits, starts 1
+
+    Any unknown character, incomplete block, or invalid
+    barcode causes the complete scanner event to be rejected.
+    """
+
+    cleaned = clean_scanner_input(
+        raw_input
+    )
+
+    if not cleaned:
+        return []
+
+    return COURIERS.split(
+        cleaned
+    )
+
+
+def parse_scanner_segments(raw_input):
+    """
+    Partial-accept parse of one scanner event.
+
+    A corrupt block does not reject the whole event as in
+    parse_scanner_input(): every valid block is kept, and
+    after invalid text the parser resynchronises where
+    the next valid barcode starts.
+
+    Returns one dict per segment, in input order:
+        {"text": ..., "courier": name}  valid barcode
+        {"text": ..., "courier": None}  rejected fragment
+    """
+
+    cleaned = clean_scanner_input(
+        raw_input
+    )
+
+    return [
+        {
+            "text": cleaned[start:end],
+            "courier": (
+                rule.name
+                if rule is not None
+                else None
+            ),
+        }
+        for start, end, rule in COURIERS.segments(
+            cleaned
+        )
+    ]
+
+
+def clean_scanner_input(raw_input):
+    """
+    Scanner input without whitespace, upper case.
+    """
+
+    if raw_input is None:
+        return ""
+
+    return re.sub(
+        r"\s+",
+        "",
+        str(raw_input),
+    ).upper()
+
+
+def scan_day(timestamp):
+    """
+    Day (YYYY-MM-DD) of an ISO scan timestamp; raises
+    ValueError if it is not one.
+    """
+
+    return (
+        datetime.datetime.fromisoformat(timestamp)
+        .date()
+        .isoformat()
+    )
+
+
+def is_storable_scan(barcode, timestamp, today):
+    """
+    True if barcode is one normalized barcode and
+    timestamp, when given, an ISO scan time no later than
+    today, as import_scans.py requires.
+
+    submit_batch() checks every scan again, since
+    registry_server.py passes on whatever a client sends.
+    """
+
+    if (
+        not isinstance(barcode, str)
+        or parse_scanner_input(barcode) != [barcode]
+    ):
+        return False
+
+    if timestamp is None:
+        return True
+
+    try:
+
+        return scan_day(timestamp) <= today
+
+    except (TypeError, ValueError):
+        return False
+
+
+def split_stored_value(stored_value):
+    """
+    [(barcode, courier), ...] held by one stored value;
+    day_manifest.update_manifest() counts them.
+    """
+
+    return [
+        (
+            barcode,
+            detect_courier(barcode),
+        )
+        for barcode in parse_scanner_input(
+            stored_value
+        )
+    ]
+
+
+# =========================================================
+# PARALLEL HISTORY LOADING
+# =========================================================
+
+def read_day_records(file_path, offset=0):
+    """
+    Read and parse one daily file after offset.
+
+    Returns (records, mark, voids, stats) with records as
+    [(barcode, timestamp), ...] in file order, voids as
+    the tombstones for records before offset (see
+    scan_storage.apply_tombstones) and stats as
+    {seconds, rows, skipped} for the diagnostics, or None
+    when the file cannot be read. Also runs in loader
+    processes.
+    """
+
+    started = time.perf_counter()
+
+    records = []
+
+    try:
+
+        clean_mark = scan_storage.read_clean_mark(
+            file_path
+        )
+
+        if (
+            clean_mark is not None
+            and offset < clean_mark["offset"]
+        ):
+
+            # Compacted (compact_history.py): one
+            # normalized barcode per record, no parsing.
+            records, _ = scan_storage.read_scan_rows_from(
+                file_path,
+                offset,
+                clean_mark["offset"],
+            )
+
+            offset = clean_mark["offset"]
+
+        rows, mark = scan_storage.read_scan_rows_from(
+            file_path,
+            offset,
+        )
+
+    except Exception:
+        return None
+
+    clean_count = len(records)
+
+    rows, voids = scan_storage.apply_tombstones(
+        rows
+    )
+
+    skipped = 0
+
+    for stored_value, timestamp in rows:
+
+        # Also understands older accidentally merged
+        # records.
+        barcodes = parse_scanner_input(
+            stored_value
+        )
+
+        if not barcodes:
+
+            skipped += 1
+
+            continue
+
+        records.extend(
+            (
+                barcode,
+                timestamp,
+            )
+            for barcode in barcodes
+        )
+
+    stats = {
+        "seconds": time.perf_counter() - started,
+        "rows": clean_count + len(rows),
+        "skipped": skipped,
+    }
+
+    return records, mark, voids, stats
+
+
+def _read_day_records_job(job):
+
+    return read_day_records(*job)
+
+
+def iter_day_records(jobs):
+    """
+    Yield (file_date, read_day_records() result) for
+    [(file_date, file_path, offset), ...] in the given
+    order.
+
+    With enough files they are parsed in a process pool;
+    results still arrive in order, so callers merge them
+    exactly as a sequential load would.
+    """
+
+    jobs = list(jobs)
+
+    done = 0
+
+    if (
+        LOAD_WORKERS > 1
+        and len(jobs) >= PARALLEL_LOAD_MIN_DAYS
+    ):
+
+        try:
+
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=LOAD_WORKERS
+            ) as pool:
+
+                for result in pool.map(
+                    _read_day_records_job,
+                    [
+                        (
+                            file_path,
+                            offset,
+                        )
+                        for _, file_path, offset in jobs
+                    ],
+                    chunksize=max(
+                        len(jobs) // (LOAD_WORKERS * 4),
+                        1,
+                    ),
+                ):
+
+                    yield jobs[done][0], result
+
+                    done += 1
+
+        except Exception:
+
+            # No pool available (or it broke): read the
+            # remaining files here.
+            pass
+
+    for file_date, file_path, offset in jobs[done:]:
+
+        yield file_date, read_day_records(
+            file_path,
+            offset,
+        )
+
+
+# =========================================================
+# DIAGNOSTICS
+# =========================================================
+
+# Entries measured when estimating the bytes of the
+# in-memory containers.
+DIAGNOSTICS_SAMPLE = 1000
+
+
+def _count_couriers(barcodes, counts):
+    """
+    Add the barcodes to a {courier: count} dict and
+    return it.
+    """
+
+    for barcode in barcodes:
+
+        courier = (
+            detect_courier(barcode)
+            or "Unknown"
+        )
+
+        counts[courier] = counts.get(
+            courier,
+            0,
+        ) + 1
+
+    return counts
+
+
+def _estimate_bytes(container):
+    """
+    Estimated bytes of a dict of str -> str or a list of
+    tuples of str, including the objects it holds.
+    """
+
+    if isinstance(container, dict):
+
+        sample = [
+            sys.getsizeof(key) + sys.getsizeof(value)
+            for key, value in itertools.islice(
+                container.items(),
+                DIAGNOSTICS_SAMPLE,
+            )
+        ]
+
+    else:
+
+        sample = [
+            sys.getsizeof(item)
+            + sum(
+                sys.getsizeof(value)
+                for value in item
+            )
+            for item in itertools.islice(
+                container,
+                DIAGNOSTICS_SAMPLE,
+            )
+        ]
+
+    per_item = (
+        sum(sample) / len(sample)
+        if sample
+        else 0
+    )
+
+    return int(
+        sys.getsizeof(container)
+        + per_item * len(container)
+    )
+
+
+# =========================================================
+# BARCODE REGISTRY
+# =========================================================
+
+class BarcodeRegistry:
+    """
+    Fast shared registry.
+
+    Duplicate lookup:
+        O(1) in-memory, or an indexed SQLite
+        query with the sqlite backend
+
+    Storage:
+        daily CSV, daily binary journal or
+        shared SQLite database
+        (see scan_storage.py)
+
+    Duplicate IDs never reach CSV writing.
+    """
+
+    def __init__(self, warm_up=False):
+
+        self.lock = threading.RLock()
+
+        # barcode -> first successful timestamp, for the
+        # days in the in-memory window (HOT_DAYS).
+        self.codes = self._new_index()
+
+        # Days before the window (see cold_index.py).
+        self.cold = cold_index.ColdIndex()
+
+        self.current_day = (
+            datetime.date.today()
+            .isoformat()
+        )
+
+        # Successful records for today only.
+        self.today_records = []
+
+        # day -> high-water mark of its daily file.
+        self.file_marks = {}
+
+        # Days before the window whose new records (old
+        # scans imported, or merged from another process)
+        # sit in codes until _demote_aged_days().
+        self.aged_days = set()
+
+        # Days not loaded yet while warming up.
+        self.pending_days = set()
+        self.total_days = 0
+        self.warm_up_done = threading.Event()
+
+        # How the history was loaded, for the diagnostics:
+        # per-day read and parse time, rows read and rows
+        # skipped as unparsable.
+        self.load_stats = {
+            "mode": None,
+            "seconds": None,
+            "files": {},
+            "rows": 0,
+            "skipped_rows": 0,
+        }
+
+        self.load_started = time.perf_counter()
+
+        self.storage = scan_storage.open_storage(
+            DATA_DIR,
+            STORAGE_BACKEND,
+        )
+
+        # Truncate torn tails left by a crash before any
+        # day is read or appended to.
+        self.recovery_report = self.storage.recover()
+
+        # Per-day counts for the totals, O(days) to sum
+        # (see day_manifest.py). Missing manifests are
+        # built once by _load_manifests(), on the warm-up
+        # thread when warming up.
+        self.manifests = None
+
+        self.manifests_ready = threading.Event()
+
+        if not self.storage.indexed:
+
+            self.manifests = day_manifest.DayManifests(
+                DATA_DIR,
+                split_stored_value,
+            )
+
+        # Subscribed before loading so nothing appended
+        # while the history loads is missed. Shared with
+        # the history pages of this process.
+        self.watcher = None
+
+        if WATCH_DATA_DIR:
+
+            self.watcher = data_watcher.shared_watcher(
+                DATA_DIR
+            )
+
+            self.watcher.subscribe(
+                self._ingest_changes
+            )
+
+        # All storage writes go through one thread.
+        self.writer = scan_writer.ScanWriter(
+            self.storage,
+            durability=WRITE_DURABILITY,
+            sync_interval_ms=SYNC_INTERVAL_MS,
+        )
+
+        if (
+            warm_up
+            and not self.storage.indexed
+        ):
+
+            self.load_stats["mode"] = "warm-up"
+
+            self._start_warm_up()
+
+        else:
+
+            self._load_manifests()
+
+            self._load_existing_data()
+
+            self.load_stats["seconds"] = (
+                time.perf_counter() - self.load_started
+            )
+
+            self.warm_up_done.set()
+
+        atexit.register(
+            self.close
+        )
+
+
+    # =====================================================
+    # LOAD EXISTING DATA
+    # =====================================================
+
+    def _load_existing_data(self):
+
+        # An indexed store answers lookups itself; only the
+        # daily files written before it existed are
+        # imported, once.
+        if self.storage.indexed:
+
+            self.load_stats["mode"] = "indexed"
+
+            if self.storage.needs_import():
+
+                self._import_file_history()
+
+            return
+
+        self.load_stats["mode"] = "full"
+
+        file_dates = self.storage.list_days()
+
+        self._update_cold_tier(
+            *self._open_cold_tier(
+                file_dates
+            )
+        )
+
+        if (
+            SNAPSHOT_ENABLED
+            and self._resume_from_snapshot()
+        ):
+
+            self.load_stats["mode"] = "snapshot"
+
+            return
+
+        self.codes = self._new_index()
+        self.today_records = []
+        self.file_marks = {}
+
+        # Date order keeps the first occurrence of every
+        # barcode.
+        for file_date, result in iter_day_records(
+            self._day_jobs(
+                self._hot_days(file_dates)
+            )
+        ):
+
+            self._index_day(
+                file_date,
+                result,
+            )
+
+
+    @staticmethod
+    def _new_index():
+
+        if REGISTRY_INDEX == "compact":
+            return barcode_index.CompactBarcodeIndex()
+
+        return {}
+
+
+    def _day_jobs(self, file_dates, marks=None):
+        """
+        iter_day_records() jobs, resuming at the marks'
+        offsets.
+        """
+
+        marks = marks or {}
+
+        return [
+            (
+                file_date,
+                scan_storage.day_file(
+                    self.storage.data_dir,
+                    file_date,
+                ),
+                marks.get(
+                    file_date,
+                    {},
+                ).get(
+                    "offset",
+                    0,
+                ),
+            )
+            for file_date in file_dates
+        ]
+
+
+    def _load_day(
+        self,
+        file_date,
+        offset=0,
+        keep_earliest=False,
+    ):
+        """
+        Load the records stored in one daily file after
+        offset and advance its high-water mark.
+        """
+
+        self._index_day(
+            file_date,
+            read_day_records(
+                scan_storage.day_file(
+                    self.storage.data_dir,
+                    file_date,
+                ),
+                offset,
+            ),
+            keep_earliest,
+        )
+
+
+    def _index_day(
+        self,
+        file_date,
+        result,
+        keep_earliest=False,
+    ):
+        """
+        Add one read_day_records() result to the index.
+
+        keep_earliest is used when days are loaded out of
+        order: the earliest timestamp wins instead of the
+        first one loaded.
+        """
+
+        if result is None:
+            return
+
+        records, mark, voids, stats = result
+
+        self._record_load(
+            file_date,
+            stats,
+        )
+
+        self.file_marks[
+            file_date
+        ] = mark
+
+        is_today = (
+            file_date == self.current_day
+        )
+
+        if isinstance(
+            self.codes,
+            barcode_index.CompactBarcodeIndex,
+        ):
+
+            # Whole file in vectorized passes.
+            self.codes.update_records(
+                records,
+                keep_earliest,
+            )
+
+        else:
+
+            for barcode, timestamp in records:
+
+                # Keep first successful occurrence.
+                stored_timestamp = self.codes.setdefault(
+                    barcode,
+                    timestamp,
+                )
+
+                if (
+                    keep_earliest
+                    and timestamp
+                    < stored_timestamp
+                ):
+
+                    self.codes[
+                        barcode
+                    ] = timestamp
+
+        if is_today:
+
+            self.today_records.extend(
+                (
+                    barcode,
+                    timestamp,
+                )
+                for barcode, timestamp in records
+            )
+
+        for barcode, timestamp in voids:
+
+            self._apply_void(
+                file_date,
+                barcode,
+                timestamp,
+            )
+
+
+    def _record_load(self, file_date, stats):
+        """
+        Add one read_day_records() stats dict to the load
+        diagnostics.
+        """
+
+        with self.lock:
+
+            entry = self.load_stats["files"].setdefault(
+                file_date,
+                {
+                    "seconds": 0.0,
+                    "rows": 0,
+                    "skipped": 0,
+                },
+            )
+
+            for key in entry:
+                entry[key] += stats[key]
+
+            self.load_stats["rows"] += stats["rows"]
+            self.load_stats["skipped_rows"] += stats[
+                "skipped"
+            ]
+
+
+    # =====================================================
+    # COLD TIER
+    # =====================================================
+
+    def _hot_cutoff(self):
+        """
+        First day of the in-memory window, or None when
+        the whole history is kept in memory.
+        """
+
+        if not HOT_DAYS:
+            return None
+
+        return (
+            datetime.date.fromisoformat(
+                self.current_day
+            )
+            - datetime.timedelta(
+                days=HOT_DAYS - 1
+            )
+        ).isoformat()
+
+
+    def _hot_days(self, file_dates):
+
+        cutoff = self._hot_cutoff()
+
+        return [
+            file_date
+            for file_date in file_dates
+            if cutoff is None
+            or file_date >= cutoff
+        ]
+
+
+    def _open_cold_tier(self, file_dates):
+        """
+        Open the newest cold index.
+
+        Returns (days, rebuild): the days before the window
+        it does not cover yet, and whether it must be built
+        again from scratch because a covered day file
+        changed or disappeared.
+        """
+
+        if self._hot_cutoff() is None:
+            return [], False
+
+        self.cold = cold_index.open_cold_index(
+            DATA_DIR
+        )
+
+        return self._stale_cold_days(
+            file_dates
+        )
+
+
+    def _stale_cold_days(self, file_dates):
+        """
+        (days, rebuild) as _open_cold_tier() returns them,
+        for the cold index already open.
+        """
+
+        cutoff = self._hot_cutoff()
+
+        if cutoff is None:
+            return [], False
+
+        cold_days = [
+            file_date
+            for file_date in file_dates
+            if file_date < cutoff
+        ]
+
+        covered = self.cold.days
+
+        if set(covered) <= set(cold_days) and all(
+            self.storage.check_mark(
+                file_date,
+                mark,
+            ) == "unchanged"
+            for file_date, mark in covered.items()
+        ):
+
+            return [
+                file_date
+                for file_date in cold_days
+                if file_date not in covered
+            ], False
+
+        return cold_days, True
+
+
+    def _update_cold_tier(self, file_dates, rebuild=False):
+        """
+        Write a new cold index generation with these days
+        added (or holding only these days, with rebuild)
+        and switch lookups over to it.
+
+        The day files are read without holding the lock.
+        """
+
+        if not file_dates and not rebuild:
+            return
+
+        def day_records():
+
+            for file_date, result in iter_day_records(
+                self._day_jobs(file_dates)
+            ):
+
+                if result is not None:
+
+                    records, mark, _, stats = result
+
+                    self._record_load(
+                        file_date,
+                        stats,
+                    )
+
+                    yield file_date, records, mark
+
+        index = cold_index.build_cold_index(
+            DATA_DIR,
+            day_records(),
+            None if rebuild else self.cold,
+        )
+
+        with self.lock:
+
+            previous = self.cold
+
+            index.stats = previous.stats
+
+            self.cold = index
+
+            self.pending_days.difference_update(
+                file_dates
+            )
+
+        previous.close()
+
+        cold_index.remove_old_generations(
+            DATA_DIR,
+            index.path,
+        )
+
+
+    def _forget_day(self, codes, file_date):
+        """
+        Drop one day's barcodes from an in-memory index.
+
+        Returns False if the day file cannot be read.
+        """
+
+        result = read_day_records(
+            scan_storage.day_file(
+                self.storage.data_dir,
+                file_date,
+            )
+        )
+
+        if result is None:
+            return False
+
+        records = result[0]
+
+        # Days are forgotten oldest first, so any entry for
+        # these barcodes came from this day or an earlier
+        # one.
+        for barcode, _ in records:
+
+            if barcode in codes:
+                del codes[barcode]
+
+        return True
+
+
+    def _demote_aged_days(self):
+        """
+        Move the days that have left the window since the
+        last rollover, and the records written to older
+        days since (see aged_days), from memory to the
+        cold index.
+        """
+
+        cutoff = self._hot_cutoff()
+
+        if cutoff is None:
+            return
+
+        with self.lock:
+
+            aged_days = sorted(
+                {
+                    file_date
+                    for file_date in self.file_marks
+                    if file_date < cutoff
+                }
+                | self.aged_days
+            )
+
+        if not aged_days:
+            return
+
+        self._update_cold_tier(
+            aged_days
+        )
+
+        with self.lock:
+
+            for file_date in aged_days:
+
+                if self._forget_demoted_day(
+                    file_date
+                ):
+                    self.aged_days.discard(file_date)
+
+                self.file_marks.pop(
+                    file_date,
+                    None,
+                )
+
+        self.save_snapshot()
+
+
+    def _forget_demoted_day(self, file_date):
+        """
+        Drop one demoted day's barcodes from codes, keeping
+        any the new cold index does not hold yet (written
+        while it was built).
+
+        Returns False if some were kept.
+        """
+
+        result = read_day_records(
+            scan_storage.day_file(
+                self.storage.data_dir,
+                file_date,
+            )
+        )
+
+        if result is None:
+            return True
+
+        barcodes = [
+            barcode
+            for barcode, _ in result[0]
+            if barcode in self.codes
+        ]
+
+        in_cold = self.cold.lookup(
+            barcodes
+        )
+
+        for barcode in in_cold:
+            del self.codes[barcode]
+
+        return len(in_cold) == len(barcodes)
+
+
+    # =====================================================
+    # SNAPSHOT
+    # =====================================================
+
+    def _resume_from_snapshot(self):
+        """
+        Start from the snapshot and replay only the bytes
+        added after each file's high-water mark.
+
+        Returns False when the snapshot is missing or a
+        marked file was rewritten, so a full load is
+        needed.
+        """
+
+        file_dates = self._hot_days(
+            self.storage.list_days()
+        )
+
+        snapshot = self._read_snapshot(
+            file_dates
+        )
+
+        if snapshot is None:
+            return False
+
+        codes, marks, changes = snapshot
+
+        self.codes = codes
+
+        for file_date in file_dates:
+
+            # Today's records are always read in full
+            # for the today table; the file is small.
+            if file_date == self.current_day:
+
+                self._load_day(
+                    file_date
+                )
+
+                continue
+
+            if file_date not in marks:
+
+                self._load_day(
+                    file_date
+                )
+
+                continue
+
+            if changes[file_date] == "unchanged":
+
+                self.file_marks[
+                    file_date
+                ] = marks[file_date]
+
+                continue
+
+            self._load_day(
+                file_date,
+                marks[file_date]["offset"],
+            )
+
+        return True
+
+
+    def _read_snapshot(self, file_dates):
+        """
+        Return (codes, marks, changes) from a snapshot that
+        is still consistent with the daily files, else None.
+
+        changes maps each marked day to the result of
+        scan_storage.check_mark().
+        """
+
+        if not SNAPSHOT_ENABLED:
+            return None
+
+        snapshot = registry_snapshot.load_snapshot(
+            SNAPSHOT_FILE
+        )
+
+        if snapshot is None:
+            return None
+
+        codes, marks = snapshot
+
+        # Written with another REGISTRY_INDEX setting.
+        if not isinstance(
+            codes,
+            type(self._new_index()),
+        ):
+            return None
+
+        # Days that have left the window since; they are
+        # in the cold index now.
+        cutoff = self._hot_cutoff()
+
+        for file_date in set(marks) - set(file_dates):
+
+            if (
+                cutoff is None
+                or file_date >= cutoff
+                or not self._forget_day(
+                    codes,
+                    file_date,
+                )
+            ):
+                return None
+
+            del marks[file_date]
+
+        changes = {}
+
+        for file_date, mark in marks.items():
+
+            changes[file_date] = (
+                self.storage.check_mark(
+                    file_date,
+                    mark,
+                )
+            )
+
+            if changes[file_date] == "rewritten":
+                return None
+
+        return codes, marks, changes
+
+
+    def save_snapshot(self):
+        """
+        Catch up every closed day's file, then write the
+        snapshot.
+        """
+
+        if (
+            not SNAPSHOT_ENABLED
+            or self.storage.indexed
+            or not self.warm_up_done.is_set()
+        ):
+            return
+
+        with self.lock:
+
+            for file_date in self._hot_days(
+                self.storage.list_days()
+            ):
+
+                if file_date == self.current_day:
+                    continue
+
+                mark = self.file_marks.get(
+                    file_date
+                )
+
+                if mark is None:
+
+                    self._load_day(
+                        file_date
+                    )
+
+                    continue
+
+                change = self.storage.check_mark(
+                    file_date,
+                    mark,
+                )
+
+                if change == "appended":
+
+                    self._load_day(
+                        file_date,
+                        mark["offset"],
+                    )
+
+                elif change == "rewritten":
+
+                    self._load_day(
+                        file_date
+                    )
+
+            try:
+
+                registry_snapshot.save_snapshot(
+                    SNAPSHOT_FILE,
+                    self.codes,
+                    self.file_marks,
+                )
+
+            except Exception:
+                pass
+
+
+    def close(self):
+
+        # Closed once: a second save_snapshot() would write
+        # wherever the process is by then.
+        atexit.unregister(
+            self.close
+        )
+
+        if self.watcher is not None:
+
+            self.watcher.unsubscribe(
+                self._ingest_changes
+            )
+
+        try:
+
+            self.writer.close()
+
+        except Exception:
+            pass
+
+        # e.g. import_scans.py: old scans go to the cold
+        # index now, not at some later rollover.
+        if self.aged_days:
+
+            self._demote_aged_days()
+
+        else:
+
+            self.save_snapshot()
+
+        self.cold.close()
+
+        try:
+
+            self.storage.close()
+
+        except Exception:
+            pass
+
+
+    def _import_file_history(self):
+
+        file_storage = scan_storage.CsvStorage(
+            DATA_DIR
+        )
+
+        for file_date in file_storage.list_days():
+
+            try:
+
+                rows = file_storage.read_day(
+                    file_date
+                )
+
+            except Exception:
+                continue
+
+            self.storage.import_rows(
+                file_date,
+                [
+                    (
+                        barcode,
+                        timestamp,
+                    )
+                    for stored_value, timestamp in (
+                        scan_storage.apply_tombstones(
+                            rows
+                        )[0]
+                    )
+                    for barcode in parse_scanner_input(
+                        stored_value
+                    )
+                ],
+            )
+
+        self.storage.mark_imported()
+
+
+    # =====================================================
+    # BACKGROUND WARM-UP
+    # =====================================================
+
+    def _start_warm_up(self):
+        """
+        Load today's file now and older days on a
+        background thread.
+        """
+
+        all_dates = self.storage.list_days()
+
+        # The cold index is usually current already; days
+        # it still lacks are brought in by the warm-up and
+        # checked on demand until then, like any pending
+        # day.
+        cold_days, rebuild_cold = self._open_cold_tier(
+            all_dates
+        )
+
+        file_dates = self._hot_days(
+            all_dates
+        )
+
+        self.total_days = len(file_dates) + len(
+            cold_days
+        )
+
+        with self.lock:
+
+            if self.current_day in file_dates:
+
+                self._load_day(
+                    self.current_day
+                )
+
+            self.pending_days = {
+                file_date
+                for file_date in file_dates + cold_days
+                if file_date != self.current_day
+            }
+
+        threading.Thread(
+            target=self._warm_up,
+            args=(
+                file_dates,
+                cold_days,
+                rebuild_cold,
+            ),
+            name="registry-warm-up",
+            daemon=True,
+        ).start()
+
+
+    def _warm_up(
+        self,
+        file_dates,
+        cold_days,
+        rebuild_cold,
+    ):
+
+        try:
+
+            self._load_manifests()
+
+            snapshot = self._read_snapshot(
+                file_dates
+            )
+
+            marks = {}
+
+            if snapshot is not None:
+
+                codes, marks, changes = snapshot
+
+                self._merge_snapshot(
+                    codes,
+                    marks,
+                    changes,
+                )
+
+            with self.lock:
+
+                # Most recent days first: they are the most
+                # likely to hold a re-scanned parcel.
+                jobs = self._day_jobs(
+                    sorted(
+                        self.pending_days.difference(
+                            cold_days
+                        ),
+                        reverse=True,
+                    ),
+                    marks,
+                )
+
+            for file_date, result in iter_day_records(
+                jobs
+            ):
+
+                with self.lock:
+
+                    self._index_pending_day(
+                        file_date,
+                        result,
+                    )
+
+            self._update_cold_tier(
+                cold_days,
+                rebuild_cold,
+            )
+
+        finally:
+
+            with self.lock:
+
+                self.pending_days = set()
+
+                self.load_stats["seconds"] = (
+                    time.perf_counter()
+                    - self.load_started
+                )
+
+            self.warm_up_done.set()
+
+
+    def _merge_snapshot(self, codes, marks, changes):
+        """
+        Swap in the snapshot's codes, keeping anything
+        loaded meanwhile if it is earlier.
+        """
+
+        with self.lock:
+
+            for barcode, timestamp in self.codes.items():
+
+                if (
+                    barcode not in codes
+                    or timestamp < codes[barcode]
+                ):
+
+                    codes[barcode] = timestamp
+
+            self.codes = codes
+
+            for file_date, change in changes.items():
+
+                if (
+                    change != "unchanged"
+                    or file_date not in self.pending_days
+                ):
+                    continue
+
+                self.file_marks[
+                    file_date
+                ] = marks[file_date]
+
+                self.pending_days.discard(
+                    file_date
+                )
+
+
+    def _index_pending_day(self, file_date, result):
+        """
+        Index a pending day read outside the lock, unless
+        it was loaded meanwhile. Called with self.lock
+        held.
+        """
+
+        if file_date not in self.pending_days:
+            return
+
+        self._index_day(
+            file_date,
+            result,
+            keep_earliest=True,
+        )
+
+        # Catch up with anything appended since it was
+        # read.
+        mark = self.file_marks.get(
+            file_date
+        )
+
+        if (
+            mark is not None
+            and self.storage.check_mark(
+                file_date,
+                mark,
+            ) == "appended"
+        ):
+
+            self._load_day(
+                file_date,
+                mark["offset"],
+                keep_earliest=True,
+            )
+
+        self.pending_days.discard(
+            file_date
+        )
+
+
+    def _check_pending_days(self, barcodes):
+        """
+        Load, on demand, every day still pending that may
+        contain one of these barcodes, so duplicate checks
+        are correct while warm-up is running.
+
+        Called before taking self.lock: the pending files
+        are searched and read without it, so scans from
+        other sessions are not held up, and each day found
+        is indexed under the lock only if the warm-up has
+        not loaded it meanwhile.
+        """
+
+        with self.lock:
+
+            if not self.pending_days:
+                return
+
+            pending = sorted(
+                self.pending_days
+            )
+
+            unknown = [
+                barcode.encode("utf-8")
+                for barcode in barcodes
+                if barcode not in self.codes
+            ]
+
+        if not unknown:
+            return
+
+        for file_date in pending:
+
+            file_path = scan_storage.day_file(
+                DATA_DIR,
+                file_date,
+            )
+
+            try:
+
+                if file_path.endswith(
+                    scan_storage.ARCHIVE_EXTENSION
+                ):
+
+                    # Compressed: ask the block index.
+                    found = scan_storage.archive_may_contain(
+                        file_path,
+                        [
+                            barcode.decode("utf-8")
+                            for barcode in unknown
+                        ],
+                    )
+
+                else:
+
+                    with open(
+                        file_path,
+                        "rb",
+                    ) as file:
+
+                        data = file.read()
+
+                    found = any(
+                        barcode in data
+                        for barcode in unknown
+                    )
+
+            except (OSError, ValueError):
+                continue
+
+            if not found:
+                continue
+
+            result = read_day_records(
+                file_path
+            )
+
+            with self.lock:
+
+                self._index_pending_day(
+                    file_date,
+                    result,
+                )
+
+
+    def get_load_progress(self):
+        """
+        Days loaded so far while warming up.
+        """
+
+        with self.lock:
+
+            return {
+                "loaded": (
+                    self.total_days
+                    - len(self.pending_days)
+                ),
+                "total": self.total_days,
+                "done": self.warm_up_done.is_set(),
+            }
+
+
+    # =====================================================
+    # STORED LOOKUP
+    # =====================================================
+
+    def _lookup_stored(self, barcodes):
+        """
+        Return {barcode: first timestamp} for IDs already
+        stored.
+
+        While warming up, call _check_pending_days() first,
+        without the lock.
+        """
+
+        if self.storage.indexed:
+
+            return self.storage.lookup(
+                barcodes
+            )
+
+        self._merge_appended()
+
+        stored_codes = {
+            barcode: self.codes[barcode]
+            for barcode in barcodes
+            if barcode in self.codes
+        }
+
+        # Older history is only probed on a miss.
+        missed = [
+            barcode
+            for barcode in barcodes
+            if barcode not in stored_codes
+        ]
+
+        if missed:
+
+            stored_codes.update(
+                self.cold.lookup(missed)
+            )
+
+        return stored_codes
+
+
+    def _merge_appended(self):
+        """
+        Merge today's records appended by other app
+        processes sharing the data directory.
+        """
+
+        # Loading today's file will include them.
+        if self.current_day in self.pending_days:
+            return
+
+        for file_date, stored_value, timestamp in (
+            self.storage.poll_appended(
+                self.current_day
+            )
+        ):
+
+            self._merge_rows(
+                file_date,
+                [
+                    (
+                        stored_value,
+                        timestamp,
+                    )
+                ],
+            )
+
+
+    def _merge_rows(self, file_date, rows):
+        """
+        Add stored records this registry has not seen yet.
+        """
+
+        rows, voids = scan_storage.apply_tombstones(
+            rows
+        )
+
+        with self.lock:
+
+            for barcode, timestamp in voids:
+
+                self._apply_void(
+                    file_date,
+                    barcode,
+                    timestamp,
+                )
+
+            records = [
+                (
+                    barcode,
+                    timestamp,
+                )
+                for stored_value, timestamp in rows
+                for barcode in parse_scanner_input(
+                    stored_value
+                )
+                if barcode not in self.codes
+            ]
+
+            # e.g. an old day file copied in again.
+            in_cold = self.cold.lookup(
+                [
+                    barcode
+                    for barcode, _ in records
+                ]
+            )
+
+            cutoff = self._hot_cutoff()
+
+            for barcode, timestamp in records:
+
+                if (
+                    barcode in self.codes
+                    or barcode in in_cold
+                ):
+                    continue
+
+                self.codes[
+                    barcode
+                ] = timestamp
+
+                if (
+                    cutoff is not None
+                    and file_date < cutoff
+                ):
+                    self.aged_days.add(file_date)
+
+                if file_date == self.current_day:
+
+                    self.today_records.append(
+                        (
+                            barcode,
+                            timestamp,
+                        )
+                    )
+
+
+    def _ingest_changes(self, file_date, rows, start, mark):
+        """
+        Data watcher callback: records appended to (or a
+        rewrite of) one day file.
+        """
+
+        if self.storage.indexed:
+
+            rows, voids = scan_storage.apply_tombstones(
+                rows
+            )
+
+            self.storage.import_rows(
+                file_date,
+                [
+                    (
+                        barcode,
+                        timestamp,
+                    )
+                    for stored_value, timestamp in rows
+                    for barcode in parse_scanner_input(
+                        stored_value
+                    )
+                ],
+            )
+
+            if voids:
+
+                # Stored as deletions (SqliteStorage.append).
+                self.storage.append(
+                    file_date,
+                    [
+                        [
+                            scan_storage.tombstone_value(
+                                barcode
+                            ),
+                            timestamp,
+                        ]
+                        for barcode, timestamp in voids
+                    ],
+                )
+
+            return
+
+        self._refresh_manifests(
+            [file_date]
+        )
+
+        with self.lock:
+
+            # Loading the day will include them.
+            if file_date in self.pending_days:
+                return
+
+            self._merge_rows(
+                file_date,
+                rows,
+            )
+
+
+    def _load_manifests(self):
+        """
+        Read, or build, the manifest of every day file.
+        """
+
+        try:
+
+            if self.manifests is not None:
+                self.manifests.refresh()
+
+        finally:
+
+            self.manifests_ready.set()
+
+
+    def _refresh_manifests(self, file_dates):
+
+        if self.manifests is not None:
+
+            self.manifests.refresh(
+                file_dates
+            )
+
+
+    # =====================================================
+    # MIDNIGHT HANDLING
+    # =====================================================
+
+    def ensure_current_day(self):
+
+        today = (
+            datetime.date.today()
+            .isoformat()
+        )
+
+        if self.current_day == today:
+            return
+
+        with self.lock:
+
+            if self.current_day == today:
+                return
+
+            closed_day = self.current_day
+
+            self.current_day = today
+            self.today_records = []
+
+            # Journal storage exports the closed day to CSV.
+            try:
+
+                self.writer.flush()
+
+                self.storage.close_day(
+                    closed_day
+                )
+
+            except Exception:
+                pass
+
+            self.save_snapshot()
+
+        if HOT_DAYS:
+
+            threading.Thread(
+                target=self._demote_aged_days,
+                name="registry-demote",
+                daemon=True,
+            ).start()
+
+
+    # =====================================================
+    # PROCESS SCAN BATCH
+    # =====================================================
+
+    def process_batch(self, barcodes, timestamps=None):
+        """
+        Process rapid scans under one lock.
+
+        Duplicate checking happens BEFORE file writing.
+
+        Therefore:
+        - duplicates are never stored
+        - invalid scans are never stored
+
+        Waits for the writer's acknowledgement, so every
+        returned status is final.
+
+        timestamps, one ISO timestamp per barcode, keeps
+        the original scan times of an import (see
+        import_scans.py); each record is stored in the
+        day file of its timestamp. Default: now.
+
+        Stored scans carry the writer's "sync_error" when
+        it could not fsync them (see scan_writer.py); they
+        stay stored and reserved.
+        """
+
+        results, acknowledgement = self.submit_batch(
+            barcodes,
+            timestamps,
+        )
+
+        if acknowledgement is None:
+            return results
+
+        try:
+
+            # Rows another process stored first.
+            rejected_codes = acknowledgement.result()
+
+        except Exception as exc:
+
+            self._release_reserved(
+                [
+                    (
+                        result["barcode"],
+                        result["timestamp"],
+                    )
+                    for result in results
+                    if result["status"] == "success"
+                ]
+            )
+
+            for result in results:
+
+                if result[
+                    "status"
+                ] in (
+                    "success",
+                    "pending_duplicate",
+                ):
+
+                    result[
+                        "status"
+                    ] = "error"
+
+                    result[
+                        "message"
+                    ] = str(exc)
+
+            return results
+
+
+        if timestamps is None:
+
+            written_days = [
+                self.current_day
+            ]
+
+        else:
+
+            written_days = sorted(
+                {
+                    scan_day(
+                        result["timestamp"]
+                    )
+                    for result in results
+                    if result["status"] == "success"
+                }
+            )
+
+        self._refresh_manifests(
+            written_days
+        )
+
+        if rejected_codes:
+
+            self._replace_reserved(
+                rejected_codes
+            )
+
+        for result in results:
+
+            if (
+                result["status"] == "success"
+                and result["barcode"]
+                in rejected_codes
+            ):
+
+                result["status"] = "duplicate"
+
+                result["timestamp"] = (
+                    rejected_codes[
+                        result["barcode"]
+                    ]
+                )
+
+
+        # -------------------------------------------------
+        # FINALIZE SAME-BATCH DUPLICATES
+        # -------------------------------------------------
+
+        for result in results:
+
+            if (
+                result["status"]
+                == "pending_duplicate"
+            ):
+
+                result[
+                    "status"
+                ] = "duplicate"
+
+
+        sync_error = self.writer.sync_error
+
+        if sync_error is not None:
+
+            for result in results:
+
+                if result["status"] == "success":
+
+                    result[
+                        "sync_error"
+                    ] = sync_error
+
+
+        return results
+
+
+    def submit_batch(self, barcodes, timestamps=None):
+        """
+        Classify scans and queue the accepted ones for the
+        writer thread.
+
+        Returns (results, acknowledgement). Accepted IDs are
+        reserved in memory at once, so the next scan sees
+        them as duplicates without waiting for the disk.
+        acknowledgement is a Future resolved once the rows
+        are stored, or None if nothing was accepted.
+        "success" and "pending_duplicate" statuses are
+        provisional until it resolves.
+
+        timestamps: see process_batch().
+
+        Scans that are not one valid barcode, or carry a
+        timestamp after today, are "invalid" and never
+        stored.
+        """
+
+        self.ensure_current_day()
+
+        if (
+            timestamps is not None
+            and len(timestamps) != len(barcodes)
+        ):
+
+            raise ValueError(
+                "timestamps must give one timestamp "
+                "per barcode."
+            )
+
+        today = (
+            datetime.date.today()
+            .isoformat()
+        )
+
+        # Positions of scans that are never stored.
+        invalid = {
+            position
+            for position, barcode in enumerate(barcodes)
+            if not is_storable_scan(
+                barcode,
+                (
+                    None
+                    if timestamps is None
+                    else timestamps[position]
+                ),
+                today,
+            )
+        }
+
+        valid_barcodes = [
+            barcode
+            for position, barcode in enumerate(barcodes)
+            if position not in invalid
+        ]
+
+        if not self.storage.indexed:
+
+            self._check_pending_days(
+                valid_barcodes
+            )
+
+        results = []
+
+        with self.lock:
+
+            # day -> rows to store in that day's file
+            rows_to_write = {}
+
+            new_records = []
+
+            # IDs first seen inside this same scan event.
+            batch_new_codes = {}
+
+            stored_codes = self._lookup_stored(
+                valid_barcodes
+            )
+
+
+            # -------------------------------------------------
+            # CLASSIFY
+            # -------------------------------------------------
+
+            for position, barcode in enumerate(barcodes):
+
+                # =============================================
+                # INVALID
+                # =============================================
+
+                if position in invalid:
+
+                    results.append(
+                        {
+                            "status": "invalid",
+                            "barcode": barcode,
+                        }
+                    )
+
+                    continue
+
+
+                # =============================================
+                # PREVIOUSLY STORED DUPLICATE
+                # =============================================
+
+                if barcode in stored_codes:
+
+                    results.append(
+                        {
+                            "status": "duplicate",
+                            "barcode": barcode,
+                            "timestamp": stored_codes[
+                                barcode
+                            ],
+                        }
+                    )
+
+                    continue
+
+
+                # =============================================
+                # DUPLICATE WITHIN SAME RAPID BATCH
+                # =============================================
+
+                if barcode in batch_new_codes:
+
+                    results.append(
+                        {
+                            "status": "pending_duplicate",
+                            "barcode": barcode,
+                            "timestamp": batch_new_codes[
+                                barcode
+                            ],
+                        }
+                    )
+
+                    continue
+
+
+                # =============================================
+                # SUCCESS
+                # =============================================
+
+                if timestamps is None:
+
+                    timestamp = (
+                        datetime.datetime.now()
+                        .isoformat()
+                    )
+
+                    day = today
+
+                else:
+
+                    timestamp = timestamps[position]
+
+                    day = scan_day(timestamp)
+
+                batch_new_codes[
+                    barcode
+                ] = timestamp
+
+                rows_to_write.setdefault(
+                    day,
+                    [],
+                ).append(
+                    [
+                        barcode,
+                        timestamp,
+                    ]
+                )
+
+                new_records.append(
+                    (
+                        day,
+                        barcode,
+                        timestamp,
+                    )
+                )
+
+                results.append(
+                    {
+                        "status": "success",
+                        "barcode": barcode,
+                        "timestamp": timestamp,
+                    }
+                )
+
+
+            # -------------------------------------------------
+            # QUEUE SUCCESSFUL IDS ONLY
+            # -------------------------------------------------
+
+            if not rows_to_write:
+                return results, None
+
+            if not self.storage.indexed:
+
+                cutoff = self._hot_cutoff()
+
+                for day, barcode, timestamp in new_records:
+
+                    self.codes[
+                        barcode
+                    ] = timestamp
+
+                    if (
+                        cutoff is not None
+                        and day < cutoff
+                    ):
+                        self.aged_days.add(day)
+
+                    if day != today:
+                        continue
+
+                    self.today_records.append(
+                        (
+                            barcode,
+                            timestamp,
+                        )
+                    )
+
+            acknowledgement = self.writer.submit_days(
+                rows_to_write
+            )
+
+
+        return results, acknowledgement
+
+
+    def _release_reserved(self, records):
+        """
+        Undo in-memory reservations for rows that were not
+        stored. A None timestamp matches any reservation.
+        """
+
+        if self.storage.indexed:
+            return
+
+        with self.lock:
+
+            released = set()
+
+            for barcode, timestamp in records:
+
+                reserved = self.codes.get(
+                    barcode
+                )
+
+                if reserved is None:
+                    continue
+
+                if (
+                    timestamp is not None
+                    and reserved != timestamp
+                ):
+                    continue
+
+                del self.codes[barcode]
+
+                released.add(
+                    (
+                        barcode,
+                        reserved,
+                    )
+                )
+
+            if released:
+
+                self.today_records = [
+                    record
+                    for record in self.today_records
+                    if record not in released
+                ]
+
+
+    def _replace_reserved(self, stored_codes):
+        """
+        Swap reservations for the records another process
+        stored first.
+        """
+
+        if self.storage.indexed:
+            return
+
+        with self.lock:
+
+            replaced = set()
+
+            for barcode, timestamp in (
+                stored_codes.items()
+            ):
+
+                reserved = self.codes.get(
+                    barcode
+                )
+
+                self.codes[
+                    barcode
+                ] = timestamp
+
+                replaced.add(
+                    (
+                        barcode,
+                        reserved,
+                    )
+                )
+
+            self.today_records = [
+                record
+                for record in self.today_records
+                if record not in replaced
+            ] + list(
+                stored_codes.items()
+            )
+
+
+    # =====================================================
+    # VOID
+    # =====================================================
+
+    def void_scan(self, barcode):
+        """
+        Void today's accepted scan of one barcode so it
+        can be scanned again.
+
+        A tombstone is appended to today's file and the
+        barcode leaves the in-memory index at once; no
+        file is rewritten and nothing is reloaded.
+        """
+
+        self.ensure_current_day()
+
+        barcodes = parse_scanner_input(
+            barcode
+        )
+
+        if len(barcodes) != 1:
+
+            return {
+                "status": "invalid",
+                "barcode": barcode,
+            }
+
+        barcode = barcodes[0]
+
+        if not self.storage.indexed:
+
+            self._check_pending_days(
+                barcodes
+            )
+
+        with self.lock:
+
+            today = self.current_day
+
+            timestamp = self._lookup_stored(
+                [barcode]
+            ).get(barcode)
+
+            if timestamp is None:
+
+                return {
+                    "status": "not_found",
+                    "barcode": barcode,
+                }
+
+            # Earlier days are closed.
+            if not timestamp.startswith(today):
+
+                return {
+                    "status": "not_today",
+                    "barcode": barcode,
+                    "timestamp": timestamp,
+                }
+
+            if not self.storage.indexed:
+
+                self._apply_void(
+                    today,
+                    barcode,
+                    timestamp,
+                )
+
+            # Queued behind the scan's own row, if that
+            # is not stored yet.
+            acknowledgement = self.writer.submit(
+                today,
+                [
+                    [
+                        scan_storage.tombstone_value(
+                            barcode
+                        ),
+                        timestamp,
+                    ]
+                ],
+            )
+
+        try:
+
+            acknowledgement.result()
+
+        except Exception as exc:
+
+            if not self.storage.indexed:
+
+                with self.lock:
+
+                    # Unless it was scanned again meanwhile.
+                    if barcode not in self.codes:
+
+                        self.codes[
+                            barcode
+                        ] = timestamp
+
+                        self.today_records.append(
+                            (
+                                barcode,
+                                timestamp,
+                            )
+                        )
+
+            return {
+                "status": "error",
+                "barcode": barcode,
+                "timestamp": timestamp,
+                "message": str(exc),
+            }
+
+        self._refresh_manifests(
+            [today]
+        )
+
+        result = {
+            "status": "voided",
+            "barcode": barcode,
+            "timestamp": timestamp,
+        }
+
+        sync_error = self.writer.sync_error
+
+        if sync_error is not None:
+            result["sync_error"] = sync_error
+
+        return result
+
+
+    def _apply_void(self, file_date, barcode, timestamp):
+        """
+        Drop a voided record from the index, unless the
+        barcode now belongs to a later scan.
+        """
+
+        if self.codes.get(barcode) != timestamp:
+            return
+
+        del self.codes[barcode]
+
+        if file_date != self.current_day:
+            return
+
+        try:
+
+            self.today_records.remove(
+                (
+                    barcode,
+                    timestamp,
+                )
+            )
+
+        except ValueError:
+            pass
+
+
+    # =====================================================
+    # COLD INDEX FILTER
+    # =====================================================
+
+    def get_filter_stats(self):
+        """
+        Bloom filter in front of the cold index (see
+        cold_index.py): its size and its expected and
+        observed false-positive rates, or None when no
+        history is kept on disk.
+        """
+
+        if self.storage.indexed or not HOT_DAYS:
+            return None
+
+        with self.lock:
+
+            return self.cold.filter_stats()
+
+
+    # =====================================================
+    # REFRESH
+    # =====================================================
+
+    def refresh(self):
+        """
+        Reconcile the live registry with the files on disk
+        instead of loading it again.
+
+        Every day file's high-water mark (size, mtime and
+        tail CRC) is compared with the file; only appended
+        bytes, new days and rewritten files are read, and
+        the cold index gets only the days it lacks.
+
+        Returns {"checked", "read", "seconds"}: the days
+        compared and the days read.
+        """
+
+        started = time.perf_counter()
+
+        report = {
+            "checked": 0,
+            "read": [],
+            "seconds": 0.0,
+        }
+
+        # An indexed store answers from the database; a
+        # warm-up still in progress reads every day anyway.
+        if (
+            self.storage.indexed
+            or not self.warm_up_done.is_set()
+        ):
+
+            report["seconds"] = (
+                time.perf_counter() - started
+            )
+
+            return report
+
+        self.ensure_current_day()
+
+        all_dates = self.storage.list_days()
+
+        self._update_cold_tier(
+            *self._stale_cold_days(
+                all_dates
+            )
+        )
+
+        with self.lock:
+
+            for file_date in self._hot_days(
+                all_dates
+            ):
+
+                report["checked"] += 1
+
+                mark = self.file_marks.get(
+                    file_date
+                )
+
+                offset = 0
+
+                if mark is not None:
+
+                    change = self.storage.check_mark(
+                        file_date,
+                        mark,
+                    )
+
+                    if change == "unchanged":
+                        continue
+
+                    if change == "appended":
+                        offset = mark["offset"]
+
+                report["read"].append(
+                    file_date
+                )
+
+                if file_date == self.current_day:
+
+                    self._refresh_today(
+                        offset
+                    )
+
+                else:
+
+                    # Like save_snapshot(): a rewritten
+                    # day is read again in full.
+                    self._load_day(
+                        file_date,
+                        offset,
+                    )
+
+        self._refresh_manifests(
+            None
+        )
+
+        report["seconds"] = (
+            time.perf_counter() - started
+        )
+
+        return report
+
+
+    def _refresh_today(self, offset):
+        """
+        Merge today's records after offset that this
+        registry has not seen yet.
+
+        Most of them were accepted here or merged from
+        other processes already, so they go through
+        _merge_rows() rather than the loader.
+        """
+
+        try:
+
+            rows, mark = scan_storage.read_scan_rows_from(
+                scan_storage.day_file(
+                    self.storage.data_dir,
+                    self.current_day,
+                ),
+                offset,
+            )
+
+        except (OSError, ValueError):
+            return
+
+        self._merge_rows(
+            self.current_day,
+            rows,
+        )
+
+        self.file_marks[
+            self.current_day
+        ] = mark
+
+
+    # =====================================================
+    # DIAGNOSTICS
+    # =====================================================
+
+    def get_diagnostics(self):
+        """
+        Memory and load-time figures for the admin panel,
+        as plain JSON-safe values.
+
+        Byte counts of Python containers are estimated from
+        a sample of DIAGNOSTICS_SAMPLE entries; strings
+        shared between codes and today_records are counted
+        in both.
+        """
+
+        counts_by_courier = None
+        codes_bytes = None
+
+        with self.lock:
+
+            if self.storage.indexed:
+
+                entries = None
+
+            elif isinstance(
+                self.codes,
+                barcode_index.CompactBarcodeIndex,
+            ):
+
+                entries = len(self.codes)
+
+                counts_by_courier = (
+                    self.codes.count_by_courier()
+                )
+
+                # Couriers without a packed table (see
+                # barcode_index.CODECS) are kept with the
+                # unknown formats.
+                if counts_by_courier.pop(
+                    "Unknown",
+                    0,
+                ):
+
+                    _count_couriers(
+                        self.codes.other,
+                        counts_by_courier,
+                    )
+
+                codes_bytes = (
+                    self.codes.memory_bytes()
+                    + _estimate_bytes(
+                        self.codes.other
+                    )
+                )
+
+            else:
+
+                entries = len(self.codes)
+
+                counts_by_courier = _count_couriers(
+                    self.codes,
+                    {},
+                )
+
+                codes_bytes = _estimate_bytes(
+                    self.codes
+                )
+
+            load_stats = dict(
+                self.load_stats,
+                files={
+                    file_date: dict(stats)
+                    for file_date, stats in (
+                        self.load_stats["files"].items()
+                    )
+                },
+            )
+
+            diagnostics = {
+                "storage": type(self.storage).__name__,
+                "index": (
+                    "sqlite"
+                    if self.storage.indexed
+                    else REGISTRY_INDEX
+                ),
+                "entries": entries,
+                "entries_by_courier": counts_by_courier,
+                "codes_bytes": codes_bytes,
+                "today_records": len(
+                    self.today_records
+                ),
+                "today_records_bytes": _estimate_bytes(
+                    self.today_records
+                ),
+                "hot_days": len(self.file_marks),
+                "pending_days": len(self.pending_days),
+                "load": load_stats,
+            }
+
+        last_write = self.writer.last_write
+
+        diagnostics["sync_error"] = (
+            self.writer.sync_error
+        )
+
+        diagnostics["seconds_since_last_write"] = (
+            None
+            if last_write is None
+            else time.time() - last_write
+        )
+
+        diagnostics["cold_filter"] = (
+            self.get_filter_stats()
+        )
+
+        return diagnostics
+
+
+    # =====================================================
+    # TODAY'S SUCCESSFUL RECORDS
+    # =====================================================
+
+    def get_today_records(self):
+
+        self.ensure_current_day()
+
+        if self.storage.indexed:
+
+            return self.storage.read_day(
+                self.current_day
+            )
+
+        self._merge_appended()
+
+        with self.lock:
+
+            return list(
+                self.today_records
+            )
+
+
+    # =====================================================
+    # TOTAL SUCCESSFUL SCANS
+    # =====================================================
+
+    def get_total_successful_scans(self):
+        """
+        Number of distinct barcodes stored across all
+        history, voided scans excluded, summed from the
+        day manifests' unique counts (the duplicate check
+        stores a barcode on one day only).
+
+        None until the manifests are loaded.
+        """
+
+        if self.storage.indexed:
+
+            return self.storage.count()
+
+        if not self.manifests_ready.is_set():
+            return None
+
+        # Picks up today's rows from other app processes.
+        self._refresh_manifests(
+            [self.current_day]
+        )
+
+        return self.manifests.total()
+
+
+# =========================================================
+# LIVE REGISTRIES
+# =========================================================
+
+# DATA_DIR -> the registry loaded in this process. Handed
+# out again, after a refresh(), when the app asks for a
+# new one (REGISTRY_CACHE_VERSION bumped, Streamlit cache
+# cleared), so that costs a file check, not a cold start.
+_live_registries = {}
+
+_live_registries_lock = threading.Lock()
+
+
+def live_registry(warm_up=False):
+    """
+    This process's registry for DATA_DIR, created on first
+    use and refreshed on every later call.
+    """
+
+    with _live_registries_lock:
+
+        registry = _live_registries.get(
+            DATA_DIR
+        )
+
+        if registry is None:
+
+            registry = BarcodeRegistry(
+                warm_up=warm_up
+            )
+
+            _live_registries[
+                DATA_DIR
+            ] = registry
+
+            return registry
+
+    registry.refresh()
+
+    return registry
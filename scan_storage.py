@@ -0,0 +1,2938 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import lzma
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from glob import glob
+
+try:
+
+    import fcntl
+
+except ImportError:
+
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+# =========================================================
+# STORAGE CONFIGURATION
+# =========================================================
+#
+# csv
+#     One text file per day: data/<date>.csv
+#     Reopened and appended for every accepted batch.
+#
+# journal
+#     One append-only binary record log per day:
+#     data/<date>.journal
+#     The file handle stays open for the whole day and
+#     data/<date>.csv is exported from the journal once
+#     the day is closed.
+#
+# sqlite
+#     One shared database: data/scans.sqlite3 (WAL mode)
+#     Duplicate checks, today's records and totals are
+#     indexed queries, so nothing is loaded at startup and
+#     several app processes can share the same store.
+
+STORAGE_BACKEND = os.environ.get(
+    "DISPATCHER_STORAGE_BACKEND",
+    "csv",
+)
+
+CSV_EXTENSION = ".csv"
+JOURNAL_EXTENSION = ".journal"
+
+# Closed days converted by archive_history.py.
+ARCHIVE_EXTENSION = ".archive"
+
+SQLITE_FILENAME = "scans.sqlite3"
+
+# Held by the file backends around every append, so app
+# processes sharing data/ never interleave writes.
+LOCK_FILENAME = ".scans.lock"
+
+# How CSV rows store the scan time:
+#     "iso"    barcode,ISO timestamp,checksum
+#              readable by staff opening the day file
+#     "epoch"  barcode,epoch_us,utc_offset,checksum
+#              integer microseconds since the epoch (UTC)
+#              and the local UTC offset in minutes; the
+#              history pages skip date parsing for them
+# Both are always readable; this only selects what new
+# rows are written as.
+ROW_TIMESTAMPS = "iso"
+
+# File header, written once when a journal is created.
+JOURNAL_MAGIC = b"DSJ3"
+
+# Version 2 journals, with text timestamps.
+JOURNAL_MAGIC_V2 = b"DSJ2"
+
+# Version 1 journals, without record checksums.
+JOURNAL_MAGIC_V1 = b"DSJ1"
+
+# Record header:
+#     barcode length   (1 byte)
+#     timestamp length (1 byte)
+#     CRC32 of the barcode and timestamp bytes (4 bytes)
+# followed by the UTF-8 barcode and the timestamp field.
+RECORD_HEADER = struct.Struct("<BBI")
+
+RECORD_HEADER_V1 = struct.Struct("<BB")
+
+# Version 3 timestamp field: a tag byte, then either the
+# epoch microseconds and UTC offset minutes (EPOCH_FIELD)
+# or, for a timestamp that is not ISO, its UTF-8 text.
+# Versions 1 and 2 store the text only.
+EPOCH_TAG = b"\x01"
+TEXT_TAG = b"\x00"
+
+EPOCH_FIELD = struct.Struct("<qh")
+
+
+# =========================================================
+# EPOCH TIMESTAMPS
+# =========================================================
+#
+# The app records local wall-clock ISO timestamps. They
+# are stored as UTC epoch microseconds plus the UTC offset
+# in effect, and turned back into the same ISO text when
+# read.
+#
+# Timestamps that carry their own offset (imported from
+# another station) keep it: the offset is stored plus
+# AWARE_OFFSET and read back as offset-qualified ISO text.
+# Offsets that are not whole minutes are stored as text.
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+EPOCH_UTC = EPOCH.replace(
+    tzinfo=datetime.timezone.utc
+)
+
+ONE_MICROSECOND = datetime.timedelta(
+    microseconds=1
+)
+
+ONE_MINUTE = datetime.timedelta(
+    minutes=1
+)
+
+# Real UTC offsets are under a day; stored offsets beyond
+# this mark a timestamp written with its own offset.
+MAX_OFFSET_MINUTES = 24 * 60 - 1
+
+AWARE_OFFSET = 4096
+
+# UTC offset at the end of ISO text; the pages drop it to
+# show every scan in the wall-clock time it was taken.
+ISO_OFFSET_SUFFIX = r"(?:[+-]\d\d:\d\d(?::\d\d(?:\.\d+)?)?|Z)$"
+
+
+def encode_epoch(timestamp):
+    """
+    ISO timestamp -> (epoch microseconds, UTC offset
+    minutes), or None for text that is not ISO.
+    """
+
+    try:
+
+        value = datetime.datetime.fromisoformat(
+            str(timestamp)
+        )
+
+        flag = AWARE_OFFSET
+
+        # Naive times are local.
+        if value.tzinfo is None:
+
+            value = value.astimezone()
+
+            flag = 0
+
+    except (ValueError, OverflowError, OSError):
+        return None
+
+    offset = value.utcoffset()
+
+    if offset % ONE_MINUTE:
+        return None
+
+    return (
+        (value - EPOCH_UTC) // ONE_MICROSECOND,
+        offset // ONE_MINUTE + flag,
+    )
+
+
+def decode_epoch(epoch_us, offset_minutes):
+    """
+    ISO timestamp for stored epoch fields: local wall
+    time, or offset-qualified for AWARE_OFFSET offsets.
+    """
+
+    if abs(offset_minutes) > MAX_OFFSET_MINUTES:
+
+        return (
+            EPOCH_UTC
+            + datetime.timedelta(
+                microseconds=epoch_us,
+            )
+        ).astimezone(
+            datetime.timezone(
+                datetime.timedelta(
+                    minutes=offset_minutes - AWARE_OFFSET,
+                )
+            )
+        ).isoformat()
+
+    return (
+        EPOCH
+        + datetime.timedelta(
+            microseconds=epoch_us,
+            minutes=offset_minutes,
+        )
+    ).isoformat()
+
+
+def normalize_timestamp(timestamp):
+    """
+    ISO timestamp as it reads back once stored, or None
+    for text that is not ISO. Storing the result again
+    gives the same text.
+    """
+
+    epoch = encode_epoch(timestamp)
+
+    if epoch is not None:
+        return decode_epoch(*epoch)
+
+    try:
+
+        datetime.datetime.fromisoformat(
+            str(timestamp)
+        )
+
+    except ValueError:
+        return None
+
+    # Stored as text (offset with seconds).
+    return str(timestamp)
+
+
+# =========================================================
+# RECORD CHECKSUMS
+# =========================================================
+#
+# CSV rows are written as
+#     barcode,timestamp,checksum
+# (or barcode,epoch_us,utc_offset,checksum, see
+# ROW_TIMESTAMPS)
+# where checksum is the CRC32 (8 hex digits) of the fields
+# before it joined with ",". Rows from older versions have
+# no checksum column and are accepted as they are.
+
+def row_checksum(fields):
+
+    return format(
+        zlib.crc32(
+            ",".join(fields).encode("utf-8")
+        ),
+        "08x",
+    )
+
+
+def checksummed_row(barcode, timestamp):
+
+    fields = [
+        str(barcode),
+        str(timestamp),
+    ]
+
+    return fields + [
+        row_checksum(fields)
+    ]
+
+
+def storage_row(barcode, timestamp):
+    """
+    CSV row for one scan in the ROW_TIMESTAMPS format.
+    """
+
+    epoch = (
+        encode_epoch(timestamp)
+        if ROW_TIMESTAMPS == "epoch"
+        else None
+    )
+
+    if epoch is None:
+
+        return checksummed_row(
+            barcode,
+            timestamp,
+        )
+
+    fields = [
+        str(barcode),
+        str(epoch[0]),
+        str(epoch[1]),
+    ]
+
+    return fields + [
+        row_checksum(fields)
+    ]
+
+
+def parse_csv_row(row):
+    """
+    Return (stored_value, timestamp) for a stored CSV row,
+    or None when it is incomplete or fails its checksum.
+    """
+
+    if len(row) < 2:
+        return None
+
+    if (
+        len(row) >= 3
+        and row[-1] != row_checksum(row[:-1])
+    ):
+        return None
+
+    if len(row) == 4:
+
+        try:
+
+            timestamp = decode_epoch(
+                int(row[1]),
+                int(row[2]),
+            )
+
+        except (ValueError, OverflowError):
+            return None
+
+    else:
+
+        timestamp = str(row[1]).strip()
+
+    return (
+        str(row[0]).strip(),
+        timestamp,
+    )
+
+
+# =========================================================
+# TOMBSTONES
+# =========================================================
+#
+# An accepted scan is voided by appending a tombstone
+# record rather than rewriting the day file:
+#     VOID:<barcode>, <timestamp of the voided scan>
+# It cancels exactly that (barcode, timestamp) record, so
+# it is harmless if read twice and never cancels a later
+# re-scan of the same barcode. Tombstones are not valid
+# scanner input and never count as scans.
+
+VOID_PREFIX = "VOID:"
+
+
+def tombstone_value(barcode):
+
+    return f"{VOID_PREFIX}{barcode}"
+
+
+def voided_barcode(stored_value):
+    """
+    Barcode a tombstone voids, or None for other values.
+    """
+
+    if not stored_value.startswith(VOID_PREFIX):
+        return None
+
+    return stored_value[len(VOID_PREFIX):]
+
+
+def apply_tombstones(rows):
+    """
+    Drop the tombstones from [(stored_value, timestamp),
+    ...] and the records they void.
+
+    Returns (rows, voids); voids are the (barcode,
+    timestamp) tombstones with no record among these rows,
+    i.e. voiding something read earlier.
+    """
+
+    voids = set()
+
+    for stored_value, timestamp in rows:
+
+        barcode = voided_barcode(stored_value)
+
+        if barcode is not None:
+
+            voids.add(
+                (
+                    barcode,
+                    timestamp,
+                )
+            )
+
+    if not voids:
+        return rows, voids
+
+    kept = []
+    matched = set()
+
+    for stored_value, timestamp in rows:
+
+        if stored_value.startswith(VOID_PREFIX):
+            continue
+
+        if (
+            stored_value,
+            timestamp,
+        ) in voids:
+
+            matched.add(
+                (
+                    stored_value,
+                    timestamp,
+                )
+            )
+
+            continue
+
+        kept.append(
+            (
+                stored_value,
+                timestamp,
+            )
+        )
+
+    return kept, voids - matched
+
+
+# =========================================================
+# JOURNAL RECORD ENCODING
+# =========================================================
+
+def encode_journal_record(barcode, timestamp):
+    """
+    Encode one accepted scan as a length-prefixed,
+    checksummed record.
+    """
+
+    barcode_bytes = str(barcode).encode("utf-8")
+
+    epoch = encode_epoch(timestamp)
+
+    if epoch is None:
+
+        timestamp_bytes = TEXT_TAG + str(
+            timestamp
+        ).encode("utf-8")
+
+    else:
+
+        timestamp_bytes = EPOCH_TAG + EPOCH_FIELD.pack(
+            *epoch
+        )
+
+    return (
+        RECORD_HEADER.pack(
+            len(barcode_bytes),
+            len(timestamp_bytes),
+            zlib.crc32(
+                barcode_bytes + timestamp_bytes
+            ),
+        )
+        + barcode_bytes
+        + timestamp_bytes
+    )
+
+
+def decode_journal_records(
+    data,
+    position=0,
+    magic=JOURNAL_MAGIC,
+):
+    """
+    Decode journal bytes starting at a record boundary.
+
+    Returns (rows, end) where end is the offset just past
+    the last valid record. Decoding stops at a torn or
+    corrupt record, for example after a power loss during
+    an append: with length prefixes nothing after it can
+    be located reliably.
+    """
+
+    header = (
+        RECORD_HEADER_V1
+        if magic == JOURNAL_MAGIC_V1
+        else RECORD_HEADER
+    )
+
+    tagged = magic == JOURNAL_MAGIC
+
+    rows = []
+    data_length = len(data)
+    header_size = header.size
+
+    while position + header_size <= data_length:
+
+        fields = header.unpack_from(
+            data,
+            position,
+        )
+
+        barcode_length, timestamp_length = fields[:2]
+
+        barcode_start = position + header_size
+        timestamp_start = barcode_start + barcode_length
+
+        record_end = (
+            timestamp_start
+            + timestamp_length
+        )
+
+        if record_end > data_length:
+            break
+
+        payload = data[
+            barcode_start:record_end
+        ]
+
+        if (
+            len(fields) == 3
+            and zlib.crc32(payload) != fields[2]
+        ):
+            break
+
+        timestamp_bytes = payload[
+            barcode_length:
+        ]
+
+        try:
+
+            if not tagged:
+                timestamp = timestamp_bytes.decode("utf-8")
+
+            elif timestamp_bytes[:1] == EPOCH_TAG:
+
+                timestamp = decode_epoch(
+                    *EPOCH_FIELD.unpack(
+                        timestamp_bytes[1:]
+                    )
+                )
+
+            else:
+                timestamp = timestamp_bytes[1:].decode("utf-8")
+
+            rows.append(
+                (
+                    payload[
+                        :barcode_length
+                    ].decode("utf-8"),
+                    timestamp,
+                )
+            )
+
+        except (
+            UnicodeDecodeError,
+            struct.error,
+            OverflowError,
+        ):
+            break
+
+        position = record_end
+
+    return rows, position
+
+
+def journal_magic(data):
+    """
+    Journal format of a file starting with data, or None.
+    """
+
+    for magic in (
+        JOURNAL_MAGIC,
+        JOURNAL_MAGIC_V2,
+        JOURNAL_MAGIC_V1,
+    ):
+
+        if data.startswith(magic):
+            return magic
+
+    return None
+
+
+def read_journal(journal_path):
+    """
+    Return [(barcode, timestamp), ...] stored in a journal.
+    """
+
+    with open(
+        journal_path,
+        "rb",
+    ) as file:
+
+        data = file.read()
+
+    magic = journal_magic(data)
+
+    if magic is None:
+        return []
+
+    rows, _ = decode_journal_records(
+        data,
+        len(magic),
+        magic,
+    )
+
+    return rows
+
+
+def read_csv_rows(csv_path):
+    """
+    Return [(stored_value, timestamp), ...] from a daily CSV.
+
+    Values are returned as stored; callers validate them.
+    Rows failing their checksum are skipped.
+    """
+
+    rows = []
+
+    with open(
+        csv_path,
+        "r",
+        newline="",
+        encoding="utf-8",
+        errors="replace",
+    ) as file:
+
+        for row in csv.reader(file):
+
+            parsed = parse_csv_row(row)
+
+            if parsed is not None:
+                rows.append(parsed)
+
+    return rows
+
+
+def read_scan_rows(file_path):
+    """
+    Read one daily scan file, CSV, journal or archive.
+    """
+
+    if file_path.endswith(
+        JOURNAL_EXTENSION
+    ):
+        return read_journal(file_path)
+
+    if file_path.endswith(
+        ARCHIVE_EXTENSION
+    ):
+        return read_archive(file_path)
+
+    return read_csv_rows(file_path)
+
+
+# =========================================================
+# INCREMENTAL READS
+# =========================================================
+#
+# A high-water mark records how far a daily file has been
+# read:
+#
+#     path      file that was read
+#     offset    end of the last complete record
+#     mtime     modification time when it was read
+#     tail_crc  CRC32 of the bytes just before offset
+#
+# The tail checksum lets a reader tell an appended file
+# (safe to resume at offset) from a rewritten one.
+
+MARK_TAIL_BYTES = 64
+
+
+def _tail_crc(file, offset):
+
+    start = max(
+        offset - MARK_TAIL_BYTES,
+        0,
+    )
+
+    file.seek(start)
+
+    return zlib.crc32(
+        file.read(offset - start)
+    )
+
+
+def _decode_csv_rows(text):
+
+    rows = []
+
+    for row in csv.reader(
+        io.StringIO(text)
+    ):
+
+        parsed = parse_csv_row(row)
+
+        if parsed is not None:
+            rows.append(parsed)
+
+    return rows
+
+
+def read_scan_rows_from(file_path, offset=0, until=None):
+    """
+    Read the complete records stored after offset (and
+    before until, if given).
+
+    Returns (rows, mark). A partial last line or record is
+    left for the next read.
+    """
+
+    with open(
+        file_path,
+        "rb",
+    ) as file:
+
+        stat = os.fstat(
+            file.fileno()
+        )
+
+        mtime = stat.st_mtime
+
+        if file_path.endswith(
+            ARCHIVE_EXTENSION
+        ):
+
+            # Written once, read whole.
+            rows = (
+                read_archive(file_path)
+                if offset < stat.st_size
+                else []
+            )
+
+            end = max(
+                stat.st_size - offset,
+                0,
+            )
+
+        elif file_path.endswith(
+            JOURNAL_EXTENSION
+        ):
+
+            magic = journal_magic(
+                file.read(len(JOURNAL_MAGIC))
+            )
+
+            file.seek(offset)
+
+            data = file.read(
+                -1 if until is None
+                else until - offset
+            )
+
+            start = 0
+
+            if magic is None:
+                data = b""
+
+            elif offset == 0:
+                start = len(magic)
+
+            rows, end = decode_journal_records(
+                data,
+                start,
+                magic,
+            )
+
+        else:
+
+            # An unterminated last line is still returned,
+            # as the full reader does, but the mark stays
+            # before it so it is read again once complete.
+            file.seek(offset)
+
+            data = file.read(
+                -1 if until is None
+                else until - offset
+            )
+
+            end = data.rfind(b"\n") + 1
+
+            rows = _decode_csv_rows(
+                data.decode(
+                    "utf-8",
+                    errors="replace",
+                )
+            )
+
+        new_offset = offset + end
+
+        mark = {
+            "path": file_path,
+            "offset": new_offset,
+            "mtime": mtime,
+            "tail_crc": _tail_crc(
+                file,
+                new_offset,
+            ),
+        }
+
+    return rows, mark
+
+
+def check_mark(mark, file_path):
+    """
+    Compare a high-water mark with the file on disk.
+
+    Returns:
+        "unchanged"  nothing new after the mark
+        "appended"   new records after the mark
+        "rewritten"  the marked bytes changed
+    """
+
+    if mark.get("path") != file_path:
+        return "rewritten"
+
+    try:
+
+        stat = os.stat(file_path)
+
+    except OSError:
+        return "rewritten"
+
+    offset = mark["offset"]
+
+    if stat.st_size < offset:
+        return "rewritten"
+
+    if (
+        stat.st_size == offset
+        and stat.st_mtime == mark["mtime"]
+    ):
+        return "unchanged"
+
+    with open(
+        file_path,
+        "rb",
+    ) as file:
+
+        if _tail_crc(
+            file,
+            offset,
+        ) != mark["tail_crc"]:
+            return "rewritten"
+
+    if stat.st_size == offset:
+        return "unchanged"
+
+    return "appended"
+
+
+def end_mark(file_path):
+    """
+    High-water mark at the current end of a file, or None
+    for an empty file.
+    """
+
+    size = os.path.getsize(file_path)
+
+    if size == 0:
+        return None
+
+    _, mark = read_scan_rows_from(
+        file_path,
+        size,
+    )
+
+    return mark
+
+
+# =========================================================
+# CLEAN FILE MARKERS
+# =========================================================
+#
+# compact_history.py rewrites past day files with exactly
+# one normalized barcode per record and leaves a sidecar
+#     data/<date>.csv.clean  (or .journal.clean)
+# holding the format version and the high-water mark of the
+# rewritten file. Records before that mark are loaded
+# without re-parsing. The marker is ignored once the file
+# has been rewritten by anything else.
+
+CLEAN_FORMAT_VERSION = 1
+
+CLEAN_MARKER_SUFFIX = ".clean"
+
+
+def clean_marker_path(file_path):
+
+    return f"{file_path}{CLEAN_MARKER_SUFFIX}"
+
+
+def read_clean_mark(file_path):
+    """
+    Return the clean high-water mark of a day file, or
+    None if it was never compacted or changed since.
+    """
+
+    try:
+
+        with open(
+            clean_marker_path(file_path),
+            "r",
+            encoding="utf-8",
+        ) as file:
+
+            marker = json.load(file)
+
+    except (OSError, ValueError):
+        return None
+
+    if marker.get(
+        "format_version"
+    ) != CLEAN_FORMAT_VERSION:
+        return None
+
+    mark = marker.get("mark")
+
+    if (
+        not mark
+        or check_mark(
+            mark,
+            file_path,
+        ) == "rewritten"
+    ):
+        return None
+
+    return mark
+
+
+def write_clean_mark(file_path):
+    """
+    Mark everything currently in a day file as clean.
+    """
+
+    marker_path = clean_marker_path(file_path)
+
+    temp_path = f"{marker_path}.tmp"
+
+    with open(
+        temp_path,
+        "w",
+        encoding="utf-8",
+    ) as file:
+
+        json.dump(
+            {
+                "format_version": CLEAN_FORMAT_VERSION,
+                "mark": end_mark(file_path),
+            },
+            file,
+        )
+
+    os.replace(
+        temp_path,
+        marker_path,
+    )
+
+
+# =========================================================
+# DAY ARCHIVES
+# =========================================================
+#
+# archive_history.py replaces the files of long-closed days
+# with one compressed archive each,
+#     data/<date>.archive
+#
+# Layout:
+#     magic, 4-byte JSON header length, JSON header,
+#     compressed blocks
+#
+# Records are sorted by barcode length, then barcode, and
+# cut into blocks of ARCHIVE_BLOCK_ROWS, each compressed on
+# its own (gzip or lzma) and holding journal records (see
+# JOURNAL RECORD ENCODING). The header indexes every block
+# by byte range, barcode range and time range, so a reader
+# looking for one barcode or a time window decompresses
+# only the blocks that can hold it.
+
+ARCHIVE_MAGIC = b"DSA1"
+
+ARCHIVE_VERSION = 1
+
+ARCHIVE_HEADER_LENGTH = struct.Struct("<I")
+
+ARCHIVE_BLOCK_ROWS = 256
+
+ARCHIVE_COMPRESSION = "gzip"
+
+ARCHIVE_CODECS = {
+    "gzip": (
+        gzip.compress,
+        gzip.decompress,
+    ),
+    "lzma": (
+        lzma.compress,
+        lzma.decompress,
+    ),
+}
+
+
+def write_archive(
+    archive_path,
+    rows,
+    compression=ARCHIVE_COMPRESSION,
+):
+    """
+    Atomically write [(barcode, timestamp), ...] as an
+    archive.
+    """
+
+    compress = ARCHIVE_CODECS[compression][0]
+
+    # One courier format per block, mostly, keeps the
+    # barcode ranges narrow.
+    rows = sorted(
+        rows,
+        key=lambda row: (
+            len(row[0]),
+            row,
+        ),
+    )
+
+    blocks = []
+    payloads = []
+
+    offset = 0
+
+    for start in range(
+        0,
+        len(rows),
+        ARCHIVE_BLOCK_ROWS,
+    ):
+
+        block_rows = rows[
+            start:start + ARCHIVE_BLOCK_ROWS
+        ]
+
+        payload = compress(
+            b"".join(
+                encode_journal_record(
+                    barcode,
+                    timestamp,
+                )
+                for barcode, timestamp in block_rows
+            )
+        )
+
+        barcodes = [
+            barcode
+            for barcode, _ in block_rows
+        ]
+
+        timestamps = [
+            timestamp
+            for _, timestamp in block_rows
+        ]
+
+        blocks.append(
+            {
+                "offset": offset,
+                "length": len(payload),
+                "rows": len(block_rows),
+                "min": min(barcodes),
+                "max": max(barcodes),
+                "max_length": len(block_rows[-1][0]),
+                "first": min(timestamps),
+                "last": max(timestamps),
+            }
+        )
+
+        payloads.append(payload)
+
+        offset += len(payload)
+
+    header = json.dumps(
+        {
+            "version": ARCHIVE_VERSION,
+            "compression": compression,
+            "rows": len(rows),
+            "blocks": blocks,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    temp_path = f"{archive_path}.{os.getpid()}.tmp"
+
+    with open(
+        temp_path,
+        "wb",
+    ) as file:
+
+        file.write(ARCHIVE_MAGIC)
+
+        file.write(
+            ARCHIVE_HEADER_LENGTH.pack(
+                len(header)
+            )
+        )
+
+        file.write(header)
+
+        for payload in payloads:
+            file.write(payload)
+
+        file.flush()
+
+        os.fsync(
+            file.fileno()
+        )
+
+    os.replace(
+        temp_path,
+        archive_path,
+    )
+
+
+def _read_archive_header(file):
+    """
+    Return (header, offset of the first block).
+    """
+
+    prefix = file.read(
+        len(ARCHIVE_MAGIC)
+        + ARCHIVE_HEADER_LENGTH.size
+    )
+
+    if (
+        len(prefix)
+        < len(ARCHIVE_MAGIC) + ARCHIVE_HEADER_LENGTH.size
+        or not prefix.startswith(ARCHIVE_MAGIC)
+    ):
+        raise ValueError("not a scan archive")
+
+    (header_length,) = ARCHIVE_HEADER_LENGTH.unpack(
+        prefix[len(ARCHIVE_MAGIC):]
+    )
+
+    header = json.loads(
+        file.read(header_length)
+    )
+
+    if header.get("version") != ARCHIVE_VERSION:
+        raise ValueError("unsupported scan archive")
+
+    return header, len(prefix) + header_length
+
+
+def read_archive_index(archive_path):
+    """
+    Header of an archive: compression, row count and the
+    block index.
+    """
+
+    with open(
+        archive_path,
+        "rb",
+    ) as file:
+
+        header, _ = _read_archive_header(file)
+
+    return header
+
+
+def _block_may_match(block, barcode, start, end):
+
+    # A value at least as long as every barcode in the
+    # block can only be contained in one by being equal.
+    if (
+        barcode is not None
+        and len(barcode) >= block["max_length"]
+        and not block["min"] <= barcode <= block["max"]
+    ):
+        return False
+
+    if (
+        start is not None
+        and block["last"] < start
+    ):
+        return False
+
+    if (
+        end is not None
+        and block["first"] > end
+    ):
+        return False
+
+    return True
+
+
+def read_archive(
+    archive_path,
+    barcode=None,
+    start=None,
+    end=None,
+):
+    """
+    Return the rows of an archive in time order.
+
+    With barcode (matched as a substring, as the history
+    search does) or a start/end time, only the blocks that
+    may hold matching rows are decompressed; callers still
+    filter the rows returned.
+    """
+
+    rows = []
+
+    with open(
+        archive_path,
+        "rb",
+    ) as file:
+
+        header, data_offset = _read_archive_header(
+            file
+        )
+
+        decompress = ARCHIVE_CODECS[
+            header["compression"]
+        ][1]
+
+        for block in header["blocks"]:
+
+            if not _block_may_match(
+                block,
+                barcode,
+                start,
+                end,
+            ):
+                continue
+
+            file.seek(
+                data_offset + block["offset"]
+            )
+
+            try:
+
+                data = decompress(
+                    file.read(block["length"])
+                )
+
+            except (
+                EOFError,
+                OSError,
+                lzma.LZMAError,
+                zlib.error,
+            ) as exc:
+
+                raise ValueError(
+                    f"corrupt archive block: {exc}"
+                ) from exc
+
+            block_rows, _ = decode_journal_records(
+                data
+            )
+
+            if len(block_rows) != block["rows"]:
+                raise ValueError("corrupt archive block")
+
+            rows.extend(block_rows)
+
+    rows.sort(
+        key=lambda row: row[1]
+    )
+
+    return rows
+
+
+def archive_may_contain(archive_path, barcodes):
+    """
+    True if a block of the archive may hold one of these
+    whole barcodes; read from the index alone.
+    """
+
+    blocks = read_archive_index(
+        archive_path
+    )["blocks"]
+
+    return any(
+        block["min"] <= barcode <= block["max"]
+        for barcode in barcodes
+        for block in blocks
+    )
+
+
+# =========================================================
+# CRASH RECOVERY
+# =========================================================
+#
+# A power loss during an append can leave a daily file
+# ending in a partial row or record (or in zero bytes).
+# recover_day_file() truncates only that torn tail and
+# keeps every complete record. The discarded bytes are
+# saved under data/recovered/ and reported.
+
+RECOVERY_DIRNAME = "recovered"
+
+# CSV tails are inspected in this window: a torn write
+# is at most one batch of rows.
+CSV_RECOVERY_WINDOW = 16 * 1024
+
+
+def _parse_csv_line(line):
+    """
+    Return the fields of one raw CSV line, or None when it
+    is not a single intact, checksum-valid row.
+    """
+
+    if b"\x00" in line:
+        return None
+
+    try:
+
+        text = line.decode("utf-8")
+
+    except UnicodeDecodeError:
+        return None
+
+    rows = list(
+        csv.reader(
+            io.StringIO(text)
+        )
+    )
+
+    if (
+        len(rows) != 1
+        or parse_csv_row(rows[0]) is None
+    ):
+        return None
+
+    return rows[0]
+
+
+def _valid_csv_end(file_path):
+    """
+    Return (offset, unterminated) for the end of the last
+    intact row, walking back over trailing lines that are
+    torn or fail their checksum.
+
+    A last line without its line break is only kept when it
+    carries a valid checksum; unterminated is then True.
+    """
+
+    size = os.path.getsize(file_path)
+
+    window_start = max(
+        size - CSV_RECOVERY_WINDOW,
+        0,
+    )
+
+    with open(
+        file_path,
+        "rb",
+    ) as file:
+
+        file.seek(window_start)
+
+        data = file.read()
+
+    cut = len(data)
+
+    while cut > 0:
+
+        terminated = data[cut - 1:cut] == b"\n"
+
+        line_start = data.rfind(
+            b"\n",
+            0,
+            cut - 1,
+        ) + 1
+
+        line = data[line_start:cut]
+
+        if not line.strip():
+            break
+
+        fields = _parse_csv_line(line)
+
+        if fields is not None and (
+            terminated
+            or len(fields) >= 3
+        ):
+            return (
+                window_start + cut,
+                not terminated,
+            )
+
+        cut = line_start
+
+    return window_start + cut, False
+
+
+def _valid_journal_end(file_path):
+
+    with open(
+        file_path,
+        "rb",
+    ) as file:
+
+        data = file.read()
+
+    magic = journal_magic(data)
+
+    if magic is None:
+        return 0
+
+    _, end = decode_journal_records(
+        data,
+        len(magic),
+        magic,
+    )
+
+    return end
+
+
+def recover_day_file(file_path):
+    """
+    Truncate a torn tail from one daily file.
+
+    Returns a report dict, or None if the file was intact.
+    """
+
+    # Written atomically; nothing can be torn.
+    if file_path.endswith(
+        ARCHIVE_EXTENSION
+    ):
+        return None
+
+    size = os.path.getsize(file_path)
+
+    unterminated = False
+
+    if file_path.endswith(
+        JOURNAL_EXTENSION
+    ):
+        valid_end = _valid_journal_end(file_path)
+
+    else:
+        valid_end, unterminated = _valid_csv_end(
+            file_path
+        )
+
+    if unterminated and valid_end >= size:
+
+        # Intact last row that lost only its line break:
+        # restore it so the next append starts a new row.
+        with open(
+            file_path,
+            "ab",
+        ) as file:
+
+            file.write(b"\r\n")
+
+        return None
+
+    if valid_end >= size:
+        return None
+
+    with open(
+        file_path,
+        "r+b",
+    ) as file:
+
+        file.seek(valid_end)
+
+        discarded = file.read()
+
+        file.truncate(valid_end)
+
+    recovered_dir = os.path.join(
+        os.path.dirname(file_path),
+        RECOVERY_DIRNAME,
+    )
+
+    os.makedirs(
+        recovered_dir,
+        exist_ok=True,
+    )
+
+    saved_path = os.path.join(
+        recovered_dir,
+        (
+            f"{os.path.basename(file_path)}."
+            f"{datetime.datetime.now():%Y%m%d%H%M%S}"
+            ".tail"
+        ),
+    )
+
+    with open(
+        saved_path,
+        "wb",
+    ) as file:
+
+        file.write(discarded)
+
+    return {
+        "file": file_path,
+        "kept_bytes": valid_end,
+        "discarded_bytes": len(discarded),
+        "discarded_preview": discarded[:80].decode(
+            "utf-8",
+            errors="replace",
+        ),
+        "saved_to": saved_path,
+    }
+
+
+# =========================================================
+# DAY FILE LOOKUP
+# =========================================================
+
+def list_day_files(data_dir):
+    """
+    Map every stored day to the file that holds its scans.
+
+    A journal is the source of truth for its day, so it is
+    preferred over a CSV export of the same day. An archive
+    is used only when neither is left.
+    """
+
+    day_files = {}
+
+    for extension in (
+        ARCHIVE_EXTENSION,
+        CSV_EXTENSION,
+        JOURNAL_EXTENSION,
+    ):
+
+        for file_path in glob(
+            os.path.join(
+                data_dir,
+                f"*{extension}",
+            )
+        ):
+
+            day = os.path.splitext(
+                os.path.basename(file_path)
+            )[0]
+
+            day_files[day] = file_path
+
+    return dict(
+        sorted(
+            day_files.items()
+        )
+    )
+
+
+def day_file(data_dir, day):
+    """
+    Path of the file holding one day's scans.
+
+    Returns the CSV path when nothing has been stored yet.
+    """
+
+    journal_path = os.path.join(
+        data_dir,
+        f"{day}{JOURNAL_EXTENSION}",
+    )
+
+    if os.path.exists(
+        journal_path
+    ):
+        return journal_path
+
+    csv_path = os.path.join(
+        data_dir,
+        f"{day}{CSV_EXTENSION}",
+    )
+
+    archive_path = os.path.join(
+        data_dir,
+        f"{day}{ARCHIVE_EXTENSION}",
+    )
+
+    if (
+        not os.path.exists(csv_path)
+        and os.path.exists(archive_path)
+    ):
+        return archive_path
+
+    return csv_path
+
+
+def reopen_archive(data_dir, day):
+    """
+    Turn an archived day back into a CSV before anything
+    is appended to it.
+
+    day_file() prefers a CSV to the archive, so a CSV
+    started next to one would hide the archived rows. The
+    caller holds DataDirLock.
+
+    Returns True if the day was archived.
+    """
+
+    archive_path = os.path.join(
+        data_dir,
+        f"{day}{ARCHIVE_EXTENSION}",
+    )
+
+    if day_file(
+        data_dir,
+        day,
+    ) != archive_path:
+        return False
+
+    csv_path = os.path.join(
+        data_dir,
+        f"{day}{CSV_EXTENSION}",
+    )
+
+    temp_path = f"{csv_path}.{os.getpid()}.tmp"
+
+    with open(
+        temp_path,
+        "w",
+        newline="",
+        encoding="utf-8",
+    ) as csvfile:
+
+        csv.writer(
+            csvfile
+        ).writerows(
+            storage_row(
+                barcode,
+                timestamp,
+            )
+            for barcode, timestamp
+            in read_archive(archive_path)
+        )
+
+        csvfile.flush()
+
+        os.fsync(
+            csvfile.fileno()
+        )
+
+    os.replace(
+        temp_path,
+        csv_path,
+    )
+
+    # The CSV holds every row now; the archive and its
+    # sidecars (clean marker, manifest) go with it.
+    for file_path in [
+        archive_path,
+        *glob(f"{archive_path}.*"),
+    ]:
+
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    return True
+
+
+# =========================================================
+# INTER-PROCESS LOCK
+# =========================================================
+
+class DataDirLock:
+    """
+    Exclusive lock on data/.scans.lock shared by every app
+    process using the same data directory.
+
+    Reentrant within a process; threads of one process are
+    serialized by an RLock before the file lock is taken.
+    """
+
+    def __init__(self, data_dir):
+
+        self.path = os.path.join(
+            data_dir,
+            LOCK_FILENAME,
+        )
+
+        self.thread_lock = threading.RLock()
+
+        self.depth = 0
+        self.file = None
+
+
+    def acquire(self):
+
+        self.thread_lock.acquire()
+
+        if self.depth == 0:
+
+            try:
+
+                self.file = open(
+                    self.path,
+                    "a+b",
+                )
+
+                self._lock_file()
+
+            except Exception:
+
+                if self.file is not None:
+
+                    self.file.close()
+                    self.file = None
+
+                self.thread_lock.release()
+                raise
+
+        self.depth += 1
+
+
+    def release(self):
+
+        self.depth -= 1
+
+        if self.depth == 0:
+
+            try:
+
+                self._unlock_file()
+
+            finally:
+
+                self.file.close()
+                self.file = None
+
+        self.thread_lock.release()
+
+
+    def _lock_file(self):
+
+        if fcntl is not None:
+
+            fcntl.flock(
+                self.file.fileno(),
+                fcntl.LOCK_EX,
+            )
+
+            return
+
+        self.file.seek(0)
+
+        while True:
+
+            try:
+
+                # LK_LOCK gives up after about ten
+                # seconds; keep waiting.
+                msvcrt.locking(
+                    self.file.fileno(),
+                    msvcrt.LK_LOCK,
+                    1,
+                )
+
+                return
+
+            except OSError:
+                continue
+
+
+    def _unlock_file(self):
+
+        if fcntl is not None:
+
+            fcntl.flock(
+                self.file.fileno(),
+                fcntl.LOCK_UN,
+            )
+
+            return
+
+        self.file.seek(0)
+
+        msvcrt.locking(
+            self.file.fileno(),
+            msvcrt.LK_UNLCK,
+            1,
+        )
+
+
+    def __enter__(self):
+
+        self.acquire()
+
+        return self
+
+
+    def __exit__(self, *exc_info):
+
+        self.release()
+
+
+# =========================================================
+# CSV STORAGE
+# =========================================================
+
+class CsvStorage:
+    """
+    Original storage: one CSV per day, opened per batch.
+
+    File backends are not indexed: the registry keeps its
+    own in-memory duplicate index loaded from read_day().
+
+    Several app processes may share one data directory.
+    Appends hold DataDirLock, and each process tails the
+    records the others append (poll_appended()). append()
+    rejects rows another process already stored, so the
+    registry's in-memory check stays correct across
+    processes without reloading.
+    """
+
+    name = "csv"
+
+    indexed = False
+
+    def __init__(self, data_dir):
+
+        self.data_dir = data_dir
+
+        # Days appended since the last sync().
+        self.unsynced_days = set()
+
+        os.makedirs(
+            data_dir,
+            exist_ok=True,
+        )
+
+        self.file_lock = DataDirLock(data_dir)
+
+        self.tail_lock = threading.RLock()
+
+        # day -> (file path, offset) read so far by
+        # tailing or written by this process.
+        self.tail_offsets = {}
+
+        # day -> {stored value: timestamp} of tailed rows.
+        self.tailed = {}
+
+        # (day, stored value, timestamp) tailed since the
+        # last poll_appended().
+        self.unpolled = []
+
+        # Records already in today's file are loaded by the
+        # registry; tail only what is appended from now on.
+        self._reset_tail(
+            datetime.date.today().isoformat()
+        )
+
+
+    def list_days(self):
+
+        return list(
+            list_day_files(
+                self.data_dir
+            )
+        )
+
+
+    def has_day(self, day):
+
+        return os.path.exists(
+            day_file(
+                self.data_dir,
+                day,
+            )
+        )
+
+
+    def day_version(self, day):
+        """
+        Changes whenever the day's stored scans change.
+        """
+
+        file_path = day_file(
+            self.data_dir,
+            day,
+        )
+
+        try:
+
+            stat = os.stat(file_path)
+
+        except OSError:
+            return None
+
+        return (
+            file_path,
+            stat.st_size,
+            stat.st_mtime,
+        )
+
+
+    def read_day(self, day):
+
+        file_path = day_file(
+            self.data_dir,
+            day,
+        )
+
+        if not os.path.exists(
+            file_path
+        ):
+            return []
+
+        return read_scan_rows(
+            file_path
+        )
+
+
+    def recover(self, days=None):
+        """
+        Run recover_day_file() on the given days' files
+        (default: every day).
+
+        Returns the list of reports for files that had a
+        torn tail.
+        """
+
+        if days is None:
+            days = self.list_days()
+
+        reports = []
+
+        # Another process may be mid-append; only a tail
+        # still torn while holding the lock is a crash.
+        with self.file_lock:
+
+            for day in days:
+
+                file_path = day_file(
+                    self.data_dir,
+                    day,
+                )
+
+                try:
+
+                    report = recover_day_file(
+                        file_path
+                    )
+
+                except OSError:
+                    continue
+
+                if report is not None:
+
+                    reports.append(report)
+
+                    self._reset_tail(day)
+
+        return reports
+
+
+    def read_day_from(self, day, offset=0):
+        """
+        Incremental read, see read_scan_rows_from().
+        """
+
+        return read_scan_rows_from(
+            day_file(
+                self.data_dir,
+                day,
+            ),
+            offset,
+        )
+
+
+    def check_mark(self, day, mark):
+
+        return check_mark(
+            mark,
+            day_file(
+                self.data_dir,
+                day,
+            ),
+        )
+
+
+    # =====================================================
+    # CROSS-PROCESS TAILING
+    # =====================================================
+
+    def _reset_tail(self, day):
+
+        file_path = day_file(
+            self.data_dir,
+            day,
+        )
+
+        with self.tail_lock:
+
+            try:
+
+                self.tail_offsets[day] = (
+                    file_path,
+                    os.path.getsize(file_path),
+                )
+
+            except OSError:
+
+                self.tail_offsets.pop(
+                    day,
+                    None,
+                )
+
+
+    def _tail(self, day):
+        """
+        Read the day's rows appended since the last tail.
+
+        A new file, or the switch from a CSV to the journal
+        seeded from it, is read from the start.
+        """
+
+        file_path = day_file(
+            self.data_dir,
+            day,
+        )
+
+        if not os.path.exists(
+            file_path
+        ):
+            return
+
+        path, offset = self.tail_offsets.get(
+            day,
+            (
+                file_path,
+                0,
+            ),
+        )
+
+        if path != file_path:
+            offset = 0
+
+        rows, mark = read_scan_rows_from(
+            file_path,
+            offset,
+        )
+
+        self.tail_offsets[day] = (
+            file_path,
+            mark["offset"],
+        )
+
+        tailed = self.tailed.setdefault(
+            day,
+            {},
+        )
+
+        for stored_value, timestamp in rows:
+
+            barcode = voided_barcode(stored_value)
+
+            if barcode is None:
+
+                tailed.setdefault(
+                    stored_value,
+                    timestamp,
+                )
+
+            elif tailed.get(barcode) == timestamp:
+
+                del tailed[barcode]
+
+            self.unpolled.append(
+                (
+                    day,
+                    stored_value,
+                    timestamp,
+                )
+            )
+
+
+    def poll_appended(self, day):
+        """
+        Return [(day, stored_value, timestamp), ...] for
+        rows other processes stored since the last poll.
+        """
+
+        with self.tail_lock:
+
+            self._tail(day)
+
+            rows = self.unpolled
+
+            self.unpolled = []
+
+        return rows
+
+
+    def append(self, day, rows):
+        """
+        Store accepted rows.
+
+        Returns {barcode: timestamp} for rows the store
+        rejected because another process stored them
+        first.
+        """
+
+        with self.file_lock, self.tail_lock:
+
+            # Nothing can be appended while the lock is
+            # held, so this sees every other process's rows.
+            self._tail(day)
+
+            tailed = self.tailed.get(
+                day,
+                {},
+            )
+
+            rejected = {
+                barcode: tailed[barcode]
+                for barcode, _ in rows
+                if barcode in tailed
+            }
+
+            accepted = [
+                row
+                for row in rows
+                if row[0] not in rejected
+            ]
+
+            if accepted:
+
+                self._write(
+                    day,
+                    accepted,
+                )
+
+            # A voided barcode may be scanned again.
+            for stored_value, timestamp in accepted:
+
+                barcode = voided_barcode(stored_value)
+
+                if (
+                    barcode is not None
+                    and tailed.get(barcode) == timestamp
+                ):
+                    del tailed[barcode]
+
+            # Skip past this process's own rows.
+            self._reset_tail(day)
+
+        return rejected
+
+
+    def _write(self, day, rows):
+
+        reopen_archive(
+            self.data_dir,
+            day,
+        )
+
+        with open(
+            os.path.join(
+                self.data_dir,
+                f"{day}{CSV_EXTENSION}",
+            ),
+            "a",
+            newline="",
+            encoding="utf-8",
+        ) as csvfile:
+
+            csv.writer(
+                csvfile
+            ).writerows(
+                storage_row(
+                    barcode,
+                    timestamp,
+                )
+                for barcode, timestamp in rows
+            )
+
+        self.unsynced_days.add(day)
+
+
+    def sync(self):
+        """
+        fsync every day file appended since the last sync.
+        """
+
+        for day in list(self.unsynced_days):
+
+            with open(
+                os.path.join(
+                    self.data_dir,
+                    f"{day}{CSV_EXTENSION}",
+                ),
+                "ab",
+            ) as file:
+
+                os.fsync(
+                    file.fileno()
+                )
+
+            self.unsynced_days.discard(day)
+
+
+    def close_day(self, day):
+
+        with self.tail_lock:
+
+            self.tail_offsets.pop(
+                day,
+                None,
+            )
+
+            self.tailed.pop(
+                day,
+                None,
+            )
+
+
+    def close(self):
+        pass
+
+
+# =========================================================
+# JOURNAL STORAGE
+# =========================================================
+
+class JournalStorage(CsvStorage):
+    """
+    Append-only binary journal per day.
+
+    Each accepted batch is one write() + flush() on a file
+    handle that stays open until the day is closed, so the
+    scan path never reopens files or formats CSV text.
+
+    Days stored before the journal was enabled stay
+    readable from their CSV files.
+    """
+
+    name = "journal"
+
+    def __init__(self, data_dir):
+
+        super().__init__(data_dir)
+
+        self.lock = threading.Lock()
+
+        # day -> open binary append handle
+        self.handles = {}
+
+        # Reports from journals recovered before export.
+        self.recovered = []
+
+        with self.file_lock:
+            self.export_closed_days()
+
+
+    def journal_path(self, day):
+
+        return os.path.join(
+            self.data_dir,
+            f"{day}{JOURNAL_EXTENSION}",
+        )
+
+
+    def _handle(self, day):
+
+        handle = self.handles.get(day)
+
+        if handle is not None:
+            return handle
+
+        journal_path = self.journal_path(day)
+        csv_path = os.path.join(
+            self.data_dir,
+            f"{day}{CSV_EXTENSION}",
+        )
+
+        is_new = not os.path.exists(
+            journal_path
+        )
+
+        if is_new:
+
+            # The seed below then includes archived rows.
+            reopen_archive(
+                self.data_dir,
+                day,
+            )
+
+        else:
+            self._upgrade_journal(journal_path)
+
+        handle = open(
+            journal_path,
+            "ab",
+        )
+
+        if is_new:
+
+            # Seed from a CSV written earlier the same day
+            # so the journal stays the complete record.
+            seed = [JOURNAL_MAGIC]
+
+            if os.path.exists(
+                csv_path
+            ):
+
+                seed.extend(
+                    encode_journal_record(
+                        barcode,
+                        timestamp,
+                    )
+                    for barcode, timestamp
+                    in read_csv_rows(csv_path)
+                )
+
+            handle.write(
+                b"".join(seed)
+            )
+
+            handle.flush()
+
+        self.handles[day] = handle
+
+        return handle
+
+
+    @staticmethod
+    def _upgrade_journal(journal_path):
+        """
+        Rewrite an older journal in the current format
+        before appending to it.
+        """
+
+        with open(
+            journal_path,
+            "rb",
+        ) as file:
+
+            magic = journal_magic(
+                file.read(len(JOURNAL_MAGIC))
+            )
+
+        if magic in (
+            JOURNAL_MAGIC,
+            None,
+        ):
+            return
+
+        temp_path = f"{journal_path}.tmp"
+
+        with open(
+            temp_path,
+            "wb",
+        ) as file:
+
+            file.write(
+                JOURNAL_MAGIC
+                + b"".join(
+                    encode_journal_record(
+                        barcode,
+                        timestamp,
+                    )
+                    for barcode, timestamp
+                    in read_journal(journal_path)
+                )
+            )
+
+        os.replace(
+            temp_path,
+            journal_path,
+        )
+
+
+    def _write(self, day, rows):
+
+        payload = b"".join(
+            encode_journal_record(
+                barcode,
+                timestamp,
+            )
+            for barcode, timestamp in rows
+        )
+
+        with self.lock:
+
+            handle = self._handle(day)
+
+            handle.write(payload)
+            handle.flush()
+
+
+    def sync(self):
+
+        with self.lock:
+
+            for handle in self.handles.values():
+
+                os.fsync(
+                    handle.fileno()
+                )
+
+
+    def close_day(self, day):
+
+        super().close_day(day)
+
+        with self.lock:
+
+            handle = self.handles.pop(
+                day,
+                None,
+            )
+
+            if handle is not None:
+                handle.close()
+
+        if os.path.exists(
+            self.journal_path(day)
+        ):
+
+            with self.file_lock:
+                self.export_csv(day)
+
+
+    def close(self):
+
+        with self.lock:
+
+            for handle in self.handles.values():
+                handle.close()
+
+            self.handles = {}
+
+
+    def recover(self, days=None):
+        """
+        Journals are only appended while their day is open,
+        so by default only today's journal is checked here;
+        past journals are recovered before their export in
+        export_closed_days().
+        """
+
+        if days is None:
+
+            today = (
+                datetime.date.today()
+                .isoformat()
+            )
+
+            days = [
+                day
+                for day in self.list_days()
+                if day >= today
+            ]
+
+        reports = self.recovered + super().recover(days)
+
+        self.recovered = []
+
+        return reports
+
+
+    # =====================================================
+    # CSV EXPORT
+    # =====================================================
+
+    def _export_is_stale(self, day):
+
+        journal_path = self.journal_path(day)
+
+        csv_path = os.path.join(
+            self.data_dir,
+            f"{day}{CSV_EXTENSION}",
+        )
+
+        if not os.path.exists(journal_path):
+            return False
+
+        return not (
+            os.path.exists(csv_path)
+            and os.path.getmtime(csv_path)
+            >= os.path.getmtime(journal_path)
+        )
+
+
+    def export_csv(self, day):
+        """
+        Write data/<day>.csv from the day's journal.
+
+        The export is for people and other tools, so the
+        timestamps are ISO text whatever ROW_TIMESTAMPS
+        says; epoch rows are only for the files the
+        scanner appends to.
+
+        The CSV is replaced atomically so readers never see
+        a half-written export.
+        """
+
+        csv_path = os.path.join(
+            self.data_dir,
+            f"{day}{CSV_EXTENSION}",
+        )
+
+        temp_path = f"{csv_path}.tmp"
+
+        buffer = io.StringIO()
+
+        csv.writer(
+            buffer
+        ).writerows(
+            checksummed_row(
+                barcode,
+                timestamp,
+            )
+            for barcode, timestamp in read_journal(
+                self.journal_path(day)
+            )
+        )
+
+        with open(
+            temp_path,
+            "w",
+            newline="",
+            encoding="utf-8",
+        ) as file:
+
+            file.write(
+                buffer.getvalue()
+            )
+
+        os.replace(
+            temp_path,
+            csv_path,
+        )
+
+        return csv_path
+
+
+    def export_closed_days(self):
+        """
+        Export every past journal whose CSV is missing or
+        older than the journal.
+        """
+
+        today = (
+            datetime.date.today()
+            .isoformat()
+        )
+
+        for journal_path in glob(
+            os.path.join(
+                self.data_dir,
+                f"*{JOURNAL_EXTENSION}",
+            )
+        ):
+
+            day = os.path.splitext(
+                os.path.basename(journal_path)
+            )[0]
+
+            if day >= today:
+                continue
+
+            try:
+
+                if not self._export_is_stale(day):
+                    continue
+
+                report = recover_day_file(
+                    journal_path
+                )
+
+                if report is not None:
+                    self.recovered.append(report)
+
+                self.export_csv(day)
+
+            except OSError:
+                continue
+
+
+# =========================================================
+# SQLITE STORAGE
+# =========================================================
+
+class SqliteStorage:
+    """
+    Shared SQLite store in WAL mode.
+
+    Schema:
+        scans(barcode, timestamp, scan_date)
+        unique index on barcode
+        index on scan_date
+
+    The unique index is the duplicate check: rows that
+    another process stored first are rejected by the
+    database and reported back by append().
+    """
+
+    name = "sqlite"
+
+    indexed = True
+
+    # SQLite limits the number of bound parameters.
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, data_dir):
+
+        self.data_dir = data_dir
+
+        os.makedirs(
+            data_dir,
+            exist_ok=True,
+        )
+
+        self.db_path = os.path.join(
+            data_dir,
+            SQLITE_FILENAME,
+        )
+
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+
+        self.connection.execute(
+            "PRAGMA journal_mode=WAL"
+        )
+
+        self.connection.execute(
+            "PRAGMA synchronous=NORMAL"
+        )
+
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS scans (
+                barcode   TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                scan_date TEXT NOT NULL
+            );
+
+            CREATE UNIQUE INDEX IF NOT EXISTS
+                scans_barcode ON scans (barcode);
+
+            CREATE INDEX IF NOT EXISTS
+                scans_scan_date ON scans (scan_date);
+
+            CREATE TABLE IF NOT EXISTS store_info (
+                key   TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+
+
+    def _query(self, sql, parameters=()):
+
+        with self.lock:
+
+            return self.connection.execute(
+                sql,
+                parameters,
+            ).fetchall()
+
+
+    # =====================================================
+    # ONE-TIME IMPORT OF FILE HISTORY
+    # =====================================================
+
+    def needs_import(self):
+        """
+        True until the daily files have been imported once.
+        """
+
+        return not self._query(
+            "SELECT 1 FROM store_info"
+            " WHERE key = 'files_imported'"
+        )
+
+
+    def import_rows(self, day, rows):
+        """
+        Import validated history rows, keeping the first
+        occurrence of every barcode.
+        """
+
+        with self.lock:
+
+            self.connection.execute("BEGIN")
+
+            try:
+
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO scans"
+                    " (barcode, timestamp, scan_date)"
+                    " VALUES (?, ?, ?)",
+                    (
+                        (barcode, timestamp, day)
+                        for barcode, timestamp in rows
+                    ),
+                )
+
+                self.connection.execute("COMMIT")
+
+            except Exception:
+
+                self.connection.execute("ROLLBACK")
+                raise
+
+
+    def mark_imported(self):
+
+        with self.lock:
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO store_info"
+                " (key, value) VALUES"
+                " ('files_imported', ?)",
+                (
+                    datetime.datetime.now()
+                    .isoformat(),
+                ),
+            )
+
+
+    # =====================================================
+    # INDEXED QUERIES
+    # =====================================================
+
+    def lookup(self, barcodes):
+        """
+        Return {barcode: first timestamp} for stored IDs.
+        """
+
+        barcodes = list(
+            dict.fromkeys(barcodes)
+        )
+
+        found = {}
+
+        for start in range(
+            0,
+            len(barcodes),
+            self.LOOKUP_CHUNK,
+        ):
+
+            chunk = barcodes[
+                start:start + self.LOOKUP_CHUNK
+            ]
+
+            placeholders = ",".join(
+                "?" * len(chunk)
+            )
+
+            found.update(
+                self._query(
+                    "SELECT barcode, timestamp FROM scans"
+                    f" WHERE barcode IN ({placeholders})",
+                    chunk,
+                )
+            )
+
+        return found
+
+
+    def count(self):
+
+        return self._query(
+            "SELECT COUNT(*) FROM scans"
+        )[0][0]
+
+
+    def list_days(self):
+
+        return [
+            row[0]
+            for row in self._query(
+                "SELECT DISTINCT scan_date FROM scans"
+                " ORDER BY scan_date"
+            )
+        ]
+
+
+    def has_day(self, day):
+
+        return bool(
+            self._query(
+                "SELECT 1 FROM scans"
+                " WHERE scan_date = ? LIMIT 1",
+                (day,),
+            )
+        )
+
+
+    def day_version(self, day):
+
+        return tuple(
+            self._query(
+                "SELECT COUNT(*), MAX(rowid) FROM scans"
+                " WHERE scan_date = ?",
+                (day,),
+            )[0]
+        )
+
+
+    def read_day(self, day):
+
+        return [
+            tuple(row)
+            for row in self._query(
+                "SELECT barcode, timestamp FROM scans"
+                " WHERE scan_date = ? ORDER BY rowid",
+                (day,),
+            )
+        ]
+
+
+    # =====================================================
+    # WRITES
+    # =====================================================
+
+    def append(self, day, rows):
+        """
+        Insert accepted rows in one transaction.
+
+        Returns {barcode: timestamp} for rows another
+        process stored first.
+        """
+
+        rejected = {}
+
+        with self.lock:
+
+            self.connection.execute(
+                "BEGIN IMMEDIATE"
+            )
+
+            try:
+
+                for barcode, timestamp in rows:
+
+                    voided = voided_barcode(barcode)
+
+                    if voided is not None:
+
+                        # Indexed: the row itself goes.
+                        self.connection.execute(
+                            "DELETE FROM scans"
+                            " WHERE barcode = ?"
+                            " AND timestamp = ?",
+                            (
+                                voided,
+                                timestamp,
+                            ),
+                        )
+
+                        continue
+
+                    cursor = self.connection.execute(
+                        "INSERT OR IGNORE INTO scans"
+                        " (barcode, timestamp, scan_date)"
+                        " VALUES (?, ?, ?)",
+                        (
+                            barcode,
+                            timestamp,
+                            day,
+                        ),
+                    )
+
+                    if cursor.rowcount == 0:
+
+                        rejected[barcode] = (
+                            self.connection.execute(
+                                "SELECT timestamp FROM scans"
+                                " WHERE barcode = ?",
+                                (barcode,),
+                            ).fetchone()[0]
+                        )
+
+                self.connection.execute("COMMIT")
+
+            except Exception:
+
+                self.connection.execute("ROLLBACK")
+                raise
+
+        return rejected
+
+
+    def sync(self):
+        """
+        WAL commits with synchronous=NORMAL are durable
+        once checkpointed.
+        """
+
+        self._query(
+            "PRAGMA wal_checkpoint(PASSIVE)"
+        )
+
+
+    def recover(self, days=None):
+        """
+        SQLite rolls back torn transactions itself.
+        """
+
+        return []
+
+
+    def close_day(self, day):
+        pass
+
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
+
+
+# =========================================================
+# BACKEND SELECTION
+# =========================================================
+
+STORAGE_BACKENDS = {
+    CsvStorage.name: CsvStorage,
+    JournalStorage.name: JournalStorage,
+    SqliteStorage.name: SqliteStorage,
+}
+
+
+def open_storage(data_dir, backend=None):
+    """
+    Create the configured storage backend.
+    """
+
+    backend = backend or STORAGE_BACKEND
+
+    if backend not in STORAGE_BACKENDS:
+
+        raise ValueError(
+            f"Unknown storage backend: {backend}"
+        )
+
+    return STORAGE_BACKENDS[backend](
+        data_dir
+    )
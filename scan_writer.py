@@ -0,0 +1,401 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# =========================================================
+# GROUP-COMMIT WRITER
+# =========================================================
+#
+# One thread owns every write to the scan storage. Accepted
+# rows are queued with an acknowledgement future; the thread
+# drains everything queued so far and stores it with one
+# append per day, so a burst of scans from several sessions
+# costs one disk write instead of one each.
+#
+# Durability policies:
+#
+#     batch     fsync after every group commit, before the
+#               acknowledgements are resolved
+#     interval  fsync at most every SYNC_INTERVAL_MS; the
+#               acknowledgement only waits for the append
+#     os        OS-buffered, never fsync (original behaviour)
+#
+# A failed fsync does not fail the acknowledgements: the
+# rows are appended and will be read back, so the registry
+# must keep them. The failure is kept in sync_error until
+# a later fsync succeeds.
+
+DURABILITY_POLICIES = (
+    "batch",
+    "interval",
+    "os",
+)
+
+
+class ScanWriter:
+    """
+    Background writer in front of a storage backend.
+
+    submit() returns a Future resolved with the storage's
+    {barcode: timestamp} rejections once the rows are
+    stored, or with the exception raised while storing.
+    """
+
+    def __init__(
+        self,
+        storage,
+        durability="os",
+        sync_interval_ms=50,
+    ):
+
+        if durability not in DURABILITY_POLICIES:
+
+            raise ValueError(
+                f"Unknown durability policy: {durability}"
+            )
+
+        self.storage = storage
+        self.durability = durability
+        self.sync_interval = (
+            sync_interval_ms / 1000
+        )
+
+        self.queue = queue.Queue()
+
+        self.unsynced = False
+        self.last_sync = time.monotonic()
+
+        # Wall-clock time of the last successful append
+        # (see BarcodeRegistry.get_diagnostics).
+        self.last_write = None
+
+        # Message of the last failed fsync, None once one
+        # succeeds again.
+        self.sync_error = None
+
+        self.closed = False
+
+        self.thread = threading.Thread(
+            target=self._run,
+            name="scan-writer",
+            daemon=True,
+        )
+
+        self.thread.start()
+
+
+    # =====================================================
+    # PUBLIC API
+    # =====================================================
+
+    def submit(self, day, rows):
+
+        future = Future()
+
+        if self.closed:
+
+            future.set_exception(
+                RuntimeError(
+                    "Scan writer is closed."
+                )
+            )
+
+            return future
+
+        self.queue.put(
+            (
+                day,
+                list(rows),
+                future,
+            )
+        )
+
+        return future
+
+
+    def submit_days(self, rows_by_day):
+        """
+        submit() the rows of several days at once.
+
+        Returns one Future resolved with the rejections of
+        every day once all are stored, or with the first
+        exception raised while storing.
+        """
+
+        futures = [
+            self.submit(
+                day,
+                rows,
+            )
+            for day, rows in rows_by_day.items()
+        ]
+
+        if len(futures) == 1:
+            return futures[0]
+
+        combined = Future()
+
+        rejected = {}
+        remaining = [len(futures)]
+
+        if not futures:
+
+            combined.set_result(rejected)
+
+            return combined
+
+        lock = threading.Lock()
+
+        def collect(future):
+
+            with lock:
+
+                if combined.done():
+                    return
+
+                exc = future.exception()
+
+                if exc is not None:
+
+                    combined.set_exception(exc)
+
+                    return
+
+                rejected.update(
+                    future.result()
+                )
+
+                remaining[0] -= 1
+
+                if not remaining[0]:
+
+                    combined.set_result(
+                        rejected
+                    )
+
+        for future in futures:
+
+            future.add_done_callback(
+                collect
+            )
+
+        return combined
+
+
+    def flush(self):
+        """
+        Wait until everything queued so far is stored and,
+        unless OS-buffered, synced.
+        """
+
+        if self.closed:
+            return
+
+        future = Future()
+
+        self.queue.put(
+            (
+                None,
+                None,
+                future,
+            )
+        )
+
+        future.result()
+
+
+    def close(self):
+
+        if self.closed:
+            return
+
+        self.flush()
+
+        self.closed = True
+
+        self.queue.put(None)
+
+        self.thread.join()
+
+
+    # =====================================================
+    # WRITER THREAD
+    # =====================================================
+
+    def _next_group(self):
+        """
+        Block for the first item, then take everything
+        else already queued.
+        """
+
+        timeout = None
+
+        if (
+            self.durability == "interval"
+            and self.unsynced
+        ):
+
+            timeout = max(
+                self.sync_interval
+                - (
+                    time.monotonic()
+                    - self.last_sync
+                ),
+                0,
+            )
+
+        try:
+
+            items = [
+                self.queue.get(
+                    timeout=timeout
+                )
+            ]
+
+        except queue.Empty:
+            return []
+
+        while True:
+
+            try:
+
+                items.append(
+                    self.queue.get_nowait()
+                )
+
+            except queue.Empty:
+                return items
+
+
+    def _run(self):
+
+        while True:
+
+            group = self._next_group()
+
+            stop = None in group
+
+            group = [
+                item
+                for item in group
+                if item is not None
+            ]
+
+            self._commit(group)
+
+            if stop:
+                return
+
+
+    def _commit(self, group):
+
+        writes = [
+            item
+            for item in group
+            if item[0] is not None
+        ]
+
+        barriers = [
+            item[2]
+            for item in group
+            if item[0] is None
+        ]
+
+        # day -> [(rows, future), ...] in arrival order
+        by_day = {}
+
+        for day, rows, future in writes:
+
+            by_day.setdefault(
+                day,
+                [],
+            ).append(
+                (
+                    rows,
+                    future,
+                )
+            )
+
+        done = []
+
+        for day, submissions in by_day.items():
+
+            try:
+
+                rejected = self.storage.append(
+                    day,
+                    [
+                        row
+                        for rows, _ in submissions
+                        for row in rows
+                    ],
+                )
+
+                self.unsynced = True
+                self.last_write = time.time()
+
+            except Exception as exc:
+
+                for _, future in submissions:
+                    future.set_exception(exc)
+
+                continue
+
+            for rows, future in submissions:
+
+                done.append(
+                    (
+                        future,
+                        {
+                            barcode: rejected[barcode]
+                            for barcode, _ in rows
+                            if barcode in rejected
+                        },
+                    )
+                )
+
+        if self._sync_due(
+            force=bool(barriers)
+        ):
+
+            try:
+
+                self.storage.sync()
+
+                self.unsynced = False
+                self.last_sync = time.monotonic()
+                self.sync_error = None
+
+            except Exception as exc:
+                self.sync_error = str(exc)
+
+        # Even when the fsync failed: the rows are
+        # appended, and failing them would let the
+        # registry release barcodes that are stored.
+        for future, rejected in done:
+            future.set_result(rejected)
+
+        for future in barriers:
+            future.set_result({})
+
+
+    def _sync_due(self, force):
+
+        if (
+            self.durability == "os"
+            or not self.unsynced
+        ):
+            return False
+
+        if (
+            force
+            or self.durability == "batch"
+        ):
+            return True
+
+        return (
+            time.monotonic() - self.last_sync
+            >= self.sync_interval
+        )
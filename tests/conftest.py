@@ -0,0 +1,122 @@
+import csv
+import datetime
+import os
+
+import pytest
+
+import scan_registry
+import scan_storage
+
+
+# =========================================================
+# DATA DIRECTORY FIXTURES
+# =========================================================
+#
+# scan_registry keeps its files under the relative DATA_DIR,
+# so each test runs in its own temporary directory with a
+# fresh data/ and no data watcher thread.
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+
+    os.makedirs(scan_registry.DATA_DIR)
+
+    monkeypatch.setattr(
+        scan_registry,
+        "STORAGE_BACKEND",
+        "csv",
+    )
+
+    monkeypatch.setattr(
+        scan_registry,
+        "WATCH_DATA_DIR",
+        False,
+    )
+
+    monkeypatch.setattr(
+        scan_registry,
+        "LOAD_WORKERS",
+        1,
+    )
+
+    return str(
+        tmp_path / scan_registry.DATA_DIR
+    )
+
+
+@pytest.fixture
+def open_registry():
+    """
+    Build BarcodeRegistry instances that are closed when
+    the test ends.
+    """
+
+    registries = []
+
+    def factory(**kwargs):
+
+        registry = scan_registry.BarcodeRegistry(
+            **kwargs
+        )
+
+        registries.append(registry)
+
+        return registry
+
+    yield factory
+
+    for registry in registries:
+        registry.close()
+
+
+def past_day(days_ago):
+
+    return (
+        datetime.date.today()
+        - datetime.timedelta(
+            days=days_ago
+        )
+    ).isoformat()
+
+
+def anteraja_barcode(number):
+
+    return f"1{number:013d}"
+
+
+def write_day(data_dir, day, barcodes, mode="a"):
+    """
+    Store barcodes in a day's CSV, one second apart from
+    09:00, as the scanner writes them.
+    """
+
+    start = datetime.datetime.fromisoformat(
+        f"{day}T09:00:00"
+    )
+
+    with open(
+        os.path.join(
+            data_dir,
+            f"{day}{scan_storage.CSV_EXTENSION}",
+        ),
+        mode,
+        newline="",
+        encoding="utf-8",
+    ) as csvfile:
+
+        csv.writer(
+            csvfile
+        ).writerows(
+            scan_storage.storage_row(
+                barcode,
+                (
+                    start
+                    + datetime.timedelta(
+                        seconds=position
+                    )
+                ).isoformat(),
+            )
+            for position, barcode in enumerate(barcodes)
+        )
@@ -0,0 +1,382 @@
+import gzip
+import os
+
+import pytest
+
+import archive_history
+import scan_registry
+import scan_storage
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# ARCHIVE FORMAT
+# =========================================================
+
+DAY = "2026-01-02"
+
+# Three courier formats, several blocks each.
+ROWS = [
+    (
+        barcode,
+        f"{DAY}T{position // 3600 % 24:02d}:"
+        f"{position // 60 % 60:02d}:{position % 60:02d}",
+    )
+    for position, barcode in enumerate(
+        [
+            anteraja_barcode(number)
+            for number in range(600)
+        ]
+        + [
+            f"SPXID06{number:010d}"
+            for number in range(300)
+        ]
+        + [
+            f"J{number:011d}"
+            for number in range(100)
+        ]
+    )
+]
+
+
+@pytest.fixture
+def archive_path(tmp_path):
+
+    archive_path = str(
+        tmp_path / f"{DAY}{scan_storage.ARCHIVE_EXTENSION}"
+    )
+
+    scan_storage.write_archive(
+        archive_path,
+        ROWS,
+    )
+
+    return archive_path
+
+
+@pytest.fixture
+def decompressed(monkeypatch):
+    """
+    Count the blocks decompressed.
+    """
+
+    calls = []
+
+    def decompress(data):
+
+        calls.append(len(data))
+
+        return gzip.decompress(data)
+
+    monkeypatch.setitem(
+        scan_storage.ARCHIVE_CODECS,
+        "gzip",
+        (
+            gzip.compress,
+            decompress,
+        ),
+    )
+
+    return calls
+
+
+@pytest.mark.parametrize(
+    "compression",
+    sorted(scan_storage.ARCHIVE_CODECS),
+)
+def test_archive_round_trips_in_time_order(
+    tmp_path,
+    compression,
+):
+
+    archive_path = str(tmp_path / "day.archive")
+
+    scan_storage.write_archive(
+        archive_path,
+        reversed(ROWS),
+        compression,
+    )
+
+    assert scan_storage.read_archive(
+        archive_path
+    ) == sorted(
+        ROWS,
+        key=lambda row: row[1],
+    )
+
+    header = scan_storage.read_archive_index(
+        archive_path
+    )
+
+    assert header["rows"] == len(ROWS)
+    assert len(header["blocks"]) == -(
+        -len(ROWS) // scan_storage.ARCHIVE_BLOCK_ROWS
+    )
+
+
+def test_whole_barcode_reads_one_block(
+    archive_path,
+    decompressed,
+):
+
+    rows = scan_storage.read_archive(
+        archive_path,
+        barcode="SPXID060000000123",
+    )
+
+    assert len(decompressed) == 1
+    assert ("SPXID060000000123", ROWS[723][1]) in rows
+
+
+def test_unknown_barcode_reads_no_block(
+    archive_path,
+    decompressed,
+):
+
+    assert scan_storage.read_archive(
+        archive_path,
+        barcode="SPXID069999999999",
+    ) == []
+
+    assert decompressed == []
+
+
+def test_partial_barcode_reads_every_block(
+    archive_path,
+    decompressed,
+):
+
+    rows = scan_storage.read_archive(
+        archive_path,
+        barcode="0123",
+    )
+
+    assert len(decompressed) == len(
+        scan_storage.read_archive_index(
+            archive_path
+        )["blocks"]
+    )
+    assert len(rows) == len(ROWS)
+
+
+def test_time_window_skips_blocks(
+    archive_path,
+    decompressed,
+):
+
+    start = f"{DAY}T00:05:00"
+    end = f"{DAY}T00:05:05"
+
+    rows = scan_storage.read_archive(
+        archive_path,
+        start=start,
+        end=end,
+    )
+
+    assert 0 < len(decompressed) < len(
+        scan_storage.read_archive_index(
+            archive_path
+        )["blocks"]
+    )
+    assert [
+        row
+        for row in rows
+        if start <= row[1] <= end
+    ] == [
+        row
+        for row in ROWS
+        if start <= row[1] <= end
+    ]
+
+
+def test_archive_may_contain_reads_the_index_only(
+    archive_path,
+    decompressed,
+):
+
+    assert scan_storage.archive_may_contain(
+        archive_path,
+        [
+            "SPXID069999999999",
+            "J00000000042",
+        ],
+    )
+    assert not scan_storage.archive_may_contain(
+        archive_path,
+        ["SPXID069999999999"],
+    )
+    assert decompressed == []
+
+
+def test_corrupt_block_raises(archive_path):
+
+    with open(archive_path, "r+b") as file:
+
+        file.seek(-20, os.SEEK_END)
+        file.write(b"\0" * 20)
+
+    with pytest.raises(ValueError):
+        scan_storage.read_archive(archive_path)
+
+
+# =========================================================
+# ARCHIVED DAYS
+# =========================================================
+
+def test_archived_day_keeps_its_rows(data_dir, open_registry):
+
+    day = past_day(60)
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(number)
+            for number in range(300)
+        ],
+    )
+
+    reports = archive_history.archive_history(
+        data_dir,
+        older_than=30,
+    )
+
+    assert [
+        report["day"]
+        for report in reports
+    ] == [day]
+
+    assert scan_storage.day_file(
+        data_dir,
+        day,
+    ).endswith(scan_storage.ARCHIVE_EXTENSION)
+
+    assert not os.path.exists(
+        os.path.join(
+            data_dir,
+            f"{day}{scan_storage.CSV_EXTENSION}",
+        )
+    )
+
+    registry = open_registry()
+
+    assert registry.process_batch(
+        [anteraja_barcode(250)]
+    )[0]["status"] == "duplicate"
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        "csv",
+        "journal",
+    ],
+)
+def test_append_to_archived_day_reopens_it(
+    data_dir,
+    backend,
+):
+
+    day = past_day(60)
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(number)
+            for number in range(300)
+        ],
+    )
+
+    archive_history.archive_history(
+        data_dir,
+        older_than=30,
+    )
+
+    storage = scan_storage.open_storage(
+        data_dir,
+        backend,
+    )
+
+    storage.append(
+        day,
+        [
+            (
+                anteraja_barcode(1000),
+                f"{day}T20:00:00",
+            ),
+        ],
+    )
+
+    storage.close_day(day)
+    storage.close()
+
+    assert not os.path.exists(
+        os.path.join(
+            data_dir,
+            f"{day}{scan_storage.ARCHIVE_EXTENSION}",
+        )
+    )
+
+    barcodes = {
+        barcode
+        for barcode, _ in storage.read_day(day)
+    }
+
+    assert len(barcodes) == 301
+    assert anteraja_barcode(1000) in barcodes
+    assert anteraja_barcode(0) in barcodes
+
+
+def test_scan_for_archived_day_through_registry(
+    data_dir,
+    open_registry,
+):
+
+    day = past_day(60)
+
+    write_day(
+        data_dir,
+        day,
+        [anteraja_barcode(1)],
+    )
+
+    archive_history.archive_history(
+        data_dir,
+        older_than=30,
+    )
+
+    registry = open_registry()
+
+    results = registry.process_batch(
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(2),
+        ],
+        [
+            f"{day}T12:00:00",
+            f"{day}T12:00:01",
+        ],
+    )
+
+    assert [
+        result["status"]
+        for result in results
+    ] == [
+        "duplicate",
+        "success",
+    ]
+
+    assert [
+        barcode
+        for barcode, _ in scan_storage.read_scan_rows(
+            scan_storage.day_file(
+                scan_registry.DATA_DIR,
+                day,
+            )
+        )
+    ] == [
+        anteraja_barcode(1),
+        anteraja_barcode(2),
+    ]
@@ -0,0 +1,245 @@
+import os
+
+import numpy as np
+import pytest
+
+import bloom_filter
+import cold_index
+
+from conftest import anteraja_barcode
+
+
+# =========================================================
+# FILTER
+# =========================================================
+
+def random_keys(count, seed):
+
+    return np.random.default_rng(seed).integers(
+        np.iinfo(np.int64).min,
+        np.iinfo(np.int64).max,
+        size=count,
+        dtype=np.int64,
+    )
+
+
+def test_added_keys_are_always_found():
+
+    keys = random_keys(20000, 1)
+
+    bloom = bloom_filter.BloomFilter.from_keys(keys)
+
+    # Vectorized batches and the scalar path.
+    assert bloom.might_contain(keys).all()
+    assert bloom.might_contain(keys[:3]).all()
+
+
+def test_scalar_and_vectorized_paths_agree():
+
+    bloom = bloom_filter.BloomFilter.from_keys(
+        random_keys(5000, 2)
+    )
+
+    probes = random_keys(
+        4 * bloom_filter.SCALAR_BATCH,
+        3,
+    )
+
+    vectorized = bloom.might_contain(probes)
+
+    scalar = np.concatenate(
+        [
+            bloom.might_contain(
+                probes[start:start + 1]
+            )
+            for start in range(len(probes))
+        ]
+    )
+
+    assert (vectorized == scalar).all()
+
+
+def test_false_positive_rate_at_capacity():
+
+    bloom = bloom_filter.BloomFilter(20000)
+
+    bloom.add(random_keys(20000, 4))
+
+    absent = random_keys(50000, 5)
+
+    observed = bloom.might_contain(absent).mean()
+
+    # About 0.8% at 10 bits and 7 hashes per key.
+    assert observed < 0.02
+    assert bloom.estimated_fpr() == pytest.approx(
+        observed,
+        abs=0.01,
+    )
+
+
+def test_copy_does_not_share_bits():
+
+    bloom = bloom_filter.BloomFilter.from_keys(
+        random_keys(100, 6)
+    )
+
+    copy = bloom.copy()
+
+    copy.add(random_keys(5000, 7))
+
+    assert copy.key_count == bloom.key_count + 5000
+    assert not np.array_equal(copy.bits, bloom.bits)
+
+
+# =========================================================
+# PERSISTENCE
+# =========================================================
+
+def test_filter_round_trips(tmp_path):
+
+    path = str(tmp_path / "keys.bloom")
+
+    keys = random_keys(3000, 8)
+
+    bloom = bloom_filter.BloomFilter.from_keys(keys)
+
+    bloom_filter.save_filter(path, bloom)
+
+    loaded = bloom_filter.load_filter(path)
+
+    assert loaded.capacity == bloom.capacity
+    assert loaded.key_count == bloom.key_count
+    assert np.array_equal(loaded.bits, bloom.bits)
+    assert loaded.might_contain(keys).all()
+
+
+@pytest.mark.parametrize(
+    "damage",
+    [
+        "missing",
+        "truncated",
+        "magic",
+    ],
+)
+def test_unreadable_filter_is_none(tmp_path, damage):
+
+    path = str(tmp_path / "keys.bloom")
+
+    if damage != "missing":
+
+        bloom_filter.save_filter(
+            path,
+            bloom_filter.BloomFilter.from_keys(
+                random_keys(100, 9)
+            ),
+        )
+
+        with open(path, "rb") as file:
+            content = file.read()
+
+        content = (
+            content[:-1]
+            if damage == "truncated"
+            else b"XXXX" + content[4:]
+        )
+
+        with open(path, "wb") as file:
+            file.write(content)
+
+    assert bloom_filter.load_filter(path) is None
+
+
+# =========================================================
+# IN FRONT OF THE COLD INDEX
+# =========================================================
+
+def build_index(data_dir, count):
+
+    return cold_index.build_cold_index(
+        data_dir,
+        [
+            (
+                "2026-01-02",
+                [
+                    (
+                        anteraja_barcode(number),
+                        "2026-01-02T09:00:00",
+                    )
+                    for number in range(count)
+                ],
+                {},
+            ),
+        ],
+    )
+
+
+def test_missing_sidecar_is_rebuilt(tmp_path):
+
+    data_dir = str(tmp_path)
+
+    index = build_index(data_dir, 100)
+
+    filter_path = index.path + cold_index.FILTER_SUFFIX
+
+    index.close()
+
+    os.remove(filter_path)
+
+    reopened = cold_index.open_cold_index(data_dir)
+
+    assert reopened.filter is not None
+    assert os.path.exists(filter_path)
+    assert reopened.lookup(
+        [anteraja_barcode(7)]
+    ) == {
+        anteraja_barcode(7): "2026-01-02T09:00:00",
+    }
+
+
+def test_filter_stats_count_probes(tmp_path):
+
+    index = build_index(str(tmp_path), 1000)
+
+    index.lookup(
+        [
+            anteraja_barcode(number)
+            for number in range(990, 1010)
+        ]
+    )
+
+    stats = index.filter_stats()
+
+    assert stats["keys"] == 1000
+    assert stats["probes"] == 20
+    assert stats["found"] == 10
+
+    # Every hit passes; a miss passes only as a false
+    # positive.
+    assert 10 <= stats["passed"] <= 20
+    assert stats["filter_bytes"] > 0
+
+
+def test_lookups_without_filter_agree(tmp_path, monkeypatch):
+
+    barcodes = [
+        anteraja_barcode(number)
+        for number in range(0, 400, 3)
+    ]
+
+    index = build_index(str(tmp_path), 200)
+
+    filtered = index.lookup(barcodes)
+
+    monkeypatch.setattr(
+        cold_index,
+        "COLD_INDEX_FILTER",
+        False,
+    )
+
+    unfiltered_index = cold_index.open_cold_index(
+        str(tmp_path)
+    )
+
+    assert unfiltered_index.filter is None
+    assert unfiltered_index.lookup(barcodes) == filtered
+    assert len(filtered) == len(range(0, 200, 3))
@@ -0,0 +1,321 @@
+import os
+
+import pytest
+
+import cold_index
+import scan_registry
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# COLD INDEX FILES
+# =========================================================
+
+MARK = {
+    "offset": 10,
+    "size": 10,
+    "mtime": 1.0,
+    "tail_crc": 0,
+}
+
+
+def build(data_dir, day_records, base=None):
+
+    return cold_index.build_cold_index(
+        data_dir,
+        [
+            (
+                day,
+                records,
+                MARK,
+            )
+            for day, records in day_records
+        ],
+        base,
+    )
+
+
+def test_lookup_returns_first_scan_of_each_barcode(tmp_path):
+
+    index = build(
+        str(tmp_path),
+        [
+            (
+                "2026-01-02",
+                [
+                    (
+                        anteraja_barcode(1),
+                        "2026-01-02T09:00:00",
+                    ),
+                    (
+                        "SPXID060000000042",
+                        "2026-01-02T09:30:00.250000",
+                    ),
+                ],
+            ),
+            (
+                "2026-01-01",
+                [
+                    (
+                        anteraja_barcode(1),
+                        "2026-01-01T18:00:00",
+                    ),
+                ],
+            ),
+        ],
+    )
+
+    assert index.days == {
+        "2026-01-01": MARK,
+        "2026-01-02": MARK,
+    }
+
+    assert index.lookup(
+        [
+            anteraja_barcode(1),
+            "SPXID060000000042",
+            anteraja_barcode(2),
+            "J00000000000",
+        ]
+    ) == {
+        anteraja_barcode(1): "2026-01-01T18:00:00",
+        "SPXID060000000042": "2026-01-02T09:30:00.250000",
+    }
+
+    index.close()
+
+
+def test_unpackable_records_are_kept_in_the_header(tmp_path):
+
+    index = build(
+        str(tmp_path),
+        [
+            (
+                "2026-01-02",
+                [
+                    (
+                        "LEGACY-0001",
+                        "2026-01-02T09:00:00",
+                    ),
+                    (
+                        anteraja_barcode(5),
+                        "not a time",
+                    ),
+                ],
+            ),
+        ],
+    )
+
+    assert index.other == {
+        "LEGACY-0001": "2026-01-02T09:00:00",
+        anteraja_barcode(5): "not a time",
+    }
+
+    reopened = cold_index.open_cold_index(
+        str(tmp_path)
+    )
+
+    assert reopened.lookup(
+        [
+            "LEGACY-0001",
+            anteraja_barcode(5),
+        ]
+    ) == index.other
+
+
+def test_new_generation_merges_base(tmp_path):
+
+    data_dir = str(tmp_path)
+
+    base = build(
+        data_dir,
+        [
+            (
+                "2026-01-01",
+                [
+                    (
+                        anteraja_barcode(1),
+                        "2026-01-01T09:00:00",
+                    ),
+                ],
+            ),
+        ],
+    )
+
+    newer = build(
+        data_dir,
+        [
+            (
+                "2026-01-02",
+                [
+                    (
+                        anteraja_barcode(1),
+                        "2026-01-02T09:00:00",
+                    ),
+                    (
+                        anteraja_barcode(2),
+                        "2026-01-02T09:00:00",
+                    ),
+                ],
+            ),
+        ],
+        base,
+    )
+
+    assert len(newer) == 2
+    assert set(newer.days) == {
+        "2026-01-01",
+        "2026-01-02",
+    }
+    assert newer.lookup(
+        [anteraja_barcode(1)]
+    ) == {
+        anteraja_barcode(1): "2026-01-01T09:00:00",
+    }
+
+    base.close()
+
+    cold_index.remove_old_generations(
+        data_dir,
+        newer.path,
+    )
+
+    assert sorted(os.listdir(data_dir)) == [
+        os.path.basename(newer.path),
+        os.path.basename(newer.path)
+        + cold_index.FILTER_SUFFIX,
+    ]
+
+    assert cold_index.open_cold_index(
+        data_dir
+    ).path == newer.path
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"",
+        b"DCI1\xff\xff",
+        b"PK\x03\x04 something else",
+    ],
+)
+def test_unreadable_index_is_empty(tmp_path, content):
+
+    path = tmp_path / "cold_index.1.bin"
+
+    path.write_bytes(content)
+
+    index = cold_index.open_cold_index(
+        str(tmp_path)
+    )
+
+    assert len(index) == 0
+    assert index.days == {}
+    assert index.lookup(
+        [anteraja_barcode(1)]
+    ) == {}
+
+
+# =========================================================
+# REGISTRY TIERS
+# =========================================================
+
+def test_days_before_the_window_are_answered_from_disk(
+    data_dir,
+    open_registry,
+    monkeypatch,
+):
+
+    monkeypatch.setattr(
+        scan_registry,
+        "HOT_DAYS",
+        3,
+    )
+
+    old_day = past_day(10)
+    recent_day = past_day(1)
+
+    write_day(
+        data_dir,
+        old_day,
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(2),
+        ],
+    )
+    write_day(
+        data_dir,
+        recent_day,
+        [anteraja_barcode(3)],
+    )
+
+    registry = open_registry()
+
+    assert set(registry.cold.days) == {old_day}
+    assert len(registry.codes) == 1
+
+    results = registry.process_batch(
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(3),
+            anteraja_barcode(4),
+        ]
+    )
+
+    assert [
+        result["status"]
+        for result in results
+    ] == [
+        "duplicate",
+        "duplicate",
+        "success",
+    ]
+
+    # First scan time from the cold index.
+    assert results[0]["timestamp"] == f"{old_day}T09:00:00"
+
+    assert registry.get_total_successful_scans() == 4
+
+
+def test_cold_index_is_reused_on_next_start(
+    data_dir,
+    open_registry,
+    monkeypatch,
+):
+
+    monkeypatch.setattr(
+        scan_registry,
+        "HOT_DAYS",
+        3,
+    )
+
+    write_day(
+        data_dir,
+        past_day(10),
+        [anteraja_barcode(1)],
+    )
+
+    first_path = open_registry().cold.path
+
+    assert first_path is not None
+
+    registry = open_registry()
+
+    assert registry.cold.path == first_path
+
+    # A day appended to after the build is rebuilt.
+    write_day(
+        data_dir,
+        past_day(10),
+        [anteraja_barcode(2)],
+    )
+
+    registry.close()
+
+    registry = open_registry()
+
+    assert registry.cold.path != first_path
+    assert registry.process_batch(
+        [anteraja_barcode(2)]
+    )[0]["status"] == "duplicate"
@@ -0,0 +1,309 @@
+import datetime
+import os
+
+import pytest
+
+import data_watcher
+import scan_history
+import scan_registry
+import scan_storage
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# DATA WATCHER
+# =========================================================
+#
+# refresh() runs the same check as the watcher thread and
+# holds the same lock, so every change is reported by the
+# time it returns, whichever of the two saw it first.
+
+@pytest.fixture
+def watcher(data_dir):
+
+    watcher = data_watcher.DataDirWatcher(
+        data_dir,
+        poll_interval=0.1,
+    )
+
+    changes = []
+
+    watcher.subscribe(
+        lambda day, rows, start, mark: changes.append(
+            (
+                day,
+                [
+                    stored_value
+                    for stored_value, _ in rows
+                ],
+                start,
+                mark["offset"],
+            )
+        )
+    )
+
+    watcher.changes = changes
+
+    yield watcher
+
+    watcher.close()
+
+
+def test_existing_records_are_not_reported(data_dir):
+
+    write_day(
+        data_dir,
+        past_day(1),
+        [anteraja_barcode(1)],
+    )
+
+    watcher = data_watcher.DataDirWatcher(
+        data_dir,
+        poll_interval=0.1,
+    )
+
+    changes = []
+
+    watcher.subscribe(
+        lambda *change: changes.append(change)
+    )
+
+    watcher.refresh()
+    watcher.close()
+
+    assert changes == []
+
+
+def test_appended_rows_are_reported_from_the_mark(
+    data_dir,
+    watcher,
+):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, [anteraja_barcode(1)])
+
+    watcher.refresh()
+
+    size = os.path.getsize(
+        scan_storage.day_file(data_dir, day)
+    )
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(2),
+            anteraja_barcode(3),
+        ],
+    )
+
+    watcher.refresh()
+
+    assert watcher.changes == [
+        (
+            day,
+            [anteraja_barcode(1)],
+            0,
+            size,
+        ),
+        (
+            day,
+            [
+                anteraja_barcode(2),
+                anteraja_barcode(3),
+            ],
+            size,
+            os.path.getsize(
+                scan_storage.day_file(data_dir, day)
+            ),
+        ),
+    ]
+
+    # Nothing new.
+    watcher.refresh()
+
+    assert len(watcher.changes) == 2
+
+
+def test_rewritten_file_is_read_from_the_start(
+    data_dir,
+    watcher,
+):
+
+    day = past_day(1)
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(2),
+        ],
+    )
+
+    watcher.refresh()
+
+    write_day(
+        data_dir,
+        day,
+        [anteraja_barcode(3)],
+        mode="w",
+    )
+
+    watcher.refresh([day])
+
+    assert watcher.changes[-1][:3] == (
+        day,
+        [anteraja_barcode(3)],
+        0,
+    )
+
+
+def test_partial_last_row_waits_for_its_line_break(
+    data_dir,
+    watcher,
+):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, [anteraja_barcode(1)])
+
+    watcher.refresh()
+
+    file_path = scan_storage.day_file(data_dir, day)
+
+    row = (
+        ",".join(
+            scan_storage.storage_row(
+                anteraja_barcode(2),
+                f"{day}T10:00:00",
+            )
+        )
+        + "\r\n"
+    ).encode("utf-8")
+
+    with open(file_path, "ab") as file:
+        file.write(row[:10])
+
+    watcher.refresh()
+
+    assert len(watcher.changes) == 1
+
+    with open(file_path, "ab") as file:
+        file.write(row[10:])
+
+    watcher.refresh()
+
+    assert watcher.changes[-1][1] == [
+        anteraja_barcode(2),
+    ]
+
+
+# =========================================================
+# SUBSCRIBERS
+# =========================================================
+
+def test_registry_ingests_rows_from_other_stations(
+    data_dir,
+    open_registry,
+    monkeypatch,
+):
+
+    monkeypatch.setattr(
+        scan_registry,
+        "WATCH_DATA_DIR",
+        True,
+    )
+
+    day = past_day(1)
+
+    registry = open_registry()
+
+    # Copied in from another station.
+    write_day(data_dir, day, [anteraja_barcode(7)])
+
+    registry.watcher.refresh()
+
+    results = registry.process_batch(
+        [anteraja_barcode(7)]
+    )
+
+    assert results[0]["status"] == "duplicate"
+
+    registry.close()
+
+    registry.watcher.close()
+
+
+@pytest.fixture
+def day_frames(data_dir):
+
+    frames = scan_history.DayFrames()
+
+    yield frames
+
+    frames.watcher.close()
+
+
+def test_day_frames_extend_on_append(data_dir, day_frames):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, [anteraja_barcode(1)])
+
+    first = day_frames.get(day)
+
+    write_day(data_dir, day, [anteraja_barcode(2)])
+
+    frame = day_frames.get(day)
+
+    assert first is not frame
+    assert list(frame["Barcode_ID"]) == [
+        anteraja_barcode(1),
+        anteraja_barcode(2),
+    ]
+
+    # Extended in place, not read again.
+    assert day_frames.frames[day][2] == os.path.getsize(
+        scan_storage.day_file(data_dir, day)
+    )
+
+
+def test_day_frames_drop_rewritten_day(data_dir, day_frames):
+
+    day = past_day(1)
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(2),
+        ],
+    )
+
+    day_frames.get(day)
+
+    write_day(
+        data_dir,
+        day,
+        [anteraja_barcode(3)],
+        mode="w",
+    )
+
+    day_frames.watcher.refresh([day])
+
+    assert day not in day_frames.frames
+
+    frame = day_frames.get(day)
+
+    assert list(frame["Barcode_ID"]) == [
+        anteraja_barcode(3),
+    ]
+    assert frame["Timestamp"].iloc[0] == (
+        datetime.datetime.fromisoformat(
+            f"{day}T09:00:00"
+        )
+    )
@@ -0,0 +1,265 @@
+import io
+import os
+
+import pytest
+
+import archive_history
+import import_scans
+import scan_registry
+import scan_storage
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# IMPORT FILE ROWS
+# =========================================================
+
+def test_import_rows_accept_every_line_form():
+
+    day = past_day(1)
+
+    stored = ",".join(
+        scan_storage.checksummed_row(
+            anteraja_barcode(3),
+            f"{day}T09:00:00",
+        )
+    )
+
+    lines = "\n".join(
+        [
+            anteraja_barcode(1),
+            "",
+            " , ",
+            f"{anteraja_barcode(2)},{day}T08:00:00",
+            stored,
+            "a,b,c,d,e",
+        ]
+    )
+
+    assert [
+        (scan, timestamp)
+        for _, scan, timestamp in import_scans.iter_import_rows(
+            io.StringIO(lines),
+            "DEFAULT",
+        )
+    ] == [
+        (anteraja_barcode(1), "DEFAULT"),
+        (anteraja_barcode(2), f"{day}T08:00:00"),
+        (anteraja_barcode(3), f"{day}T09:00:00"),
+        (None, None),
+    ]
+
+
+# =========================================================
+# IMPORTING INTO THE REGISTRY
+# =========================================================
+
+def run_import(lines, registry, **kwargs):
+
+    return import_scans.import_scans(
+        io.StringIO(
+            "\n".join(lines)
+        ),
+        registry,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize(
+    "chunk_size",
+    [
+        1,
+        2,
+        import_scans.CHUNK_SIZE,
+    ],
+)
+def test_import_keeps_times_and_skips_duplicates(
+    data_dir,
+    open_registry,
+    chunk_size,
+):
+
+    write_day(
+        data_dir,
+        past_day(3),
+        [anteraja_barcode(1)],
+    )
+
+    registry = open_registry()
+
+    summary = run_import(
+        [
+            # Already in the history.
+            f"{anteraja_barcode(1)},{past_day(2)}T10:00:00",
+            f"{anteraja_barcode(2)},{past_day(2)}T10:00:00",
+            # Twice in the dump.
+            f"{anteraja_barcode(2)},{past_day(1)}T10:00:00",
+            # Two glued reads.
+            (
+                f"{anteraja_barcode(3)}{anteraja_barcode(4)},"
+                f"{past_day(1)}T11:00:00"
+            ),
+        ],
+        registry,
+        chunk_size=chunk_size,
+    )
+
+    assert summary["lines"] == 4
+    assert summary["accepted"] == 3
+    assert summary["duplicate"] == 2
+    assert summary["invalid"] == 0
+    assert summary["days"] == {
+        past_day(2): 1,
+        past_day(1): 2,
+    }
+
+    registry.close()
+
+    assert [
+        row
+        for row in scan_storage.read_scan_rows(
+            scan_storage.day_file(
+                data_dir,
+                past_day(1),
+            )
+        )
+    ] == [
+        (
+            anteraja_barcode(3),
+            f"{past_day(1)}T11:00:00",
+        ),
+        (
+            anteraja_barcode(4),
+            f"{past_day(1)}T11:00:00",
+        ),
+    ]
+
+
+def test_invalid_lines_are_counted_and_saved(
+    data_dir,
+    open_registry,
+):
+
+    registry = open_registry()
+
+    summary = run_import(
+        [
+            # No timestamp and no default.
+            anteraja_barcode(1),
+            f"{anteraja_barcode(2)},not a time",
+            f"{anteraja_barcode(3)},{past_day(-3)}T10:00:00",
+            f"NOT-A-BARCODE,{past_day(1)}T10:00:00",
+            f"{anteraja_barcode(4)},{past_day(1)}T10:00:00",
+        ],
+        registry,
+        source_name="dump.csv",
+    )
+
+    assert summary["accepted"] == 1
+    assert summary["invalid"] == 4
+
+    assert os.path.dirname(
+        summary["saved_to"]
+    ) == os.path.join(
+        scan_registry.DATA_DIR,
+        scan_storage.RECOVERY_DIRNAME,
+    )
+
+    with open(summary["saved_to"], encoding="utf-8") as file:
+        assert len(file.read().splitlines()) == 4
+
+
+def test_default_timestamp_fills_bare_lines(
+    data_dir,
+    open_registry,
+):
+
+    registry = open_registry()
+
+    summary = run_import(
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(2),
+        ],
+        registry,
+        default_timestamp=f"{past_day(1)}T07:00:00",
+    )
+
+    assert summary["days"] == {
+        past_day(1): 2,
+    }
+
+
+def test_archived_days_are_skipped(
+    data_dir,
+    open_registry,
+):
+
+    write_day(
+        data_dir,
+        past_day(60),
+        [anteraja_barcode(1)],
+    )
+
+    archive_history.archive_history(
+        data_dir,
+        older_than=30,
+    )
+
+    registry = open_registry()
+
+    summary = run_import(
+        [
+            f"{anteraja_barcode(2)},{past_day(60)}T10:00:00",
+            f"{anteraja_barcode(3)},{past_day(1)}T10:00:00",
+        ],
+        registry,
+    )
+
+    assert summary["archived"] == 1
+    assert summary["accepted"] == 1
+
+    assert len(
+        scan_storage.read_scan_rows(
+            scan_storage.day_file(
+                data_dir,
+                past_day(60),
+            )
+        )
+    ) == 1
+
+
+def test_old_scans_go_to_the_cold_index(
+    data_dir,
+    open_registry,
+    monkeypatch,
+):
+
+    monkeypatch.setattr(
+        scan_registry,
+        "HOT_DAYS",
+        3,
+    )
+
+    registry = open_registry()
+
+    summary = run_import(
+        [
+            f"{anteraja_barcode(1)},{past_day(10)}T10:00:00",
+        ],
+        registry,
+    )
+
+    assert summary["accepted"] == 1
+
+    registry.close()
+
+    registry = open_registry()
+
+    assert past_day(10) in registry.cold.days
+    assert len(registry.codes) == 0
+
+    assert registry.process_batch(
+        [anteraja_barcode(1)]
+    )[0]["status"] == "duplicate"
@@ -0,0 +1,203 @@
+import pytest
+
+import scan_registry
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# INCREMENTAL REFRESH
+# =========================================================
+#
+# BarcodeRegistry.refresh() reconciles a live registry with
+# data/ by high-water marks instead of loading it again.
+
+@pytest.fixture
+def registry(data_dir, open_registry):
+
+    write_day(
+        data_dir,
+        past_day(1),
+        [anteraja_barcode(1)],
+    )
+    write_day(
+        data_dir,
+        past_day(2),
+        [anteraja_barcode(2)],
+    )
+
+    return open_registry()
+
+
+def statuses(registry, barcodes):
+
+    return [
+        result["status"]
+        for result in registry.process_batch(barcodes)
+    ]
+
+
+def test_unchanged_files_are_not_read(registry):
+
+    report = registry.refresh()
+
+    assert report["checked"] == 2
+    assert report["read"] == []
+
+
+def test_appended_day_is_read_from_its_mark(
+    data_dir,
+    registry,
+):
+
+    write_day(
+        data_dir,
+        past_day(2),
+        [anteraja_barcode(20)],
+    )
+
+    assert registry.refresh()["read"] == [
+        past_day(2),
+    ]
+
+    assert statuses(
+        registry,
+        [
+            anteraja_barcode(2),
+            anteraja_barcode(20),
+            anteraja_barcode(21),
+        ],
+    ) == [
+        "duplicate",
+        "duplicate",
+        "success",
+    ]
+
+    # Today's file is merged, so the registry's own scans
+    # are not counted twice; after that it is current.
+    registry.refresh()
+
+    assert len(registry.get_today_records()) == 1
+    assert registry.refresh()["read"] == []
+
+
+def test_new_and_rewritten_days_are_read(
+    data_dir,
+    registry,
+):
+
+    write_day(
+        data_dir,
+        past_day(3),
+        [anteraja_barcode(30)],
+    )
+    write_day(
+        data_dir,
+        past_day(1),
+        [anteraja_barcode(10)],
+        mode="w",
+    )
+
+    assert sorted(registry.refresh()["read"]) == [
+        past_day(3),
+        past_day(1),
+    ]
+
+    assert statuses(
+        registry,
+        [
+            anteraja_barcode(30),
+            anteraja_barcode(10),
+        ],
+    ) == [
+        "duplicate",
+        "duplicate",
+    ]
+
+
+def test_cold_tier_gets_only_the_missing_days(
+    data_dir,
+    open_registry,
+    monkeypatch,
+):
+
+    monkeypatch.setattr(
+        scan_registry,
+        "HOT_DAYS",
+        3,
+    )
+
+    write_day(
+        data_dir,
+        past_day(10),
+        [anteraja_barcode(1)],
+    )
+
+    registry = open_registry()
+
+    first_path = registry.cold.path
+
+    registry.refresh()
+
+    assert registry.cold.path == first_path
+
+    write_day(
+        data_dir,
+        past_day(11),
+        [anteraja_barcode(2)],
+    )
+
+    report = registry.refresh()
+
+    assert report["read"] == []
+    assert registry.cold.path != first_path
+    assert set(registry.cold.days) == {
+        past_day(10),
+        past_day(11),
+    }
+
+    assert statuses(
+        registry,
+        [
+            anteraja_barcode(1),
+            anteraja_barcode(2),
+        ],
+    ) == [
+        "duplicate",
+        "duplicate",
+    ]
+
+
+def test_live_registry_is_refreshed_not_rebuilt(
+    data_dir,
+    monkeypatch,
+):
+
+    monkeypatch.setattr(
+        scan_registry,
+        "_live_registries",
+        {},
+    )
+
+    registry = scan_registry.live_registry()
+
+    try:
+
+        write_day(
+            data_dir,
+            past_day(1),
+            [anteraja_barcode(5)],
+        )
+
+        assert scan_registry.live_registry() is registry
+
+        assert statuses(
+            registry,
+            [anteraja_barcode(5)],
+        ) == [
+            "duplicate",
+        ]
+
+    finally:
+
+        registry.close()
@@ -0,0 +1,322 @@
+import io
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+import registry_server
+
+from conftest import anteraja_barcode, past_day
+
+
+# =========================================================
+# MESSAGE FRAMING
+# =========================================================
+
+def test_messages_round_trip():
+
+    stream = io.BytesIO()
+
+    registry_server.write_message(
+        stream,
+        {"method": "refresh", "params": []},
+    )
+    registry_server.write_message(
+        stream,
+        {"result": ["ü", 1]},
+    )
+
+    stream.seek(0)
+
+    assert registry_server.read_message(stream) == {
+        "method": "refresh",
+        "params": [],
+    }
+    assert registry_server.read_message(stream) == {
+        "result": ["ü", 1],
+    }
+
+    # Peer closed.
+    assert registry_server.read_message(stream) is None
+
+
+def test_truncated_message_reads_as_closed():
+
+    stream = io.BytesIO()
+
+    registry_server.write_message(
+        stream,
+        {"method": "refresh"},
+    )
+
+    stream = io.BytesIO(stream.getvalue()[:-2])
+
+    assert registry_server.read_message(stream) is None
+
+
+def test_oversized_message_is_refused():
+
+    stream = io.BytesIO(
+        registry_server.MESSAGE_HEADER.pack(
+            registry_server.MAX_MESSAGE_BYTES + 1
+        )
+    )
+
+    with pytest.raises(ValueError):
+        registry_server.read_message(stream)
+
+
+def test_parse_address():
+
+    assert registry_server.parse_address(
+        "127.0.0.1:8765"
+    ) == (
+        socket.AF_INET,
+        ("127.0.0.1", 8765),
+    )
+
+    assert registry_server.parse_address(
+        ":9000"
+    ) == (
+        socket.AF_INET,
+        ("127.0.0.1", 9000),
+    )
+
+
+# =========================================================
+# DISPATCH AND TOKEN CHECK
+# =========================================================
+
+class FakeRegistry:
+
+    recovery_report = []
+
+    def get_total_successful_scans(self):
+        return 42
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def tcp_server():
+
+    server = registry_server.RegistryServer(
+        FakeRegistry(),
+        "127.0.0.1:0",
+        token="s3cret",
+    )
+
+    yield server
+
+    server.server.server_close()
+
+
+def test_tcp_server_needs_token():
+
+    with pytest.raises(ValueError):
+
+        registry_server.RegistryServer(
+            FakeRegistry(),
+            "127.0.0.1:0",
+            token="",
+        )
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        None,
+        "",
+        "s3cre",
+        "s3cret ",
+        12,
+    ],
+)
+def test_wrong_token_is_refused(tcp_server, token):
+
+    request = {
+        "method": "get_total_successful_scans",
+    }
+
+    if token is not None:
+        request["token"] = token
+
+    assert tcp_server.dispatch(request) == {
+        "error": "Invalid registry token.",
+    }
+
+
+def test_only_registry_methods_are_served(tcp_server):
+
+    for method in (
+        "close",
+        "__init__",
+        "_lookup_stored",
+        None,
+    ):
+
+        assert "error" in tcp_server.dispatch(
+            {
+                "method": method,
+                "token": "s3cret",
+            }
+        )
+
+    assert tcp_server.dispatch(
+        {
+            "method": "get_total_successful_scans",
+            "token": "s3cret",
+        }
+    ) == {
+        "result": 42,
+    }
+
+    assert tcp_server.dispatch(
+        {
+            "method": "get_recovery_report",
+            "token": "s3cret",
+        }
+    ) == {
+        "result": [],
+    }
+
+
+# =========================================================
+# END TO END
+# =========================================================
+
+def serve(server):
+
+    thread = threading.Thread(
+        target=server.serve_forever,
+        daemon=True,
+    )
+
+    thread.start()
+
+    return thread
+
+
+def test_client_scans_through_tcp_server(
+    data_dir,
+    open_registry,
+):
+
+    server = registry_server.RegistryServer(
+        open_registry(),
+        "127.0.0.1:0",
+        token="s3cret",
+    )
+
+    serve(server)
+
+    host, port = server.server.server_address
+
+    client = registry_server.RegistryClient(
+        f"{host}:{port}",
+        token="s3cret",
+    )
+
+    try:
+
+        results = client.process_batch(
+            [
+                anteraja_barcode(1),
+                anteraja_barcode(1),
+                "10000",
+            ]
+        )
+
+        assert [
+            result["status"]
+            for result in results
+        ] == [
+            "success",
+            "duplicate",
+            "invalid",
+        ]
+
+        # Imports send timestamps; the server checks
+        # them as well.
+        results = client.process_batch(
+            [
+                anteraja_barcode(2),
+                anteraja_barcode(3),
+            ],
+            [
+                f"{past_day(1)}T10:00:00",
+                f"{past_day(-2)}T10:00:00",
+            ],
+        )
+
+        assert [
+            result["status"]
+            for result in results
+        ] == [
+            "success",
+            "invalid",
+        ]
+
+        assert client.get_total_successful_scans() == 2
+
+        intruder = registry_server.RegistryClient(
+            f"{host}:{port}",
+            token="guess",
+        )
+
+        with pytest.raises(RuntimeError):
+            intruder.get_total_successful_scans()
+
+        intruder.close()
+
+    finally:
+
+        client.close()
+        server.close()
+
+
+@pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"),
+    reason="no Unix sockets",
+)
+def test_unix_socket_is_private(
+    data_dir,
+    open_registry,
+):
+
+    socket_path = os.path.join(
+        data_dir,
+        "registry.sock",
+    )
+
+    server = registry_server.RegistryServer(
+        open_registry(),
+        f"unix:{socket_path}",
+        token="",
+    )
+
+    serve(server)
+
+    try:
+
+        assert stat.S_IMODE(
+            os.stat(socket_path).st_mode
+        ) == registry_server.UNIX_SOCKET_MODE
+
+        client = registry_server.RegistryClient(
+            f"unix:{socket_path}",
+            token="",
+        )
+
+        assert client.get_total_successful_scans() == 0
+
+        client.close()
+
+    finally:
+
+        server.close()
+
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,233 @@
+import os
+
+import pytest
+
+import barcode_index
+import registry_snapshot
+import scan_registry
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# SNAPSHOT FILE
+# =========================================================
+
+MARKS = {
+    "2026-01-02": {
+        "offset": 120,
+        "size": 120,
+        "mtime": 1.5,
+        "tail_crc": 7,
+    },
+}
+
+
+def test_compact_index_round_trips(tmp_path):
+
+    codes = barcode_index.CompactBarcodeIndex()
+
+    codes.update_records(
+        [
+            (
+                anteraja_barcode(number),
+                f"2026-01-02T09:00:{number:02d}",
+            )
+            for number in range(50)
+        ]
+        + [
+            # No codec: kept in the dict part.
+            (
+                "NOT-A-COURIER",
+                "2026-01-02T10:00:00",
+            ),
+        ]
+    )
+
+    snapshot_path = str(tmp_path / "registry.snapshot")
+
+    registry_snapshot.save_snapshot(
+        snapshot_path,
+        codes,
+        MARKS,
+    )
+
+    loaded, marks = registry_snapshot.load_snapshot(
+        snapshot_path
+    )
+
+    assert marks == MARKS
+    assert len(loaded) == len(codes)
+    assert dict(loaded.items()) == dict(codes.items())
+
+
+def test_dict_index_round_trips(tmp_path):
+
+    codes = {
+        anteraja_barcode(1): "2026-01-02T09:00:00",
+    }
+
+    snapshot_path = str(tmp_path / "registry.snapshot")
+
+    registry_snapshot.save_snapshot(
+        snapshot_path,
+        codes,
+        MARKS,
+    )
+
+    assert registry_snapshot.load_snapshot(
+        snapshot_path
+    ) == (codes, MARKS)
+
+
+@pytest.mark.parametrize(
+    "damage",
+    [
+        "truncate",
+        "flip",
+        "magic",
+    ],
+)
+def test_damaged_snapshot_is_ignored(tmp_path, damage):
+
+    codes = barcode_index.CompactBarcodeIndex()
+
+    codes.update_records(
+        [
+            (
+                anteraja_barcode(number),
+                "2026-01-02T09:00:00",
+            )
+            for number in range(50)
+        ]
+    )
+
+    snapshot_path = str(tmp_path / "registry.snapshot")
+
+    registry_snapshot.save_snapshot(
+        snapshot_path,
+        codes,
+        MARKS,
+    )
+
+    with open(snapshot_path, "rb") as file:
+        content = bytearray(file.read())
+
+    if damage == "truncate":
+        content = content[:-9]
+    elif damage == "flip":
+        content[-1] ^= 0xFF
+    else:
+        content[:4] = b"PKL0"
+
+    with open(snapshot_path, "wb") as file:
+        file.write(content)
+
+    assert registry_snapshot.load_snapshot(
+        snapshot_path
+    ) is None
+
+
+# =========================================================
+# REPLAY ON STARTUP
+# =========================================================
+
+def test_startup_replays_bytes_appended_after_snapshot(
+    data_dir,
+    open_registry,
+):
+
+    day = past_day(2)
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(number)
+            for number in range(10)
+        ],
+    )
+
+    open_registry().close()
+
+    assert os.path.exists(
+        scan_registry.SNAPSHOT_FILE
+    )
+
+    # Appended by another station after the snapshot.
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(100),
+        ],
+    )
+
+    registry = open_registry()
+
+    assert registry.load_stats["mode"] == "snapshot"
+
+    results = registry.process_batch(
+        [
+            anteraja_barcode(3),
+            anteraja_barcode(100),
+            anteraja_barcode(200),
+        ]
+    )
+
+    assert [
+        result["status"]
+        for result in results
+    ] == [
+        "duplicate",
+        "duplicate",
+        "success",
+    ]
+
+
+def test_rewritten_day_forces_full_load(
+    data_dir,
+    open_registry,
+):
+
+    day = past_day(2)
+
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(number)
+            for number in range(10)
+        ],
+    )
+
+    open_registry().close()
+
+    # Replaced, not appended: the marks no longer hold.
+    write_day(
+        data_dir,
+        day,
+        [
+            anteraja_barcode(500),
+        ],
+        mode="w",
+    )
+
+    registry = open_registry()
+
+    assert registry.load_stats["mode"] == "full"
+
+    results = registry.process_batch(
+        [
+            anteraja_barcode(3),
+            anteraja_barcode(500),
+        ]
+    )
+
+    assert [
+        result["status"]
+        for result in results
+    ] == [
+        "success",
+        "duplicate",
+    ]
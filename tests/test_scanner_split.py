@@ -0,0 +1,331 @@
+import random
+import re
+
+import pytest
+
+import courier_rules
+import scan_registry
+
+
+# =========================================================
+# REFERENCE IMPLEMENTATIONS
+# =========================================================
+#
+# The splitter before the prefix trie (scan_registry.py
+# before the in-place rewrite): slices the remainder at
+# every position and checks the three default formats with
+# anchored patterns.
+
+SHOPEE_PREFIX = "SPXID06"
+SHOPEE_LENGTH = 17
+
+JNT_PREFIX = "J"
+JNT_LENGTH = 12
+
+ANTERAJA_PREFIX = "1"
+ANTERAJA_LENGTH = 14
+
+SHOPEE_PATTERN = re.compile(r"^SPXID06\d{10}$")
+JNT_PATTERN = re.compile(r"^J[A-Z0-9]{11}$")
+ANTERAJA_PATTERN = re.compile(r"^1\d{13}$")
+
+
+def reference_parse_scanner_input(raw_input):
+
+    if raw_input is None:
+        return []
+
+    cleaned = re.sub(
+        r"\s+",
+        "",
+        str(raw_input),
+    ).upper()
+
+    if not cleaned:
+        return []
+
+    barcodes = []
+    position = 0
+
+    while position < len(cleaned):
+
+        remaining = cleaned[position:]
+
+        for prefix, length, pattern in (
+            (SHOPEE_PREFIX, SHOPEE_LENGTH, SHOPEE_PATTERN),
+            (JNT_PREFIX, JNT_LENGTH, JNT_PATTERN),
+            (ANTERAJA_PREFIX, ANTERAJA_LENGTH, ANTERAJA_PATTERN),
+        ):
+
+            if not remaining.startswith(prefix):
+                continue
+
+            if len(remaining) < length:
+                return []
+
+            candidate = remaining[:length]
+
+            if not pattern.fullmatch(candidate):
+                return []
+
+            break
+
+        else:
+            return []
+
+        barcodes.append(candidate)
+
+        position += length
+
+    return barcodes
+
+
+def reference_split(rules, cleaned):
+    """
+    The same slicing walk for any rule list: longest prefix
+    first, then file order, as courier_rules documents.
+    """
+
+    ordered = sorted(
+        rules,
+        key=lambda rule: -len(rule.prefix),
+    )
+
+    barcodes = []
+    position = 0
+
+    while position < len(cleaned):
+
+        remaining = cleaned[position:]
+
+        for rule in ordered:
+
+            candidate = remaining[:rule.length]
+
+            if (
+                remaining.startswith(rule.prefix)
+                and len(candidate) == rule.length
+                and re.fullmatch(
+                    f"{re.escape(rule.prefix)}"
+                    f"{rule.body.pattern}",
+                    candidate,
+                )
+            ):
+                break
+
+        else:
+            return []
+
+        barcodes.append(candidate)
+
+        position += rule.length
+
+    return barcodes
+
+
+# =========================================================
+# INPUTS
+# =========================================================
+
+DEFAULT_MATCHER = courier_rules.CourierMatcher(
+    courier_rules.CourierRule(**entry)
+    for entry in courier_rules.DEFAULT_COURIERS
+)
+
+SHOPEE = "SPXID061234567890"
+JNT = "J1234ABCD567"
+ANTERAJA = "12345678901234"
+
+EDGE_INPUTS = [
+    None,
+    "",
+    "   ",
+    "\t\n",
+    SHOPEE,
+    SHOPEE.lower(),
+    JNT.lower(),
+    f"  {SHOPEE}\n",
+    f"{SHOPEE} {JNT}\t{ANTERAJA}",
+    SHOPEE + JNT + ANTERAJA,
+    ANTERAJA + ANTERAJA,
+    # trailing partial blocks
+    SHOPEE + SHOPEE[:10],
+    JNT + "J123",
+    ANTERAJA + "1",
+    SHOPEE[:6],
+    "SPXID06",
+    "J",
+    "1",
+    # a prefix followed by a bad body
+    "SPXID06123456789X",
+    "J1234ABCD56!",
+    "1234567890123A",
+    # overlapping prefixes: "1" inside Shopee digits, "J"
+    # inside a J&T body
+    "SPXID061" + "1" * 9,
+    "J" + "J" * 11,
+    "SPX" + JNT,
+    "X" + SHOPEE,
+    SHOPEE + "X",
+    "١" * 14,
+]
+
+
+def fuzz_inputs(count, seed):
+
+    rnd = random.Random(seed)
+
+    blocks = [
+        lambda: "SPXID06" + "".join(
+            rnd.choice("0123456789") for _ in range(10)
+        ),
+        lambda: "J" + "".join(
+            rnd.choice("0123456789ABCXYZ") for _ in range(11)
+        ),
+        lambda: "1" + "".join(
+            rnd.choice("0123456789") for _ in range(13)
+        ),
+    ]
+
+    for _ in range(count):
+
+        parts = [
+            rnd.choice(blocks)()
+            for _ in range(rnd.randrange(1, 6))
+        ]
+
+        text = "".join(parts)
+
+        mutation = rnd.random()
+
+        if mutation < 0.2 and text:
+
+            # drop a character
+            index = rnd.randrange(len(text))
+            text = text[:index] + text[index + 1:]
+
+        elif mutation < 0.4:
+
+            # insert noise
+            index = rnd.randrange(len(text) + 1)
+            text = (
+                text[:index]
+                + rnd.choice("XJ1S! 0a\t")
+                + text[index:]
+            )
+
+        elif mutation < 0.5:
+
+            # cut a trailing partial block
+            text = text[:rnd.randrange(len(text) + 1)]
+
+        elif mutation < 0.7:
+
+            # whitespace between the reads
+            text = rnd.choice([" ", "\n", "\t "]).join(parts)
+
+        if rnd.random() < 0.3:
+            text = text.lower()
+
+        yield text
+
+
+def random_rules(rnd):
+
+    rules = []
+
+    for index in range(rnd.randrange(1, 7)):
+
+        prefix = "".join(
+            rnd.choice("01JSP")
+            for _ in range(rnd.randrange(1, 4))
+        )
+
+        rules.append(
+            courier_rules.CourierRule(
+                f"Courier {index % 3}",
+                prefix,
+                len(prefix) + rnd.randrange(1, 5),
+                rnd.choice(sorted(courier_rules.CHARSETS)),
+            )
+        )
+
+    return rules
+
+
+# =========================================================
+# CONFORMANCE
+# =========================================================
+
+@pytest.mark.parametrize(
+    "raw_input",
+    EDGE_INPUTS,
+)
+def test_edge_inputs_match_reference(raw_input):
+
+    expected = reference_parse_scanner_input(raw_input)
+
+    assert DEFAULT_MATCHER.split(
+        scan_registry.clean_scanner_input(raw_input)
+    ) == expected
+
+
+def test_fuzzed_bursts_match_reference():
+
+    for raw_input in fuzz_inputs(5000, seed=21):
+
+        assert DEFAULT_MATCHER.split(
+            scan_registry.clean_scanner_input(raw_input)
+        ) == reference_parse_scanner_input(
+            raw_input
+        ), raw_input
+
+
+def test_parse_scanner_input_matches_reference():
+
+    # The shipped couriers.json holds the default formats.
+    if [
+        (rule.name, rule.prefix, rule.length, rule.charset)
+        for rule in scan_registry.COURIERS.rules
+    ] != [
+        (rule.name, rule.prefix, rule.length, rule.charset)
+        for rule in DEFAULT_MATCHER.rules
+    ]:
+        pytest.skip("a custom courier config is loaded")
+
+    for raw_input in EDGE_INPUTS + list(
+        fuzz_inputs(1000, seed=22)
+    ):
+
+        assert scan_registry.parse_scanner_input(
+            raw_input
+        ) == reference_parse_scanner_input(
+            raw_input
+        ), raw_input
+
+
+def test_overlapping_prefixes_match_reference():
+
+    rnd = random.Random(23)
+
+    for _ in range(300):
+
+        rules = random_rules(rnd)
+
+        matcher = courier_rules.CourierMatcher(rules)
+
+        for _ in range(30):
+
+            text = "".join(
+                rnd.choice(rules).prefix
+                + "".join(
+                    rnd.choice("0123456789AZ")
+                    for _ in range(rnd.randrange(0, 5))
+                )
+                for _ in range(rnd.randrange(0, 5))
+            )
+
+            assert matcher.split(text) == reference_split(
+                rules,
+                text,
+            ), (text, [vars(rule) for rule in rules])
@@ -0,0 +1,177 @@
+import os
+
+import scan_registry
+import scan_storage
+
+from conftest import anteraja_barcode, past_day, write_day
+
+
+# =========================================================
+# TORN TAIL RECOVERY
+# =========================================================
+#
+# A crash mid-append leaves part of a row (CSV) or record
+# (journal) at the end of a day file. recover_day_file()
+# cuts it off and saves it under data/recovered/.
+
+BARCODES = [
+    anteraja_barcode(number)
+    for number in range(5)
+]
+
+
+def csv_path(data_dir, day):
+
+    return os.path.join(
+        data_dir,
+        f"{day}{scan_storage.CSV_EXTENSION}",
+    )
+
+
+def test_intact_csv_is_left_alone(data_dir):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, BARCODES)
+
+    file_path = csv_path(data_dir, day)
+
+    size = os.path.getsize(file_path)
+
+    assert scan_storage.recover_day_file(file_path) is None
+    assert os.path.getsize(file_path) == size
+
+
+def test_torn_csv_row_is_cut_and_saved(data_dir):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, BARCODES)
+
+    file_path = csv_path(data_dir, day)
+
+    intact_size = os.path.getsize(file_path)
+
+    with open(file_path, "ab") as file:
+        file.write(b"10000000009999,2026-01-0")
+
+    report = scan_storage.recover_day_file(file_path)
+
+    assert report["kept_bytes"] == intact_size
+    assert report["discarded_bytes"] == len(
+        b"10000000009999,2026-01-0"
+    )
+    assert os.path.getsize(file_path) == intact_size
+
+    with open(report["saved_to"], "rb") as file:
+        assert file.read() == b"10000000009999,2026-01-0"
+
+    assert [
+        barcode
+        for barcode, _ in scan_storage.read_scan_rows(
+            file_path
+        )
+    ] == BARCODES
+
+
+def test_row_missing_only_its_line_break_is_kept(data_dir):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, BARCODES)
+
+    file_path = csv_path(data_dir, day)
+
+    with open(file_path, "rb") as file:
+        content = file.read()
+
+    with open(file_path, "wb") as file:
+        file.write(content.rstrip(b"\r\n"))
+
+    assert scan_storage.recover_day_file(file_path) is None
+
+    with open(file_path, "rb") as file:
+        assert file.read() == content
+
+    write_day(data_dir, day, [anteraja_barcode(9)])
+
+    assert len(
+        scan_storage.read_scan_rows(file_path)
+    ) == len(BARCODES) + 1
+
+
+def test_torn_journal_record_is_cut(data_dir):
+
+    day = past_day(1)
+
+    file_path = os.path.join(
+        data_dir,
+        f"{day}{scan_storage.JOURNAL_EXTENSION}",
+    )
+
+    records = [
+        scan_storage.encode_journal_record(
+            barcode,
+            f"{day}T09:00:0{position}",
+        )
+        for position, barcode in enumerate(BARCODES)
+    ]
+
+    with open(file_path, "wb") as file:
+        file.write(
+            scan_storage.JOURNAL_MAGIC
+            + b"".join(records)
+            + records[0][:-3]
+        )
+
+    report = scan_storage.recover_day_file(file_path)
+
+    assert report["discarded_bytes"] == len(records[0]) - 3
+
+    assert [
+        barcode
+        for barcode, _ in scan_storage.read_scan_rows(
+            file_path
+        )
+    ] == BARCODES
+
+
+def test_registry_recovers_before_loading(
+    data_dir,
+    open_registry,
+):
+
+    day = past_day(1)
+
+    write_day(data_dir, day, BARCODES)
+
+    with open(csv_path(data_dir, day), "ab") as file:
+        file.write(b"1000000000")
+
+    registry = open_registry()
+
+    assert [
+        report["file"]
+        for report in registry.recovery_report
+    ] == [
+        os.path.join(
+            scan_registry.DATA_DIR,
+            f"{day}{scan_storage.CSV_EXTENSION}",
+        ),
+    ]
+
+    results = registry.process_batch(
+        [
+            BARCODES[0],
+            anteraja_barcode(10),
+        ]
+    )
+
+    assert [
+        result["status"]
+        for result in results
+    ] == [
+        "duplicate",
+        "success",
+    ]
+